@@ -16,6 +16,8 @@ from PyQt5.QtCore import Qt
 
 from helper_functions import calc_zoom_in_factor, calc_zoom_out_factor
 from lib.vectors import Triangle, Vector3
+from lib.collision import Collision
+from lib.collision_mesh import CollisionMesh
 ENTITY_SIZE = 10
 
 DEFAULT_ENTITY = QColor("black")
@@ -202,7 +204,7 @@ class MapViewer(QWidget):
         self.move_startpos = []
 
     def set_collision(self, verts, faces):
-        self.collision = Collision(verts, faces)
+        self.collision = Collision(CollisionMesh.from_obj_faces(verts, faces))
 
     def set_mouse_mode(self, mode):
         assert mode in (MOUSE_MODE_NONE, MOUSE_MODE_ADDWP, MOUSE_MODE_CONNECTWP, MOUSE_MODE_MOVEWP)
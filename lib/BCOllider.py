@@ -3,8 +3,16 @@
 import subprocess
 from struct import unpack_from, pack
 
+from numpy import frombuffer, dtype
+
 from .BCOnvert import (normalize_vector, create_vector, cross_product,
                         write_float, write_uint32, write_short)
+from .collision_mesh import CollisionMesh
+
+
+# Triangle entries of 0x24 bytes, only the vertex indices and the collision type are interpreted
+TRIANGLE_DTYPE = dtype([("vertices", ">i4", (3,)), ("unknown", "V10"), ("collision_type", ">u2"), ("rest", "V12")])
+VERTEX_DTYPE = dtype((">f4", (3,)))
 
 
 def read_array(buffer, offset, length):
@@ -51,8 +59,10 @@ class RacetrackCollision(object):
         self.unknownoffset = 0
 
         self.grids = []
-        self.triangles = []
-        self.vertices = []
+        # Structured array of the triangle entries (see TRIANGLE_DTYPE) and the mesh made of them
+        self.triangles = frombuffer(b"", dtype=TRIANGLE_DTYPE)
+        self.mesh = CollisionMesh([], [])
+        self.vertices = self.mesh.vertices
 
     def load_file(self, f):
         data = f.read()
@@ -84,38 +94,22 @@ class RacetrackCollision(object):
         # Parse triangles
         trianglescount = (self.verticesoffset-self.trianglesoffset) // 0x24
         print((self.verticesoffset-self.trianglesoffset)%0x24)
-
-        for i in range(trianglescount):
-            v1 = read_int32(data, self.trianglesoffset+i*0x24 + 0x00)
-            v2 = read_int32(data, self.trianglesoffset+i*0x24 + 0x04)
-            v3 = read_int32(data, self.trianglesoffset+i*0x24 + 0x08)
-            collision_type = read_uint16(data, self.trianglesoffset+i*0x24 + 0x16)
-            rest = read_array(data, self.trianglesoffset+i*0x24 + 0x0C, length=0x24-0xC)
-            self.triangles.append((v1,v2,v3, collision_type, rest))
+        self.triangles = frombuffer(data, dtype=TRIANGLE_DTYPE, count=trianglescount, offset=self.trianglesoffset)
 
         # Parse vertices
         vertcount = (self.unknownoffset-self.verticesoffset) // 0xC
         print((self.unknownoffset-self.verticesoffset) % 0xC)
+        vertices = frombuffer(data, dtype=VERTEX_DTYPE, count=vertcount, offset=self.verticesoffset)
+
+        self.mesh = CollisionMesh(vertices, self.triangles["vertices"], self.triangles["collision_type"])
+        self.vertices = self.mesh.vertices
 
-        biggestx = biggestz = -99999999
-        smallestx = smallestz = 99999999
-
-        for i in range(vertcount):
-            x = read_float(data, self.verticesoffset + i*0xC + 0x00)
-            y = read_float(data, self.verticesoffset + i*0xC + 0x04)
-            z = read_float(data, self.verticesoffset + i*0xC + 0x08)
-            self.vertices.append((x,y,z))
-
-            if x > biggestx:
-                biggestx = x
-            if x < smallestx:
-                smallestx = x
-
-            if z > biggestz:
-                biggestz = z
-            if z < smallestz:
-                smallestz = z
-            #print(x,y,z)
+        if vertcount > 0:
+            smallestx, smallestz = float(self.vertices[:, 0].min()), float(self.vertices[:, 2].min())
+            biggestx, biggestz = float(self.vertices[:, 0].max()), float(self.vertices[:, 2].max())
+        else:
+            biggestx = biggestz = -99999999
+            smallestx = smallestz = 99999999
         print("smallest/biggest vertex coordinates:",smallestx, smallestz, biggestx, biggestz)
         f.seek(self.unknownoffset)
         self.matentries = []
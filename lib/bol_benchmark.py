@@ -0,0 +1,126 @@
+# Memory use and attribute access timing of loaded BOL files.
+# Run from the editor directory: python -m lib.bol_benchmark [course.bol ...]
+# Without arguments a generated course with 20000 enemy points is used.
+# Every file is measured twice, with the records as they are and as a baseline with records
+# that keep their attributes in a __dict__, like they did before they had __slots__.
+import sys
+import tracemalloc
+from copy import deepcopy
+from timeit import default_timer
+
+from . import libbol
+from .libbol import (BOL, EnemyPointGroup, EnemyPoint, CheckpointGroup, Checkpoint, Route, RoutePoint,
+                     MapObject, Area, Camera, JugemPoint)
+from .vectors import Vector3
+
+
+def generated_course(enemypoints=20000):
+    bol = BOL()
+
+    for i in range(enemypoints):
+        if i % 100 == 0:
+            group = EnemyPointGroup()
+            group.id = len(bol.enemypointgroups.groups)
+            bol.enemypointgroups.groups.append(group)
+        group.points.append(EnemyPoint(Vector3(i*10.0, 0.0, -i*5.0), 0, -1, 1000.0, 0, 0, group.id, 0, 0, 0))
+
+    for i in range(50):
+        group = CheckpointGroup(i)
+        for j in range(40):
+            group.points.append(Checkpoint(Vector3(j, 0.0, i), Vector3(j, 0.0, i+100.0)))
+        bol.checkpoints.groups.append(group)
+
+    for i in range(100):
+        route = Route()
+        for j in range(20):
+            route.points.append(RoutePoint(Vector3(i, j, 0.0)))
+        bol.routes.append(route)
+
+    for i in range(1000):
+        bol.objects.objects.append(MapObject(Vector3(i, 0.0, i), 1))
+    for i in range(100):
+        bol.areas.areas.append(Area(Vector3(i, 0.0, 0.0)))
+        bol.cameras.append(Camera(Vector3(0.0, i, 0.0)))
+        bol.respawnpoints.append(JugemPoint(Vector3(0.0, 0.0, i)))
+
+    return bytes(bol.to_buffer())
+
+
+_dict_classes = {}
+
+
+def dict_class(cls):
+    # Copy of a slotted class whose instances have a __dict__ instead of slots. __deepcopy__
+    # is left out as well, the slotted vectors only have one to make up for slow copying.
+    if cls not in _dict_classes:
+        namespace = {}
+        for base in reversed(cls.__mro__[:-1]):
+            slots = base.__dict__.get("__slots__", ())
+            for name, value in base.__dict__.items():
+                if name not in slots and name not in ("__slots__", "__deepcopy__", "__dict__", "__weakref__"):
+                    namespace[name] = value
+        _dict_classes[cls] = type(cls.__name__, (object,), namespace)
+
+    return _dict_classes[cls]
+
+
+def dict_records(value):
+    # Replaces all slotted records and vectors in value by dict based copies
+    if isinstance(value, list):
+        for i, item in enumerate(value):
+            value[i] = dict_records(item)
+    elif hasattr(type(value), "__slots__") and not hasattr(value, "__dict__"):
+        copy = object.__new__(dict_class(type(value)))
+        for base in type(value).__mro__:
+            for name in base.__dict__.get("__slots__", ()):
+                if hasattr(value, name):
+                    setattr(copy, name, dict_records(getattr(value, name)))
+        return copy
+    elif type(value).__module__ == libbol.__name__ and hasattr(value, "__dict__"):
+        for name, attribute in value.__dict__.items():
+            value.__dict__[name] = dict_records(attribute)
+
+    return value
+
+
+def benchmark(data, name, baseline=False):
+    tracemalloc.start()
+    bol = BOL.from_buffer(data)
+    if baseline:
+        bol = dict_records(bol)
+    loaded, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    positions = sum(1 for obj in bol.objects_with_position())
+
+    start = default_timer()
+    for i in range(20):
+        total = 0.0
+        for obj in bol.objects_with_position():
+            pos = obj.position
+            total += pos.x + pos.y + pos.z
+        for obj in bol.objects_with_2positions():
+            total += obj.start.x + obj.end.z
+    iterate = (default_timer() - start)/20
+
+    start = default_timer()
+    copy = deepcopy(bol)
+    copytime = default_timer() - start
+
+    print("{0} ({1}): {2} bytes loaded ({3} bytes per point with a position), {4} bytes peak".format(
+        name, "baseline, records with __dict__" if baseline else "current", loaded, loaded//max(1, positions), peak))
+    print("    objects_with_position loop: {0:.2f} ms, deepcopy: {1:.2f} ms".format(iterate*1000, copytime*1000))
+
+
+def compare(data, name):
+    benchmark(data, name, baseline=True)
+    benchmark(data, name)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, "rb") as f:
+                compare(f.read(), path)
+    else:
+        compare(generated_course(), "Generated course")
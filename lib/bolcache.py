@@ -0,0 +1,275 @@
+# Snapshots of parsed BOL files and an on-disk cache of them keyed by the file's content hash.
+# A snapshot is an uncompressed npz file with the column arrays of the sections (see
+# libbol.COLUMN_FIELDS), the group structure and the few fields that aren't columns. Reading
+# one decodes nothing: the sections of the BOL are created on first access from records that
+# are views of the loaded arrays (see libbol.make_record_views), and read_snapshot_arrays
+# gives the arrays without creating any objects, e.g. read_snapshot_arrays(f)["enemypoints"]["position"].
+import os
+import tempfile
+from hashlib import sha1
+
+from numpy import load, savez, array, zeros, frombuffer, uint8
+
+from .libbol import (BOL, EnemyPointGroups, EnemyPointGroup, EnemyPoint, CheckpointGroups, CheckpointGroup,
+                     Checkpoint, Route, RoutePoint, MapObjects, MapObject, KartStartPoints, KartStartPoint, Areas,
+                     Area, ObjectContainer, Camera, JugemPoint, LightParam, MGEntry, column_data, make_record_views,
+                     ENEMYITEMPOINT, CHECKPOINT, ROUTEGROUP, OBJECTS, KARTPOINT, AREA, CAMERA, RESPAWNPOINT,
+                     BOL_HEADER_0015, BOL_HEADER_COMMON)
+
+
+SNAPSHOT_VERSION = 2
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "mkdd_bol_cache")
+# The least recently used snapshots beyond this are deleted
+CACHE_SIZE = 32
+
+HEADER_SIZE = 4 + BOL_HEADER_0015.size + BOL_HEADER_COMMON.size
+
+# Column arrays of the snapshot: name, section, record class
+COLUMN_ARRAYS = (
+    ("enemypoints", ENEMYITEMPOINT, EnemyPoint),
+    ("checkpoints", CHECKPOINT, Checkpoint),
+    ("routepoints", ROUTEGROUP, RoutePoint),
+    ("objects", OBJECTS, MapObject),
+    ("kartpoints", KARTPOINT, KartStartPoint),
+    ("areas", AREA, Area),
+    ("cameras", CAMERA, Camera),
+    ("respawnpoints", RESPAWNPOINT, JugemPoint)
+)
+
+
+def write_snapshot(bol, f, source_hash=""):
+    arrays = {}
+    for name, section, recordcls in COLUMN_ARRAYS:
+        arrays[name] = column_data(section, bol._section_points(section))
+
+    groups = bol.enemypointgroups.groups
+    arrays["enemygroups"] = array([(group.id, len(group.points)) for group in groups],
+                                  dtype=[("id", "i8"), ("count", "i8")]).reshape(-1)
+
+    groups = bol.checkpoints.groups
+    checkpointgroups = zeros(len(groups), dtype=[("count", "i8"), ("grouplink", "i8"),
+                                                 ("prevgroup", "i8", (4,)), ("nextgroup", "i8", (4,))])
+    for i, group in enumerate(groups):
+        checkpointgroups[i] = (len(group.points), group.grouplink, group.prevgroup, group.nextgroup)
+    arrays["checkpointgroups"] = checkpointgroups
+
+    arrays["routes"] = array([(len(route.points), route.unk1, route.unk2) for route in bol.routes],
+                             dtype=[("count", "i8"), ("unk1", "i8"), ("unk2", "i8")]).reshape(-1)
+
+    arrays["objects_userdata"] = array([obj.userdata for obj in bol.objects.objects], dtype="i8").reshape(-1, 8)
+    arrays["cameras_name"] = array([camera.name for camera in bol.cameras], dtype=str)
+
+    # Light parameters and minigame entries are few and have no columns, they are kept encoded
+    arrays["lightparams"] = _encode_records(bol.lightparams)
+    arrays["mgentries"] = _encode_records(bol.mgentries)
+
+    header = bol.to_buffer(use_cache=False)[:HEADER_SIZE]
+    savez(f, version=array([SNAPSHOT_VERSION]), source=array([source_hash]),
+          header=frombuffer(bytes(header), uint8), **arrays)
+
+
+def read_snapshot_arrays(f):
+    # The arrays of a snapshot, or None if it was written by another version
+    with load(f) as snapshot:
+        if snapshot["version"][0] != SNAPSHOT_VERSION:
+            return None
+        return {name: snapshot[name] for name in snapshot.files}
+
+
+def read_snapshot(f, lazy=True):
+    arrays = read_snapshot_arrays(f)
+    if arrays is None:
+        raise RuntimeError("Unsupported BOL snapshot version")
+
+    return snapshot_to_bol(arrays, lazy)
+
+
+def snapshot_to_bol(arrays, lazy=True):
+    bol, old_bol, sectioncounts, sectionoffsets = BOL.from_header(arrays["header"].tobytes())
+
+    bol.set_section_loaders({
+        "enemypointgroups": lambda: _enemypointgroups(bol, arrays),
+        "checkpoints": lambda: _checkpoints(bol, arrays),
+        "routes": lambda: _routes(bol, arrays),
+        "objects": lambda: _objects(bol, arrays),
+        "kartpoints": lambda: _kartpoints(bol, arrays),
+        "areas": lambda: _areas(bol, arrays),
+        "cameras": lambda: _cameras(bol, arrays),
+        "respawnpoints": lambda: ObjectContainer(_records(bol, arrays, "respawnpoints")),
+        "lightparams": lambda: _decode_records(arrays["lightparams"], LightParam),
+        "mgentries": lambda: _decode_records(arrays["mgentries"], MGEntry)
+    }, lazy)
+
+    return bol
+
+
+def _records(bol, arrays, name):
+    # Records of a column array, the columns are kept as the BOL's columnar storage of the section
+    for arrayname, section, recordcls in COLUMN_ARRAYS:
+        if arrayname == name:
+            records = make_record_views(recordcls, section, arrays[name])
+            bol.set_columns(section, records, arrays[name])
+            return records
+
+
+def _enemypointgroups(bol, arrays):
+    points = _records(bol, arrays, "enemypoints")
+    for point in points:
+        point._size = EnemyPoint._struct.size
+
+    enemypointgroups = EnemyPointGroups()
+    start = 0
+    for groupid, count in arrays["enemygroups"].tolist():
+        group = EnemyPointGroup()
+        group.id = groupid
+        group.points = points[start:start+count]
+        enemypointgroups.groups.append(group)
+        enemypointgroups._group_ids[groupid] = group
+        start += count
+
+    return enemypointgroups
+
+
+def _checkpoints(bol, arrays):
+    points = _records(bol, arrays, "checkpoints")
+    for point in points:
+        point.mid = (point.start + point.end)/2.0
+
+    checkpoints = CheckpointGroups()
+    start = 0
+    for count, grouplink, prevgroup, nextgroup in arrays["checkpointgroups"].tolist():
+        group = CheckpointGroup(grouplink)
+        group.prevgroup = prevgroup
+        group.nextgroup = nextgroup
+        group._pointcount = count
+        group.points = points[start:start+count]
+        checkpoints.groups.append(group)
+        start += count
+
+    return checkpoints
+
+
+def _routes(bol, arrays):
+    points = _records(bol, arrays, "routepoints")
+
+    routes = ObjectContainer()
+    start = 0
+    for count, unk1, unk2 in arrays["routes"].tolist():
+        route = Route()
+        route.unk1 = unk1
+        route.unk2 = unk2
+        route._pointcount = count
+        route._pointstart = start
+        route.points = points[start:start+count]
+        routes.append(route)
+        start += count
+
+    return routes
+
+
+def _objects(bol, arrays):
+    objects = MapObjects()
+    objects.objects = _records(bol, arrays, "objects")
+    for obj, userdata in zip(objects.objects, arrays["objects_userdata"].tolist()):
+        obj.userdata = userdata
+        obj.widget = None
+        obj._size = MapObject._struct.size
+
+    return objects
+
+
+def _kartpoints(bol, arrays):
+    kartpoints = KartStartPoints()
+    kartpoints.positions = _records(bol, arrays, "kartpoints")
+    return kartpoints
+
+
+def _areas(bol, arrays):
+    areas = Areas()
+    areas.areas = _records(bol, arrays, "areas")
+    return areas
+
+
+def _cameras(bol, arrays):
+    cameras = ObjectContainer(_records(bol, arrays, "cameras"))
+    for camera, name in zip(cameras, arrays["cameras_name"].tolist()):
+        camera.name = name
+    return cameras
+
+
+def _encode_records(records):
+    data = bytearray(sum(record._struct.size for record in records))
+    offset = 0
+    for record in records:
+        record.pack_into(data, offset)
+        offset += record._struct.size
+    return frombuffer(bytes(data), uint8)
+
+
+def _decode_records(data, recordcls):
+    return ObjectContainer.from_buffer(data.tobytes(), 0, len(data)//recordcls._struct.size, recordcls)
+
+
+def load_cached(path, cachedir=CACHE_DIR, lazy=True):
+    # Loads the BOL file at path from its snapshot in cachedir if there is one for the
+    # current contents of the file, otherwise the file is parsed and a snapshot is written.
+    with open(path, "rb") as f:
+        data = f.read()
+
+    return load_cached_buffer(data, cachedir, lazy)
+
+
+def load_cached_buffer(data, cachedir=CACHE_DIR, lazy=True):
+    source_hash = content_hash(data)
+    snapshotpath = os.path.join(cachedir, source_hash + ".npz")
+
+    if os.path.exists(snapshotpath):
+        try:
+            arrays = read_snapshot_arrays(snapshotpath)
+        except Exception as error:
+            print("Couldn't read BOL snapshot", snapshotpath, error)
+            arrays = None
+
+        if arrays is not None and str(arrays["source"][0]) == source_hash:
+            os.utime(snapshotpath)
+            return snapshot_to_bol(arrays, lazy)
+
+    bol = BOL.from_buffer(data)
+    try:
+        store_snapshot(bol, source_hash, cachedir)
+    except OSError as error:
+        print("Couldn't store BOL snapshot:", error)
+    return bol
+
+
+def content_hash(data):
+    return sha1(data).hexdigest()
+
+
+def store_snapshot(bol, source_hash, cachedir=CACHE_DIR):
+    # Can also be called with the hash of a file that was just saved, so reopening it hits the cache
+    os.makedirs(cachedir, exist_ok=True)
+    snapshotpath = os.path.join(cachedir, source_hash + ".npz")
+
+    # Written to a temporary file first so a cancelled write never leaves a broken snapshot
+    tmppath = snapshotpath + ".tmp{0}".format(os.getpid())
+    with open(tmppath, "wb") as f:
+        write_snapshot(bol, f, source_hash)
+    os.replace(tmppath, snapshotpath)
+
+    _prune_cache(cachedir)
+
+
+def _prune_cache(cachedir):
+    snapshots = []
+    for filename in os.listdir(cachedir):
+        if filename.endswith(".npz"):
+            filepath = os.path.join(cachedir, filename)
+            snapshots.append((os.path.getmtime(filepath), filepath))
+
+    snapshots.sort(reverse=True)
+    for mtime, filepath in snapshots[CACHE_SIZE:]:
+        try:
+            os.remove(filepath)
+        except OSError as error:
+            print("Couldn't remove old BOL snapshot", filepath, error)
@@ -0,0 +1,591 @@
+# Structural diff and patch of BOL files.
+# Both files are encoded and split into their records. Records are paired by their content
+# (difflib on the record bytes, so inserting or removing points doesn't shift everything
+# after them) and changed pairs are compared field by field in one numpy pass per block.
+# Fields are numbered in the order of the record's struct, see libbol.
+# Enemy points, checkpoints and route points are diffed within their group or route. Fields
+# that follow from that structure (point counts and route point starts) are left out of the
+# diff and recomputed when a patch is applied. Modifications store the old value of each field
+# and applying them to a record with a different value is reported as a conflict.
+#
+# python -m lib.boldiff old.bol new.bol [-o patch.json]
+# python -m lib.boldiff --apply patch.json course.bol output.bol
+import json
+import re
+from difflib import SequenceMatcher
+
+from numpy import frombuffer, dtype, nonzero
+
+from .libbol import (BOL, BOL_HEADER_0015, BOL_HEADER_COMMON, EnemyPoint, CheckpointGroup, Checkpoint,
+                     Route, RoutePoint, MapObject, KartStartPoint, Area, Camera, JugemPoint, LightParam, MGEntry,
+                     ENEMYITEMPOINT, CHECKPOINT, ROUTEGROUP, ROUTEPOINT, OBJECTS, KARTPOINT, AREA, CAMERA,
+                     RESPAWNPOINT, LIGHTPARAM, MINIGAME)
+
+
+# Record lists in file order: name, section, record class. The checkpoint section is
+# split into the groups and the points that follow them.
+SECTIONS = (
+    ("enemypoints", ENEMYITEMPOINT, EnemyPoint),
+    ("checkpointgroups", CHECKPOINT, CheckpointGroup),
+    ("checkpoints", CHECKPOINT, Checkpoint),
+    ("routes", ROUTEGROUP, Route),
+    ("routepoints", ROUTEPOINT, RoutePoint),
+    ("objects", OBJECTS, MapObject),
+    ("kartpoints", KARTPOINT, KartStartPoint),
+    ("areas", AREA, Area),
+    ("cameras", CAMERA, Camera),
+    ("respawnpoints", RESPAWNPOINT, JugemPoint),
+    ("lightparams", LIGHTPARAM, LightParam),
+    ("mgentries", MINIGAME, MGEntry)
+)
+
+# Lists whose points belong to groups: patch name, group records, point records and derived
+# fields of the group records. Enemy point groups have no records of their own, a group is a
+# run of points with the same group id. The group id is an ordinary field of the points.
+GROUPED_SECTIONS = (
+    ("enemypoints", None, "enemypoints", ()),
+    ("checkpoints", "checkpointgroups", "checkpoints", (0,)),
+    ("routes", "routes", "routepoints", (0, 1))
+)
+
+# Field of the group id in enemy point records
+ENEMYPOINT_GROUP_FIELD = 8
+
+GROUPED_LISTS = ("enemypoints", "checkpointgroups", "checkpoints", "routes", "routepoints")
+
+HEADER_ATTRIBUTES = ("roll", "rgb_ambient", "rgba_light", "lightsource", "fog_type", "fog_color",
+                     "fog_startz", "fog_endz", "unk1", "unk2", "unk3", "unk4", "unk5", "unk6",
+                     "shadow_color", "lap_count", "music_id")
+
+HEADER_SIZE = 4 + BOL_HEADER_0015.size + BOL_HEADER_COMMON.size
+
+_GROUPED_NAMES = tuple(name for name, groupname, pointname, groupfields in GROUPED_SECTIONS)
+
+
+class BOLPatch(object):
+    def __init__(self):
+        # attribute -> [old, new]
+        self.header = {}
+        # section name -> list of operations, indices refer to the records of the old file:
+        #   ["insert", index, [record bytes, ...]]  inserted before the old record at index
+        #   ["delete", index, count]
+        #   ["modify", index, {field: [old, new]}]
+        # Operations on grouped sections (see GROUPED_SECTIONS) refer to groups instead:
+        #   ["insert", index, [[group record, [point record, ...]], ...]]
+        #   ["modify", index, {field: [old, new]}, [operations on the points of the group]]
+        self.sections = {}
+
+    def is_empty(self):
+        return not self.header and not self.sections
+
+    def to_json(self):
+        sections = {}
+        for name, ops in self.sections.items():
+            sections[name] = [_op_to_json(op, name in _GROUPED_NAMES) for op in ops]
+
+        return json.dumps({"header": self.header, "sections": sections})
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        patch = cls()
+        patch.header = data["header"]
+        for name, ops in data["sections"].items():
+            patch.sections[name] = [_op_from_json(op, name in _GROUPED_NAMES) for op in ops]
+
+        return patch
+
+    def describe(self):
+        lines = []
+        for attribute, (old, new) in self.header.items():
+            lines.append("header {0}: {1} -> {2}".format(attribute, old, new))
+
+        for name, ops in self.sections.items():
+            _describe_ops(name, ops, lines)
+
+        return lines
+
+
+def diff(old, new, verify=True):
+    # Changes needed to turn BOL old into BOL new. With verify the patch is applied to old and
+    # has to give exactly the data of new.
+    patch = BOLPatch()
+
+    for attribute in HEADER_ATTRIBUTES:
+        oldvalue = _header_value(old, attribute)
+        newvalue = _header_value(new, attribute)
+        if oldvalue != newvalue:
+            patch.header[attribute] = [oldvalue, newvalue]
+
+    olddata = old.to_buffer(use_cache=False)
+    newdata = new.to_buffer(use_cache=False)
+    oldrecords = split_records(olddata)
+    newrecords = split_records(newdata)
+
+    for name, section, recordcls in SECTIONS:
+        if name in GROUPED_LISTS:
+            continue
+        ops = diff_records(oldrecords[name], newrecords[name], recordcls._struct)
+        if ops:
+            patch.sections[name] = ops
+
+    oldgroups = split_groups(oldrecords)
+    newgroups = split_groups(newrecords)
+    for name, groupname, pointname, groupfields in GROUPED_SECTIONS:
+        ops = diff_groups(oldgroups[name], newgroups[name], _struct_of(groupname), _struct_of(pointname))
+        if ops:
+            patch.sections[name] = ops
+
+    if verify:
+        result = apply_patch(BOL.from_buffer(olddata), patch).to_buffer(use_cache=False)
+        if result != newdata:
+            raise RuntimeError("Patch doesn't reproduce the new file, first difference at 0x{0:x}".format(
+                _first_difference(result, newdata)))
+
+    return patch
+
+
+def apply_patch(bol, patch, force=False):
+    # Returns a new BOL with the patch applied to bol. bol doesn't need to be the file the
+    # patch was made from, but its sections need to have at least as many records as the
+    # patch refers to. Values that differ from the old values stored in the patch are
+    # conflicts, which raise an error unless force is set, then they are printed and overwritten.
+    data = bol.to_buffer(use_cache=False)
+    records = split_records(data)
+    conflicts = []
+
+    for attribute, (old, new) in patch.header.items():
+        if attribute in HEADER_ATTRIBUTES and _header_value(bol, attribute) != old:
+            conflicts.append("header {0}: expected {1}, found {2}, set to {3}".format(
+                attribute, old, _header_value(bol, attribute), new))
+
+    for name, section, recordcls in SECTIONS:
+        ops = patch.sections.get(name)
+        if ops and name not in GROUPED_LISTS:
+            records[name] = apply_records(records[name], ops, recordcls._struct, name, conflicts)
+
+    groups = split_groups(records)
+    for name, groupname, pointname, groupfields in GROUPED_SECTIONS:
+        ops = patch.sections.get(name)
+        if ops:
+            patched = apply_groups(groups[name], ops, _struct_of(groupname), _struct_of(pointname), name,
+                                   conflicts)
+            grouprecords, records[pointname] = join_groups(name, patched)
+            if groupname is not None:
+                records[groupname] = grouprecords
+
+    if conflicts:
+        if not force:
+            raise RuntimeError("Patch conflicts with the file:\n" + "\n".join(conflicts))
+        for conflict in conflicts:
+            print("Conflict:", conflict)
+
+    result = BOL.from_buffer(join_records(data[:HEADER_SIZE], records))
+
+    for attribute, (old, new) in patch.header.items():
+        if attribute not in HEADER_ATTRIBUTES:
+            raise RuntimeError("Unknown header attribute in patch: {0}".format(attribute))
+        if isinstance(new, list):
+            value = getattr(result, attribute)
+            setattr(result, attribute, type(value)(*new))
+        else:
+            setattr(result, attribute, new)
+
+    return result
+
+
+def split_records(data):
+    # Records of a file as written by BOL.to_buffer, name -> list of bytes
+    values = BOL_HEADER_COMMON.unpack_from(data, 4 + BOL_HEADER_0015.size)
+    checkpointgroups = values[3]
+    offsets = list(values[27:38])
+    offsets.append(len(data))
+
+    records = {}
+    for name, section, recordcls in SECTIONS:
+        start, end = offsets[section-1], offsets[section]
+        if recordcls is CheckpointGroup:
+            end = start + checkpointgroups*CheckpointGroup._struct.size
+        elif recordcls is Checkpoint:
+            start += checkpointgroups*CheckpointGroup._struct.size
+
+        size = recordcls._struct.size
+        records[name] = [bytes(data[i:i+size]) for i in range(start, end, size)]
+
+    return records
+
+
+def join_records(header, records):
+    # Inverse of split_records, the counts and section offsets in the header are updated
+    data = bytearray(header)
+    offsets = []
+    for name, section, recordcls in SECTIONS:
+        if recordcls is not Checkpoint:
+            offsets.append(len(data))
+        for record in records[name]:
+            data.extend(record)
+
+    values = list(BOL_HEADER_COMMON.unpack_from(data, 4 + BOL_HEADER_0015.size))
+    values[2:9] = (len(records["enemypoints"]), len(records["checkpointgroups"]), len(records["objects"]),
+                   len(records["areas"]), len(records["cameras"]), len(records["routes"]),
+                   len(records["respawnpoints"]))
+    values[23:25] = len(records["lightparams"]), len(records["mgentries"])
+    values[27:38] = offsets
+    BOL_HEADER_COMMON.pack_into(data, 4 + BOL_HEADER_0015.size, *values)
+
+    return data
+
+
+def split_groups(records):
+    # Groups of the grouped sections, name -> list of [group record, [point record, ...]].
+    # Derived fields are cleared in the group records so they don't show up in comparisons.
+    groups = {}
+    for name, groupname, pointname, groupfields in GROUPED_SECTIONS:
+        groupstruct, pointstruct = _struct_of(groupname), _struct_of(pointname)
+        points = records[pointname]
+        groups[name] = []
+
+        if groupname is None:
+            # BOL.to_buffer writes the points of each group one after another
+            lastid = None
+            for point in points:
+                groupid = pointstruct.unpack(point)[ENEMYPOINT_GROUP_FIELD]
+                if groupid != lastid or not groups[name]:
+                    groups[name].append([b"", []])
+                    lastid = groupid
+                groups[name][-1][1].append(point)
+        else:
+            start = 0
+            for record in records[groupname]:
+                values = groupstruct.unpack(record)
+                count = values[0]
+                if groupname == "routes":
+                    start = values[1]
+                if start + count > len(points):
+                    raise RuntimeError("{0} refer to more points than there are".format(groupname))
+
+                groups[name].append([_clear_fields(record, groupstruct, groupfields),
+                                     points[start:start+count]])
+                start += count
+
+    return groups
+
+
+def join_groups(name, groups):
+    # Inverse of split_groups for one grouped section, returns the group records and the point
+    # records with the derived fields filled in from the groups
+    grouprecords, pointrecords = [], []
+    for record, points in groups:
+        if name == "enemypoints":
+            pointrecords.extend(points)
+        elif name == "routes":
+            values = list(Route._struct.unpack(record))
+            values[0:2] = len(points), len(pointrecords)
+            grouprecords.append(Route._struct.pack(*values))
+            pointrecords.extend(points)
+        else:
+            values = list(CheckpointGroup._struct.unpack(record))
+            values[0] = len(points)
+            grouprecords.append(CheckpointGroup._struct.pack(*values))
+            pointrecords.extend(points)
+
+    return grouprecords, pointrecords
+
+
+def diff_records(old, new, struct):
+    ops = []
+    matcher = SequenceMatcher(None, old, new, autojunk=False)
+
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        elif tag == "delete":
+            ops.append(["delete", i1, i2-i1])
+        elif tag == "insert":
+            ops.append(["insert", i1, new[j1:j2]])
+        else:
+            # Changed records are paired in order, the rest of the longer side is
+            # inserted or deleted
+            count = min(i2-i1, j2-j1)
+            for index, changes in zip(range(i1, i1+count), _field_changes(old[i1:i1+count], new[j1:j1+count], struct)):
+                ops.append(["modify", index, changes])
+
+            if i2-i1 > count:
+                ops.append(["delete", i1+count, i2-i1-count])
+            elif j2-j1 > count:
+                ops.append(["insert", i2, new[j1+count:j2]])
+
+    return ops
+
+
+def apply_records(records, ops, struct, name="", conflicts=None):
+    # Fields whose current value isn't the old value of a modification are changed anyway and
+    # added to conflicts as strings, if it is given
+    records = list(records)
+
+    # Operations are sorted by index, going backwards keeps the indices of the rest valid
+    for op in reversed(ops):
+        kind, index = op[0], op[1]
+        if index < 0 or index > len(records) or (kind != "insert" and index + _op_length(op) > len(records)):
+            raise RuntimeError("Patch doesn't fit: {0} has {1} records, operation {2} at {3}".format(
+                name, len(records), kind, index))
+
+        if kind == "insert":
+            records[index:index] = op[2]
+        elif kind == "delete":
+            del records[index:index+op[2]]
+        else:
+            values = list(struct.unpack(records[index]))
+            for field, (old, new) in op[2].items():
+                current = values[int(field)]
+                if isinstance(current, bytes):
+                    new = bytes.fromhex(new)
+                    current = current.hex()
+                if current != old and conflicts is not None:
+                    conflicts.append("{0} {1} field {2}: expected {3}, found {4}, set to {5}".format(
+                        name, index, field, old, current, op[2][field][1]))
+                values[int(field)] = new
+            records[index] = struct.pack(*values)
+
+    return records
+
+
+def diff_groups(old, new, groupstruct, pointstruct):
+    # Like diff_records with groups as the records. Paired groups that differ get one modify
+    # operation with the changed fields of the group record and the diff of their points.
+    ops = []
+    matcher = SequenceMatcher(None, [_group_key(group) for group in old], [_group_key(group) for group in new],
+                              autojunk=False)
+
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        elif tag == "delete":
+            ops.append(["delete", i1, i2-i1])
+        elif tag == "insert":
+            ops.append(["insert", i1, new[j1:j2]])
+        else:
+            count = min(i2-i1, j2-j1)
+            if groupstruct is not None:
+                fieldchanges = _field_changes([group[0] for group in old[i1:i1+count]],
+                                              [group[0] for group in new[j1:j1+count]], groupstruct)
+            else:
+                fieldchanges = [{} for i in range(count)]
+
+            for i in range(count):
+                pointops = diff_records(old[i1+i][1], new[j1+i][1], pointstruct)
+                if fieldchanges[i] or pointops:
+                    ops.append(["modify", i1+i, fieldchanges[i], pointops])
+
+            if i2-i1 > count:
+                ops.append(["delete", i1+count, i2-i1-count])
+            elif j2-j1 > count:
+                ops.append(["insert", i2, new[j1+count:j2]])
+
+    return ops
+
+
+def apply_groups(groups, ops, groupstruct, pointstruct, name="", conflicts=None):
+    groups = [[record, points] for record, points in groups]
+
+    for op in reversed(ops):
+        kind, index = op[0], op[1]
+        if index < 0 or index > len(groups) or (kind != "insert" and index + _op_length(op) > len(groups)):
+            raise RuntimeError("Patch doesn't fit: {0} has {1} groups, operation {2} at {3}".format(
+                name, len(groups), kind, index))
+
+        if kind == "insert":
+            groups[index:index] = [[record, list(points)] for record, points in op[2]]
+        elif kind == "delete":
+            del groups[index:index+op[2]]
+        else:
+            if op[2]:
+                groups[index][0] = apply_records(groups[index][0:1], [["modify", 0, op[2]]], groupstruct,
+                                                 "{0} {1}, group".format(name, index), conflicts)[0]
+            groups[index][1] = apply_records(groups[index][1], op[3], pointstruct,
+                                             "{0} {1}, point".format(name, index), conflicts)
+
+    return groups
+
+
+def _group_key(group):
+    return group[0], tuple(group[1])
+
+
+def _op_length(op):
+    return op[2] if op[0] == "delete" else 1
+
+
+def _field_changes(old, new, struct):
+    # Field changes of each pair of records as dicts of field -> [old, new]. Fields are compared
+    # as raw bytes for all records at once, values are only converted for changed fields.
+    valuetype, rawtype = struct_dtypes(struct)
+    oldvalues = frombuffer(b"".join(old), valuetype)
+    newvalues = frombuffer(b"".join(new), valuetype)
+    oldraw = oldvalues.view(rawtype)
+    newraw = newvalues.view(rawtype)
+
+    changes = [{} for i in range(len(old))]
+    for field, name in enumerate(valuetype.names):
+        for row in nonzero(oldraw[name] != newraw[name])[0].tolist():
+            changes[row][field] = [_to_python(oldvalues[name][row]), _to_python(newvalues[name][row])]
+
+    return changes
+
+
+_dtype_cache = {}
+
+
+def struct_dtypes(struct):
+    # Numpy dtypes with one field per value of a big endian struct, once with the values
+    # and once as raw bytes for exact comparison
+    if struct.format in _dtype_cache:
+        return _dtype_cache[struct.format]
+
+    codes = {"b": "i1", "B": "u1", "h": ">i2", "H": ">u2", "i": ">i4", "I": ">u4", "f": ">f4"}
+    names, formats, offsets, sizes = [], [], [], []
+    offset = 0
+    for count, code in re.findall(r"(\d*)([a-zA-Z])", struct.format.lstrip("><!=@")):
+        count = int(count) if count else 1
+        if code == "s":
+            fields = [("S{0}".format(count), count)]
+        else:
+            fields = [(codes[code], dtype(codes[code]).itemsize)]*count
+        for fieldformat, size in fields:
+            names.append("f{0}".format(len(names)))
+            formats.append(fieldformat)
+            offsets.append(offset)
+            sizes.append(size)
+            offset += size
+
+    assert offset == struct.size
+    valuetype = dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": offset})
+    rawtype = dtype({"names": names, "formats": ["V{0}".format(size) for size in sizes],
+                     "offsets": offsets, "itemsize": offset})
+    _dtype_cache[struct.format] = (valuetype, rawtype)
+    return valuetype, rawtype
+
+
+def _first_difference(a, b):
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            return i
+    return min(len(a), len(b))
+
+
+def _struct_of(name):
+    for recordname, section, recordcls in SECTIONS:
+        if recordname == name:
+            return recordcls._struct
+    return None
+
+
+def _clear_fields(record, struct, fields):
+    # record with the bytes of the given fields set to zero
+    if not fields:
+        return record
+
+    valuetype, rawtype = struct_dtypes(struct)
+    record = bytearray(record)
+    for field in fields:
+        fieldtype, offset = valuetype.fields["f{0}".format(field)][:2]
+        record[offset:offset+fieldtype.itemsize] = bytes(fieldtype.itemsize)
+    return bytes(record)
+
+
+def _to_python(value):
+    value = value.item()
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+
+def _header_value(bol, attribute):
+    value = getattr(bol, attribute)
+    if hasattr(value, "r"):
+        if hasattr(value, "a"):
+            return [value.r, value.g, value.b, value.a]
+        return [value.r, value.g, value.b]
+    elif hasattr(value, "x"):
+        return [value.x, value.y, value.z]
+    return value
+
+
+def _describe_ops(name, ops, lines):
+    for op in ops:
+        if op[0] == "insert":
+            lines.append("{0} {1}: insert {2} record(s)".format(name, op[1], len(op[2])))
+        elif op[0] == "delete":
+            lines.append("{0} {1}: delete {2} record(s)".format(name, op[1], op[2]))
+        else:
+            if op[2]:
+                changes = ", ".join("field {0}: {1} -> {2}".format(field, old, new)
+                                    for field, (old, new) in sorted(op[2].items()))
+                lines.append("{0} {1}: {2}".format(name, op[1], changes))
+            if len(op) > 3:
+                _describe_ops("{0} {1} point".format(name, op[1]), op[3], lines)
+
+
+def _op_to_json(op, grouped=False):
+    if op[0] == "insert":
+        if grouped:
+            return ["insert", op[1], [[record.hex(), [point.hex() for point in points]] for record, points in op[2]]]
+        return ["insert", op[1], [record.hex() for record in op[2]]]
+    elif op[0] == "modify" and grouped:
+        return ["modify", op[1], op[2], [_op_to_json(pointop) for pointop in op[3]]]
+    return op
+
+
+def _op_from_json(op, grouped=False):
+    if op[0] == "insert":
+        if grouped:
+            return ["insert", op[1], [[bytes.fromhex(record), [bytes.fromhex(point) for point in points]]
+                                      for record, points in op[2]]]
+        return ["insert", op[1], [bytes.fromhex(record) for record in op[2]]]
+    elif op[0] == "modify":
+        changes = {int(field): change for field, change in op[2].items()}
+        if grouped:
+            return ["modify", op[1], changes, [_op_from_json(pointop) for pointop in op[3]]]
+        return ["modify", op[1], changes]
+    return op
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="Original .bol file, or the patch with --apply")
+    parser.add_argument("other", help="Changed .bol file, or the .bol file to be patched with --apply")
+    parser.add_argument("output", default=None, nargs='?',
+                        help="Output .bol file with --apply")
+    parser.add_argument("-o", "--patch", default=None,
+                        help="Write the changes as a json patch to this file")
+    parser.add_argument("--apply", action="store_true",
+                        help="Apply the patch in input to the file in other and write it to output")
+    parser.add_argument("--force", action="store_true",
+                        help="With --apply, overwrite values that differ from the old values in the patch")
+
+    args = parser.parse_args()
+
+    if args.apply:
+        if args.output is None:
+            raise RuntimeError("No output file given")
+        with open(args.input, "r") as f:
+            patch = BOLPatch.from_json(f.read())
+        with open(args.other, "rb") as f:
+            bol = BOL.from_file(f)
+        with open(args.output, "wb") as f:
+            apply_patch(bol, patch, args.force).write(f)
+    else:
+        with open(args.input, "rb") as f:
+            old = BOL.from_file(f)
+        with open(args.other, "rb") as f:
+            new = BOL.from_file(f)
+
+        patch = diff(old, new)
+        for line in patch.describe():
+            print(line)
+
+        if args.patch is not None:
+            with open(args.patch, "w") as f:
+                f.write(patch.to_json())
@@ -1,95 +1,107 @@
 import math
-from .vectors import Vector3, Triangle
-
-
-def collides(face_v1, face_v2, face_v3, box_mid_x, box_mid_z, box_size_x, box_size_z):
-    min_x = min(face_v1[0], face_v2[0], face_v3[0]) - box_mid_x
-    max_x = max(face_v1[0], face_v2[0], face_v3[0]) - box_mid_x
-
-    min_z = min(face_v1[2], face_v2[2], face_v3[2]) - box_mid_z
-    max_z = max(face_v1[2], face_v2[2], face_v3[2]) - box_mid_z
-
-    half_x = box_size_x / 2.0
-    half_z = box_size_z / 2.0
-
-    if max_x < -half_x or min_x > +half_x:
-        return False
-    if max_z < -half_z or min_z > +half_z:
-        return False
-
-    return True
-
-
-def subdivide_grid(minx, minz,
-                   gridx_start, gridx_end, gridz_start, gridz_end,
-                   cell_size, triangles, vertices, result):
-    #print("Subdivision with", gridx_start, gridz_start, gridx_end, gridz_end, (gridx_start+gridx_end) // 2, (gridz_start+gridz_end) // 2)
-    if gridx_start == gridx_end-1 and gridz_start == gridz_end-1:
-        if gridx_start not in result:
-            result[gridx_start] = {}
-        result[gridx_start][gridz_start] = triangles
-
-        return True
-
-    assert gridx_end > gridx_start or gridz_end > gridz_start
-
-    halfx = (gridx_start+gridx_end) // 2
-    halfz = (gridz_start+gridz_end) // 2
-
-    quadrants = (
-        [], [], [], []
-    )
-    # x->
-    # 2 3 ^
-    # 0 1 z
-    coordinates = (
-        (0, gridx_start , halfx     , gridz_start   , halfz),   # Quadrant 0
-        (1, halfx       , gridx_end , gridz_start   , halfz),     # Quadrant 1
-        (2, gridx_start , halfx     , halfz         , gridz_end),     # Quadrant 2
-        (3, halfx       , gridx_end , halfz         , gridz_end) # Quadrant 3
-    )
-    skip = []
-    if gridx_start == halfx:
-        skip.append(0)
-        skip.append(2)
-    if halfx == gridx_end:
-        skip.append(1)
-        skip.append(3)
-    if gridz_start == halfz:
-        skip.append(0)
-        skip.append(1)
-    if halfz == gridz_end:
-        skip.append(2)
-        skip.append(3)
-
-
-    for i, face in triangles:
-        v1_index, v2_index, v3_index = face
-
-        v1 = vertices[v1_index[0]-1]
-        v2 = vertices[v2_index[0]-1]
-        v3 = vertices[v3_index[0]-1]
-
-        for quadrant, startx, endx, startz, endz in coordinates:
-            if quadrant not in skip:
-                area_size_x = (endx - startx)*cell_size
-                area_size_z = (endz - startz)*cell_size
-
-                if collides(v1, v2, v3,
-                            minx+startx*cell_size + area_size_x//2,
-                            minz+startz*cell_size + area_size_z//2,
-                            area_size_x,
-                            area_size_z):
-                    #print(i, "collided")
-                    quadrants[quadrant].append((i, face))
-
-    for quadrant, startx, endx, startz, endz in coordinates:
-        #print("Doing subdivision, skipping:", skip)
-        if quadrant not in skip:
-            #print("doing subdivision with", coordinates[quadrant])
-            subdivide_grid(minx, minz,
-                           startx, endx, startz, endz,
-                           cell_size, quadrants[quadrant], vertices, result)
+from numpy import (array, asarray, zeros, full, stack, cross, errstate, arange, repeat, cumsum, bincount, argsort,
+                   lexsort, floor, ceil, floor_divide, clip, where, nonzero, diff, minimum, maximum, searchsorted,
+                   concatenate, column_stack, inf, nan, int64, int32, float64)
+from .vectors import Vector3
+
+
+def build_grid(vertices, faces, cell_size):
+    # Bins the triangles into square cells on the xz plane that cover the extents of the mesh.
+    # vertices is an (n, 3) array, faces an (m, 3) array of vertex indices. A triangle is put into
+    # every cell its bounding box touches. Returns the origin, the cell counts along x and z, and the
+    # grid in CSR form: the triangles of cell (x, z) are indices[offsets[c]:offsets[c+1]] with c = x*size_z + z.
+    if len(faces) == 0:
+        return 0.0, 0.0, 0, 0, zeros(1, dtype=int64), zeros(0, dtype=int32)
+
+    used = vertices[faces.ravel()]
+    start_x = math.floor(used[:, 0].min() / cell_size) * cell_size
+    start_z = math.floor(used[:, 2].min() / cell_size) * cell_size
+    # One more cell if the mesh ends exactly on a cell border
+    size_x = int((used[:, 0].max() - start_x) // cell_size) + 1
+    size_z = int((used[:, 2].max() - start_z) // cell_size) + 1
+
+    tri_x = vertices[faces, 0]
+    tri_z = vertices[faces, 2]
+
+    # A bounding box that ends exactly on a cell border also touches the neighbouring cell
+    min_x = clip(ceil((tri_x.min(axis=1) - start_x) / cell_size).astype(int64) - 1, 0, size_x-1)
+    max_x = clip(floor((tri_x.max(axis=1) - start_x) / cell_size).astype(int64), 0, size_x-1)
+    min_z = clip(ceil((tri_z.min(axis=1) - start_z) / cell_size).astype(int64) - 1, 0, size_z-1)
+    max_z = clip(floor((tri_z.max(axis=1) - start_z) / cell_size).astype(int64), 0, size_z-1)
+
+    # One entry per (triangle, cell) pair
+    width_z = max_z - min_z + 1
+    counts = (max_x - min_x + 1) * width_z
+    triangles = repeat(arange(len(faces), dtype=int32), counts)
+    first = cumsum(counts) - counts
+    local = arange(counts.sum(), dtype=int64) - repeat(first, counts)
+    width_z = repeat(width_z, counts)
+    cells = ((repeat(min_x, counts) + local // width_z) * size_z
+             + repeat(min_z, counts) + local % width_z)
+
+    order = argsort(cells, kind="stable")
+    offsets = zeros(size_x*size_z + 1, dtype=int64)
+    cumsum(bincount(cells, minlength=size_x*size_z), out=offsets[1:])
+
+    return start_x, start_z, size_x, size_z, offsets, triangles[order]
+
+
+def build_bvh(corners, leaf_size):
+    # Bounding volume hierarchy over the triangles with the given corners ((m, 3, 3) array). It's built
+    # top down one level at a time: every node with more than leaf_size triangles is split at the median
+    # of its triangles' centers along the axis where the centers are spread the most. Returns flat arrays:
+    # node i has the bounding box mins[i], maxs[i] and covers the triangles order[starts[i]:ends[i]],
+    # its children are children[i] and children[i]+1 (-1 for leaves) and were split along axes[i].
+    count = len(corners)
+    centers = corners.mean(axis=1)
+    order = arange(count, dtype=int64)
+
+    starts, ends, children, axes = [0], [count], [-1], [0]
+    level = [0] if count > leaf_size else []
+    while level:
+        node_starts = array([starts[node] for node in level], dtype=int64)
+        node_counts = array([ends[node] for node in level], dtype=int64) - node_starts
+
+        # Positions in order of the triangles of all nodes of this level, node after node
+        firsts = cumsum(node_counts) - node_counts
+        segments = repeat(arange(len(level)), node_counts)
+        positions = repeat(node_starts - firsts, node_counts) + arange(node_counts.sum())
+
+        node_centers = centers[order[positions]]
+        spread = maximum.reduceat(node_centers, firsts) - minimum.reduceat(node_centers, firsts)
+        node_axes = spread.argmax(axis=1)
+        keys = node_centers[arange(len(positions)), node_axes[segments]]
+        order[positions] = order[positions][lexsort((keys, segments))]
+
+        next_level = []
+        for node, start, node_count, axis in zip(level, node_starts.tolist(), node_counts.tolist(),
+                                                 node_axes.tolist()):
+            middle = start + node_count//2
+            children[node] = len(starts)
+            axes[node] = axis
+            for child_start, child_end in ((start, middle), (middle, start + node_count)):
+                if child_end - child_start > leaf_size:
+                    next_level.append(len(starts))
+                starts.append(child_start)
+                ends.append(child_end)
+                children.append(-1)
+                axes.append(0)
+        level = next_level
+
+    starts = array(starts, dtype=int64)
+    ends = array(ends, dtype=int64)
+
+    # The bounds of every node are reduced over its range of the triangle bounds, the extra
+    # row at the end makes the ranges that end with the last triangle valid
+    bounds = stack((starts, ends), axis=1).ravel()
+    tri_mins = concatenate((corners.min(axis=1)[order], full((1, 3), inf)))
+    tri_maxs = concatenate((corners.max(axis=1)[order], full((1, 3), -inf)))
+    mins = minimum.reduceat(tri_mins, bounds)[::2]
+    maxs = maximum.reduceat(tri_maxs, bounds)[::2]
+    if count == 0:
+        mins[:], maxs[:] = inf, -inf
+
+    return mins, maxs, array(children, dtype=int64), array(axes, dtype=int64), starts, ends, order
 
 
 def normalize_vector(v1):
@@ -108,93 +120,63 @@ def cross_product(v1, v2):
     return cross_x, cross_y, cross_z
 
 
-MAX_X = 200000
-MAX_Z = 200000
+# Cells with fewer triangles are tested one triangle at a time
+VECTORIZE_MIN_TRIANGLES = 16
+# Largest number of point and triangle pairs ground_many tests at once
+GROUND_BLOCK_SIZE = 1 << 18
+# Largest number of triangles in a leaf of the bounding volume hierarchy
+BVH_LEAF_SIZE = 4
+# Stands in for 1/0 in ray and box tests, so that 0*(1/0) stays 0 instead of becoming NaN
+RAY_INFINITY = 1e300
 
 
 class Collision(object):
-    def __init__(self, verts, faces):
-        self.verts = verts
-        self.faces = faces
-        self.triangles = []
-        for v1i, v2i, v3i in self.faces:
-            #print(v1i, v2i, v3i, len(self.verts))
-            x, y, z = verts[v1i[0]-1]
-            v1 = Vector3(x, -z, y)
-            x, y, z = verts[v2i[0]-1]
-            v2 = Vector3(x, -z, y)
-            x, y, z = verts[v3i[0]-1]
-            v3 = Vector3(x, -z, y)
-
-            self.triangles.append(Triangle(v1,v2,v3))
-
+    def __init__(self, mesh):
+        # mesh is a collision_mesh.CollisionMesh, the math is done in float64
+        self.mesh = mesh
         self.cell_size = 2000
 
-        box_size_x = self.cell_size
-        box_size_z = self.cell_size
-
-        smallest_x =-MAX_X#max(-6000.0, smallest_x)
-        smallest_z = -MAX_Z#max(-6000.0, smallest_z)
-        biggest_x = MAX_X#min(6000.0, biggest_x)
-        biggest_z = MAX_Z#min(6000.0, biggest_z)
-        print("dimensions are changed to", smallest_x, smallest_z, biggest_x, biggest_z)
-        start_x = math.floor(smallest_x / box_size_x) * box_size_x
-        start_z = math.floor(smallest_z / box_size_z) * box_size_z
-        end_x = math.ceil(biggest_x / box_size_x) * box_size_x
-        end_z = math.ceil(biggest_z / box_size_z) * box_size_z
-        diff_x = abs(end_x - start_x)
-        diff_z = abs(end_z - start_z)
-        grid_size_x = int(diff_x // box_size_x)
-        grid_size_z = int(diff_z // box_size_z)
-
-        self.grid = {}
-        triangles = [(i, face) for i, face in enumerate(faces)]
-        subdivide_grid(start_x, start_z, 0, grid_size_x, 0, grid_size_z, self.cell_size, triangles, self.verts, self.grid)
-        print("finished generating triangles")
-        print(grid_size_x, grid_size_z)
+        self.vertices = mesh.vertices.astype(float64)
+        self.face_indices = mesh.faces
 
-    def collide_ray_downwards(self, x, z, y=99999999):
-        grid_x = int((x+MAX_X) // self.cell_size)
-        grid_z = int((z+MAX_Z) // self.cell_size)
+        (self.grid_start_x, self.grid_start_z, self.grid_size_x, self.grid_size_z,
+         self.cell_offsets, self.cell_triangles) = build_grid(self.vertices, self.face_indices, self.cell_size)
+        valid = self._precompute_planes()
 
-        if grid_x not in self.grid or grid_z not in self.grid[grid_x]:
-            return None
+        (self.bvh_mins, self.bvh_maxs, self.bvh_children, self.bvh_axes, self.bvh_starts, self.bvh_ends,
+         order) = build_bvh(self.tri_planes[valid, 0:9].reshape(-1, 3, 3), BVH_LEAF_SIZE)
+        self.bvh_triangles = nonzero(valid)[0][order]
+        # The traversal of single rays reads one row per node
+        self._bvh_rows = column_stack((self.bvh_mins, self.bvh_maxs, self.bvh_children, self.bvh_axes,
+                                       self.bvh_starts, self.bvh_ends))
 
-        triangles = self.grid[grid_x][grid_z]
+    def triangles_at(self, x, z):
+        # Indices of the triangles whose bounding box touches the cell at x, z, None outside of the grid
+        grid_x = int((x - self.grid_start_x) // self.cell_size)
+        grid_z = int((z - self.grid_start_z) // self.cell_size)
 
-        verts = self.verts
+        if not (0 <= grid_x < self.grid_size_x and 0 <= grid_z < self.grid_size_z):
+            return None
 
-        y = y
-        dir_x = 0
-        dir_y = -1.0
-        dir_z = 0
+        cell = grid_x*self.grid_size_z + grid_z
+        return self.cell_triangles[self.cell_offsets[cell]:self.cell_offsets[cell+1]]
 
-        hit = None
+    def collide_ray_downwards(self, x, z, y=99999999):
+        triangles = self.triangles_at(x, z)
+        if triangles is None:
+            return None
 
-        result = self._collide(verts, triangles, x, y, z, -1.0)
+        result = self._collide(triangles, x, y, z, -1.0)
 
         return result
 
     def collide_ray_closest(self, x, z, y):
-        grid_x = int((x + MAX_X) // self.cell_size)
-        grid_z = int((z + MAX_Z) // self.cell_size)
-
-        if grid_x not in self.grid or grid_z not in self.grid[grid_x]:
+        triangles = self.triangles_at(x, z)
+        if triangles is None:
             return None
 
-        triangles = self.grid[grid_x][grid_z]
-
-        verts = self.verts
-
-        y = y
-        dir_x = 0
-        dir_y = -1.0
-        dir_z = 0
-
-        hit = None
-
-        result1 = self._collide(verts, triangles, x, y, z, -1.0)
-        result2 = self._collide(verts, triangles, x, y, z, 1.0)
+        result1 = self._collide(triangles, x, y, z, -1.0)
+        result2 = self._collide(triangles, x, y, z, 1.0)
 
         if result1 is None and result2 is None:
             return None
@@ -210,45 +192,136 @@ class Collision(object):
             else:
                 return result1
 
-    def _collide(self, verts, triangles, x, y, z, dir_y):
-        hit = None
-        for i, face in triangles:#face in self.faces:#
-            v1index, v2index, v3index = face
-
-            v1 = verts[v1index[0]-1]
-            v2 = verts[v2index[0]-1]
-            v3 = verts[v3index[0]-1]
-
-            edge1 = create_vector(v1, v2)
-            edge2 = create_vector(v1, v3)
+    def _precompute_planes(self):
+        # Per triangle rows of corners (9 values), edges (9), normal (3) and plane distance (1),
+        # computed in the same order as the per triangle version did
+        corners = self.vertices[self.face_indices]
+        v1, v2, v3 = corners[:, 0], corners[:, 1], corners[:, 2]
+
+        normal = cross(v2 - v1, v3 - v1)
+        # Degenerate triangles have no normal and are never hit, they are left out of the grid
+        valid = (normal != 0.0).any(axis=1)
+        with errstate(invalid="ignore", divide="ignore"):
+            length = (normal[:, 0]**2 + normal[:, 1]**2 + normal[:, 2]**2)**0.5
+            normal = normal / length[:, None]
+
+        self.tri_planes = zeros((len(corners), 22))
+        self.tri_planes[:, 0:9] = corners.reshape(-1, 9)
+        self.tri_planes[:, 9:18] = stack((v2 - v1, v3 - v2, v1 - v3), axis=1).reshape(-1, 9)
+        self.tri_planes[:, 18:21] = normal
+        self.tri_planes[:, 21] = -v1[:, 0]*normal[:, 0] + -v1[:, 1]*normal[:, 1] + -v1[:, 2]*normal[:, 2]
+
+        if not valid.all():
+            keep = valid[self.cell_triangles]
+            kept = zeros(len(keep) + 1, dtype=int64)
+            cumsum(keep, out=kept[1:])
+            self.cell_offsets = kept[self.cell_offsets]
+            self.cell_triangles = self.cell_triangles[keep]
+
+        return valid
+
+    def _collide(self, triangles, x, y, z, dir_y):
+        # Height at which a vertical ray through x, z hits the closest of the given triangles
+        # (closest to y), None if it hits none of them
+        if len(triangles) < VECTORIZE_MIN_TRIANGLES:
+            return self._collide_few(triangles, x, y, z, dir_y)
+
+        height, inside = self._hit_heights(triangles, x, y, z, dir_y)
+        if not inside.any():
+            return None
 
-            normal = cross_product(edge1, edge2)
-            if normal[0] == normal[1] == normal[2] == 0.0:
+        heights = height[inside]
+        # argmin gives the first of equally close hits, like the loop over triangles did
+        return float(heights[abs(y - heights).argmin()])
+
+    def _hit_heights(self, triangles, x, y, z, dir_y):
+        # Heights at which vertical rays through x, z hit the planes of the triangles and whether
+        # the hit is inside of the triangle. x, y and z are numbers or arrays of the same length
+        # as triangles.
+        planes = self.tri_planes[triangles]
+        nx, ny, nz = planes[:, 18], planes[:, 19], planes[:, 20]
+        with errstate(invalid="ignore", divide="ignore"):
+            t = -(nx * x + ny * y + nz * z + planes[:, 21]) / (ny*dir_y)
+        height = y+dir_y*t
+
+        # The hit point has to be on the inner side of all three edges
+        inside = ny*dir_y != 0.0
+        for corner, edge in ((0, 9), (3, 12), (6, 15)):
+            to_x = x - planes[:, corner]
+            to_y = height - planes[:, corner+1]
+            to_z = z - planes[:, corner+2]
+            ex, ey, ez = planes[:, edge], planes[:, edge+1], planes[:, edge+2]
+            inside &= (nx*(ey*to_z - ez*to_y) + ny*(ez*to_x - ex*to_z) + nz*(ex*to_y - ey*to_x)) >= 0
+
+        return height, inside
+
+    def ground_many(self, xs, zs, ys):
+        # collide_ray_closest for many points: returns an array with the height of the closest
+        # hit for each point, NaN where there is none. Every point is paired with each triangle
+        # of its grid cell and all pairs are tested at once.
+        xs = asarray(xs, dtype=float64)
+        zs = asarray(zs, dtype=float64)
+        ys = asarray(ys, dtype=float64)
+        heights = full(len(xs), nan)
+
+        grid_x = floor_divide(xs - self.grid_start_x, self.cell_size)
+        grid_z = floor_divide(zs - self.grid_start_z, self.cell_size)
+        in_grid = (grid_x >= 0) & (grid_x < self.grid_size_x) & (grid_z >= 0) & (grid_z < self.grid_size_z)
+
+        points = nonzero(in_grid)[0]
+        cells = grid_x[points].astype(int64)*self.grid_size_z + grid_z[points].astype(int64)
+        firsts = self.cell_offsets[cells]
+        counts = self.cell_offsets[cells+1] - firsts
+        points, firsts, counts = points[counts > 0], firsts[counts > 0], counts[counts > 0]
+
+        # Points are split into blocks to limit the number of pairs handled at once
+        ends = cumsum(counts)
+        blockends = searchsorted(ends, arange(GROUND_BLOCK_SIZE, ends[-1] if len(ends) else 0, GROUND_BLOCK_SIZE),
+                                 side="right")
+        for start, end in zip([0] + blockends.tolist(), blockends.tolist() + [len(points)]):
+            if start == end:
+                continue
+            blockpoints, blockcounts = points[start:end], counts[start:end]
+
+            # One entry per pair of point and triangle, the pairs of a point are in triangle order
+            pairstarts = cumsum(blockcounts) - blockcounts
+            pairpoints = repeat(arange(end - start), blockcounts)
+            triangles = self.cell_triangles[repeat(firsts[start:end] - pairstarts, blockcounts)
+                                            + arange(len(pairpoints))]
+            x = xs[blockpoints][pairpoints]
+            y = ys[blockpoints][pairpoints]
+            z = zs[blockpoints][pairpoints]
+            height, inside = self._hit_heights(triangles, x, y, z, -1.0)
+
+            # The closest hit of every point, the first one if several are equally close
+            distance = where(inside, abs(y - height), inf)
+            closest = minimum.reduceat(distance, pairstarts)
+            best = nonzero(inside & (distance == closest[pairpoints]))[0]
+            if len(best) == 0:
                 continue
-            normal = normalize_vector(normal)
+            best = best[diff(pairpoints[best], prepend=-1) != 0]
+            heights[blockpoints[pairpoints[best]]] = height[best]
 
-            D = -v1[0]*normal[0] + -v1[1]*normal[1] + -v1[2]*normal[2]
+        return heights
 
-            if normal[1]*dir_y == 0.0:#abs(normal[1] * dir_y) < 10**(-6):
+    def _collide_few(self, triangles, x, y, z, dir_y):
+        # Same as _collide, numpy has too much overhead per call for a few triangles
+        hit = None
+        for (v1x, v1y, v1z, v2x, v2y, v2z, v3x, v3y, v3z,
+             e1x, e1y, e1z, e2x, e2y, e2z, e3x, e3y, e3z,
+             nx, ny, nz, d) in self.tri_planes[triangles].tolist():
+            if ny*dir_y == 0.0:
                 continue # triangle parallel to ray
 
-            t = -(normal[0] * x + normal[1] * y + normal[2] * z + D) / (normal[1]*dir_y)
-
-            point = x, (y+dir_y*t), z
-            #print(point)
-            edg1 = create_vector(v1, v2)
-            edg2 = create_vector(v2, v3)
-            edg3 = create_vector(v3, v1)
-
-            vectest1 = cross_product(edg1, create_vector(v1, point))
-            vectest2 = cross_product(edg2, create_vector(v2, point))
-            vectest3 = cross_product(edg3, create_vector(v3, point))
+            t = -(nx * x + ny * y + nz * z + d) / (ny*dir_y)
+            height = y+dir_y*t
 
-            if ((normal[0]*vectest1[0] + normal[1]*vectest1[1] + normal[2]*vectest1[2]) >= 0 and
-                 (normal[0]*vectest2[0] + normal[1]*vectest2[1] + normal[2]*vectest2[2]) >= 0 and
-                  (normal[0]*vectest3[0] + normal[1]*vectest3[1] + normal[2]*vectest3[2]) >= 0):
-
-                height = point[1]
+            if ((nx*(e1y*(z - v1z) - e1z*(height - v1y)) + ny*(e1z*(x - v1x) - e1x*(z - v1z))
+                    + nz*(e1x*(height - v1y) - e1y*(x - v1x))) >= 0 and
+                (nx*(e2y*(z - v2z) - e2z*(height - v2y)) + ny*(e2z*(x - v2x) - e2x*(z - v2z))
+                    + nz*(e2x*(height - v2y) - e2y*(x - v2x))) >= 0 and
+                (nx*(e3y*(z - v3z) - e3z*(height - v3y)) + ny*(e3z*(x - v3x) - e3x*(z - v3z))
+                    + nz*(e3x*(height - v3y) - e3y*(x - v3x))) >= 0):
 
                 if hit is None or abs(y - height) < abs(y - hit):
                     hit = height
@@ -256,17 +329,128 @@ class Collision(object):
         return hit
 
     def collide_ray(self, ray):
-        best_distance = None
-        place_at = None
-
-        for tri in self.triangles:
-            collision = ray.collide(tri)
+        # Closest point where the ray (a vectors.Line in the 3D view's coordinates, which are x, -z, y
+        # of the mesh) hits a triangle, None if it hits none
+        origin, direction = ray.origin, ray.direction
+        distance = self.cast_ray((origin.x, origin.z, -origin.y), (direction.x, direction.z, -direction.y))
+        if distance is None:
+            return None
 
-            if collision is not False:
-                point, distance = collision
+        return origin + direction*distance
+
+    def cast_ray(self, origin, direction):
+        # Distance along the ray (in lengths of direction) to the first triangle it hits, None if
+        # it hits none. Walks the bounding volume hierarchy with a stack, nearer child first.
+        ox, oy, oz = origin
+        dx, dy, dz = direction
+        inverse = [1.0/value if value != 0.0 else RAY_INFINITY for value in direction]
+        best = inf
+
+        stack = [0]
+        while stack:
+            minx, miny, minz, maxx, maxy, maxz, child, axis, start, end = self._bvh_rows[stack.pop()].tolist()
+
+            near, far = 0.0, best
+            for o, inv, low, high in ((ox, inverse[0], minx, maxx), (oy, inverse[1], miny, maxy),
+                                      (oz, inverse[2], minz, maxz)):
+                t1 = (low - o)*inv
+                t2 = (high - o)*inv
+                if t1 > t2:
+                    t1, t2 = t2, t1
+                if t1 > near:
+                    near = t1
+                if t2 < far:
+                    far = t2
+            if near > far or near >= best:
+                continue
 
-                if best_distance is None or distance < best_distance:
-                    place_at = point
-                    best_distance = distance
+            if child >= 0:
+                child = int(child)
+                # The first child has the triangles with the smaller centers along axis
+                if direction[int(axis)] >= 0.0:
+                    stack.append(child+1)
+                    stack.append(child)
+                else:
+                    stack.append(child)
+                    stack.append(child+1)
+                continue
 
-        return place_at
\ No newline at end of file
+            for (v1x, v1y, v1z, v2x, v2y, v2z, v3x, v3y, v3z,
+                 e1x, e1y, e1z, e2x, e2y, e2z, e3x, e3y, e3z,
+                 nx, ny, nz, d) in self.tri_planes[self.bvh_triangles[int(start):int(end)]].tolist():
+                denominator = nx*dx + ny*dy + nz*dz
+                if denominator == 0.0:
+                    continue # triangle parallel to ray
+
+                t = ((v1x - ox)*nx + (v1y - oy)*ny + (v1z - oz)*nz) / denominator
+                if t < 0.0 or t >= best:
+                    continue
+
+                px, py, pz = ox + dx*t, oy + dy*t, oz + dz*t
+                if ((nx*(e1y*(pz - v1z) - e1z*(py - v1y)) + ny*(e1z*(px - v1x) - e1x*(pz - v1z))
+                        + nz*(e1x*(py - v1y) - e1y*(px - v1x))) > 0 and
+                    (nx*(e2y*(pz - v2z) - e2z*(py - v2y)) + ny*(e2z*(px - v2x) - e2x*(pz - v2z))
+                        + nz*(e2x*(py - v2y) - e2y*(px - v2x))) > 0 and
+                    (nx*(e3y*(pz - v3z) - e3z*(py - v3y)) + ny*(e3z*(px - v3x) - e3x*(pz - v3z))
+                        + nz*(e3x*(py - v3y) - e3y*(px - v3x))) > 0):
+                    best = t
+
+        if best == inf:
+            return None
+        return best
+
+    def cast_rays(self, origins, directions):
+        # cast_ray for many rays given as (n, 3) arrays: returns an array with the distances, NaN
+        # where a ray hits nothing. All rays go through the hierarchy together, every step tests
+        # the pending pairs of ray and node at once and replaces the pairs whose box is hit by
+        # pairs with the node's children, or tests the triangles if the node is a leaf.
+        origins = asarray(origins, dtype=float64).reshape(-1, 3)
+        directions = asarray(directions, dtype=float64).reshape(-1, 3)
+        with errstate(divide="ignore"):
+            inverse = where(directions != 0.0, 1.0/directions, RAY_INFINITY)
+        best = full(len(origins), inf)
+
+        rays = arange(len(origins))
+        nodes = zeros(len(origins), dtype=int64)
+        while len(rays):
+            t1 = (self.bvh_mins[nodes] - origins[rays]) * inverse[rays]
+            t2 = (self.bvh_maxs[nodes] - origins[rays]) * inverse[rays]
+            near = maximum(minimum(t1, t2).max(axis=1), 0.0)
+            far = maximum(t1, t2).min(axis=1)
+            hit = (near <= far) & (near < best[rays])
+            rays, nodes = rays[hit], nodes[hit]
+
+            children = self.bvh_children[nodes]
+            leaf = children < 0
+            if leaf.any():
+                leafrays, leafnodes = rays[leaf], nodes[leaf]
+                firsts = self.bvh_starts[leafnodes]
+                counts = self.bvh_ends[leafnodes] - firsts
+                pairstarts = cumsum(counts) - counts
+                pairrays = repeat(leafrays, counts)
+                triangles = self.bvh_triangles[repeat(firsts - pairstarts, counts) + arange(counts.sum())]
+                distances = self._ray_distances(triangles, origins[pairrays], directions[pairrays])
+                minimum.at(best, pairrays, distances)
+
+            inner = ~leaf
+            rays = repeat(rays[inner], 2)
+            nodes = stack((children[inner], children[inner] + 1), axis=1).ravel()
+
+        best[best == inf] = nan
+        return best
+
+    def _ray_distances(self, triangles, origins, directions):
+        # Distances along the rays to the triangles (one ray per triangle), inf where it misses
+        planes = self.tri_planes[triangles]
+        normals = planes[:, 18:21]
+        denominators = (normals*directions).sum(axis=1)
+        with errstate(invalid="ignore", divide="ignore"):
+            t = ((planes[:, 0:3] - origins)*normals).sum(axis=1) / denominators
+        points = origins + directions*t[:, None]
+
+        hit = (denominators != 0.0) & (t >= 0.0)
+        for corner, edge in ((0, 9), (3, 12), (6, 15)):
+            sides = cross(planes[:, edge:edge+3], points - planes[:, corner:corner+3])
+            hit &= (normals*sides).sum(axis=1) > 0
+
+        return where(hit, t, inf)
@@ -0,0 +1,37 @@
+# Triangle meshes stored as typed arrays instead of lists of tuples. The loaders (OBJ and BCO files)
+# return them, Collision builds its grid and bounding volume hierarchy from them and the renderers
+# draw them, so a mesh never turns into Python objects per vertex or per triangle on the way.
+from numpy import asarray, zeros, float32, int32, uint16
+
+
+class CollisionMesh(object):
+    # vertices is a float32 (n, 3) array, faces an int32 (m, 3) array of 0-based vertex
+    # indices and types a uint16 array with the collision type of every face (0 for
+    # formats that have no collision types).
+    __slots__ = ("vertices", "faces", "types")
+
+    def __init__(self, vertices, faces, types=None):
+        self.vertices = asarray(vertices, dtype=float32).reshape(-1, 3)
+        self.faces = asarray(faces, dtype=int32).reshape(-1, 3)
+        if types is None:
+            self.types = zeros(len(self.faces), dtype=uint16)
+        else:
+            self.types = asarray(types, dtype=uint16)
+
+        if len(self.types) != len(self.faces):
+            raise RuntimeError("Mesh has {0} faces but {1} collision types".format(len(self.faces), len(self.types)))
+        if len(self.faces) > 0 and (self.faces.min() < 0 or self.faces.max() >= len(self.vertices)):
+            raise RuntimeError("Mesh has faces with vertex indices outside of its {0} vertices".format(
+                len(self.vertices)))
+
+    @classmethod
+    def from_obj_faces(cls, vertices, faces):
+        # From a list of (x, y, z) vertices and a list of faces in the format of py_obj.read_obj,
+        # ((v1, texcoord), (v2, texcoord), (v3, texcoord)) with 1-based vertex indices
+        return cls(vertices, [(v1[0] - 1, v2[0] - 1, v3[0] - 1) for v1, v2, v3 in faces])
+
+    def __len__(self):
+        return len(self.faces)
+
+    def nbytes(self):
+        return self.vertices.nbytes + self.faces.nbytes + self.types.nbytes
@@ -1,10 +1,12 @@
 import json
-from struct import unpack, pack
-from numpy import ndarray, array
+from struct import unpack, pack, Struct
+from numpy import ndarray, array, zeros, minimum, maximum
 from binascii import hexlify
 from math import cos, sin
-from .vectors import Vector3
+from .vectors import Vector3, Vector3View
 from collections import OrderedDict
+from functools import partial
+from heapq import heappush, heappop
 from io import BytesIO
 from copy import deepcopy
 
@@ -70,6 +72,8 @@ def write_padding(f, multiple):
 
 
 class Rotation(object):
+    __slots__ = ("mtx",)
+
     def __init__(self, forward, up, left):
         self.mtx = ndarray(shape=(4,4), dtype=float, order="F")
 
@@ -102,7 +106,8 @@ class Rotation(object):
             0.0, 0.0, 0.0, 1.0
         ]))
 
-        self.mtx = self.mtx.dot(mtx)
+        # Changed in place, the matrix can be a view of SectionColumns data
+        self.mtx[:] = self.mtx.dot(mtx)
 
     def rotate_around_y(self, degrees):
         mtx = ndarray(shape=(4,4), dtype=float, order="F", buffer=array([
@@ -112,7 +117,8 @@ class Rotation(object):
             0.0, 0.0, 0.0, 1.0
         ]))
 
-        self.mtx = self.mtx.dot(mtx)
+        # Changed in place, the matrix can be a view of SectionColumns data
+        self.mtx[:] = self.mtx.dot(mtx)
 
     def rotate_around_z(self, degrees):
         mtx = ndarray(shape=(4,4), dtype=float, order="F", buffer=array([
@@ -122,7 +128,8 @@ class Rotation(object):
             0.0, 0.0, 0.0, 1.0
         ]))
 
-        self.mtx = self.mtx.dot(mtx)
+        # Changed in place, the matrix can be a view of SectionColumns data
+        self.mtx[:] = self.mtx.dot(mtx)
 
     @classmethod
     def default(cls):
@@ -172,20 +179,19 @@ class Rotation(object):
         self.mtx[3][0] = self.mtx[3][1] = self.mtx[3][2] = 0.0
         self.mtx[3][3] = 1.0
 
-    def write(self, f):
+    def to_mkdd_rotation(self):
         forward = Vector3(self.mtx[0][0], self.mtx[0][2], -self.mtx[0][1])
         up = Vector3(self.mtx[2][0], self.mtx[2][2], -self.mtx[2][1])
 
-        f.write(pack(">hhh",
-                     int(round(forward.x * 10000)),
-                     int(round(forward.y * 10000)),
-                     int(round(forward.z * 10000))
-                     ))
-        f.write(pack(">hhh",
-                     int(round(up.x * 10000)),
-                     int(round(up.y * 10000)),
-                     int(round(up.z * 10000))
-                     ))
+        return (int(round(forward.x * 10000)),
+                int(round(forward.y * 10000)),
+                int(round(forward.z * 10000)),
+                int(round(up.x * 10000)),
+                int(round(up.y * 10000)),
+                int(round(up.z * 10000)))
+
+    def write(self, f):
+        f.write(pack(">hhhhhh", *self.to_mkdd_rotation()))
 
 
 class ObjectContainer(list):
@@ -202,6 +208,16 @@ class ObjectContainer(list):
 
         return container
 
+    @classmethod
+    def from_buffer(cls, data, offset, count, objcls):
+        container = cls()
+        size = objcls._struct.size
+
+        for i in range(count):
+            container.append(objcls.from_buffer(data, offset + i*size))
+
+        return container
+
 
 ENEMYITEMPOINT = 1
 CHECKPOINT = 2
@@ -217,6 +233,8 @@ MINIGAME = 11
 
 
 class ColorRGB(object):
+    __slots__ = ("r", "g", "b")
+
     def __init__(self, r, g, b):
         self.r = r
         self.g = g
@@ -231,6 +249,8 @@ class ColorRGB(object):
 
 
 class ColorRGBA(ColorRGB):
+    __slots__ = ("a",)
+
     def __init__(self, r, g, b, a):
         super().__init__(r, g, b)
         self.a = a
@@ -247,6 +267,10 @@ class ColorRGBA(ColorRGB):
 # Section 1
 # Enemy/Item Route Code Start
 class EnemyPoint(object):
+    __slots__ = ("position", "driftdirection", "link", "scale", "swerve", "itemsonly", "group",
+                 "driftacuteness", "driftduration", "unknown", "_size")
+    _struct = Struct(">fffHhfbBBBBH5s")
+    _struct_old = Struct(">fffHhfHBB")
 
     def __init__(self,
                  position,
@@ -300,6 +324,19 @@ class EnemyPoint(object):
             obj._size += 8
         return obj
 
+    @classmethod
+    def from_buffer(cls, data, offset, old_bol=False):
+        if not old_bol:
+            x, y, z, *args, padding = cls._struct.unpack_from(data, offset)
+            assert padding == b"\x00" * 5
+            obj = cls(Vector3(x, y, z), *args)
+            obj._size = cls._struct.size
+        else:
+            x, y, z, *args = cls._struct_old.unpack_from(data, offset)
+            obj = cls(Vector3(x, y, z), *args, 0, 0)
+            obj._size = cls._struct_old.size + 8
+        return obj
+
     def write(self, f):
         start = f.tell()
         f.write(pack(">fff", self.position.x, self.position.y, self.position.z))
@@ -308,6 +345,13 @@ class EnemyPoint(object):
         f.write(b"\x00"*5)
         #assert f.tell() - start == self._size
 
+    def pack_into(self, data, offset):
+        self._struct.pack_into(data, offset,
+                               self.position.x, self.position.y, self.position.z,
+                               self.driftdirection, self.link, self.scale,
+                               self.swerve, self.itemsonly, self.group, self.driftacuteness, self.driftduration,
+                               self.unknown, b"")
+
 
 class EnemyPointGroup(object):
     def __init__(self):
@@ -359,26 +403,44 @@ class EnemyPointGroups(object):
         self.groups = []
         self._group_ids = {}
 
+        # Index of link -> points with that link and a heap of unused link ids below
+        # _link_limit. Built on first use, see link_index and invalidate_links.
+        self._links = None
+        self._free_links = []
+        self._link_limit = 0
+
     @classmethod
     def from_file(cls, f, count, old_bol=False):
         enemypointgroups = cls()
-        curr_group = None
 
         for i in range(count):
             enemypoint = EnemyPoint.from_file(f, old_bol)
             print("Point", i, "in group", enemypoint.group, "links to", enemypoint.link)
-            if enemypoint.group not in enemypointgroups._group_ids:
-                # start of group
-                curr_group = EnemyPointGroup()
-                curr_group.id = enemypoint.group
-                enemypointgroups._group_ids[enemypoint.group] = curr_group
-                curr_group.points.append(enemypoint)
-                enemypointgroups.groups.append(curr_group)
-            else:
-                enemypointgroups._group_ids[enemypoint.group].points.append(enemypoint)
+            enemypointgroups._add_point(enemypoint)
+
+        return enemypointgroups
+
+    @classmethod
+    def from_buffer(cls, data, offset, count, old_bol=False):
+        enemypointgroups = cls()
+        size = EnemyPoint._struct_old.size if old_bol else EnemyPoint._struct.size
+
+        for i in range(count):
+            enemypointgroups._add_point(EnemyPoint.from_buffer(data, offset + i*size, old_bol))
 
         return enemypointgroups
 
+    def _add_point(self, enemypoint):
+        if enemypoint.group not in self._group_ids:
+            # start of group
+            curr_group = EnemyPointGroup()
+            curr_group.id = enemypoint.group
+            self._group_ids[enemypoint.group] = curr_group
+            curr_group.points.append(enemypoint)
+            self.groups.append(curr_group)
+        else:
+            self._group_ids[enemypoint.group].points.append(enemypoint)
+
     def points(self):
         for group in self.groups:
             for point in group.points:
@@ -387,30 +449,119 @@ class EnemyPointGroups(object):
     def new_group_id(self):
         return len(self.groups)
 
-    def used_links(self):
-        links = []
-        for group in self.groups:
-            for point in group.points:
-                point: EnemyPoint
-                if point.link != -1:
-                    if point.link not in links:
-                        links.append(point.link)
+    def link_index(self):
+        # Points by link, points without a link are stored under -1
+        if self._links is None:
+            links = {}
+            for group in self.groups:
+                for point in group.points:
+                    if point.link in links:
+                        links[point.link].append(point)
+                    else:
+                        links[point.link] = [point]
+
+            self._links = links
+            self._link_limit = max(links, default=-1) + 1
+            # Sorted, so it already is a heap
+            self._free_links = [i for i in range(self._link_limit) if i not in links]
+
+        return self._links
+
+    def invalidate_links(self):
+        # Needs to be called when points or links were changed without the methods below,
+        # the index is rebuilt on next use
+        self._links = None
+
+    def points_with_link(self, link):
+        return self.link_index().get(link, ())
+
+    def _index_point(self, point):
+        if self._links is None:
+            return
+
+        if point.link in self._links:
+            self._links[point.link].append(point)
+        else:
+            self._links[point.link] = [point]
+            if point.link >= self._link_limit:
+                for i in range(self._link_limit, point.link):
+                    heappush(self._free_links, i)
+                self._link_limit = point.link + 1
+
+    def _unindex_point(self, point):
+        if self._links is None:
+            return
+
+        points = self._links[point.link]
+        for i, other in enumerate(points):
+            if other is point:
+                del points[i]
+                break
+
+        if not points:
+            del self._links[point.link]
+            if point.link >= 0:
+                heappush(self._free_links, point.link)
+
+    def set_link(self, point, link):
+        self._unindex_point(point)
+        point.link = link
+        self._index_point(point)
+
+    def add_group(self, group):
+        self.groups.append(group)
+        for point in group.points:
+            self._index_point(point)
+
+    def remove_group(self, group):
+        self.groups.remove(group)
+        for point in group.points:
+            self._unindex_point(point)
+
+    def insert_point(self, group, point, index=-1):
+        group.insert_point(point, index)
+        self._index_point(point)
+
+    def remove_point(self, group, point):
+        group.points.remove(point)
+        self._unindex_point(point)
+
+    def split_group(self, group, point):
+        # The points after point are moved into a new group that is linked to the end of group
+        new_link = self.new_link_id()
+        if new_link >= 2**14:
+            raise RuntimeError("Too many links, cannot create more")
+
+        new_group = group.copy_group_after(self.new_group_id(), point)
+        for removed in group.points[group.points.index(point)+1:]:
+            self._unindex_point(removed)
+        group.remove_after(point)
+        self.add_group(new_group)
+
+        self.set_link(group.points[-1], new_link)
+        self.set_link(new_group.points[0], new_link)
+
+        return new_group
+
+    def duplicate_group(self, group):
+        new_group = group.copy_group(self.new_group_id())
+        self.add_group(new_group)
+        return new_group
 
-        return links
+    def used_links(self):
+        return [link for link in self.link_index() if link != -1]
 
     def new_link_id(self):
-        existing_links = self.used_links()
-        existing_links.sort()
-        if len(existing_links) == 0:
-            return 0
-
-        max_link = existing_links[-1]
-
-        for i in range(max_link):
-            if i not in existing_links:
-                return i
-
-        return max_link+1
+        # Lowest link that no point uses. Ids that were used again since they were
+        # freed are dropped from the heap here.
+        links = self.link_index()
+        while self._free_links and self._free_links[0] in links:
+            heappop(self._free_links)
+
+        if self._free_links:
+            return self._free_links[0]
+        else:
+            return self._link_limit
 
 
 # Enemy/Item Route Code End
@@ -420,6 +571,8 @@ class EnemyPointGroups(object):
 # Section 2
 # Checkpoint Group Code Start
 class CheckpointGroup(object):
+    _struct = Struct(">HH4h4h")
+
     def __init__(self, grouplink):
         self.points = []
         self._pointcount = 0
@@ -473,6 +626,16 @@ class CheckpointGroup(object):
 
         return checkpointgroup
 
+    @classmethod
+    def from_buffer(cls, data, offset):
+        pointcount, grouplink, *links = cls._struct.unpack_from(data, offset)
+        checkpointgroup = cls(grouplink)
+        checkpointgroup._pointcount = pointcount
+        checkpointgroup.prevgroup = list(links[:4])
+        checkpointgroup.nextgroup = list(links[4:])
+
+        return checkpointgroup
+
     def write(self, f):
         self._pointcount = len(self.points)
 
@@ -480,8 +643,16 @@ class CheckpointGroup(object):
         f.write(pack(">hhhh", *self.prevgroup))
         f.write(pack(">hhhh", *self.nextgroup))
 
+    def pack_into(self, data, offset):
+        self._pointcount = len(self.points)
+
+        self._struct.pack_into(data, offset, self._pointcount, self.grouplink, *self.prevgroup, *self.nextgroup)
+
 
 class Checkpoint(object):
+    __slots__ = ("start", "end", "mid", "unk1", "unk2", "unk3", "unk4")
+    _struct = Struct(">ffffffBBBB")
+
     def __init__(self, start, end, unk1=0, unk2=0, unk3=0, unk4=0):
         self.start = start
         self.end = end
@@ -509,11 +680,25 @@ class Checkpoint(object):
         assert unk3 == 0 or unk3 == 1
         return cls(start, end, unk1, unk2, unk3, unk4)
 
+    @classmethod
+    def from_buffer(cls, data, offset):
+        x1, y1, z1, x2, y2, z2, unk1, unk2, unk3, unk4 = cls._struct.unpack_from(data, offset)
+        assert unk4 == 0
+        assert unk2 == 0 or unk2 == 1
+        assert unk3 == 0 or unk3 == 1
+        return cls(Vector3(x1, y1, z1), Vector3(x2, y2, z2), unk1, unk2, unk3, unk4)
+
     def write(self, f):
         f.write(pack(">fff", self.start.x, self.start.y, self.start.z))
         f.write(pack(">fff", self.end.x, self.end.y, self.end.z))
         f.write(pack(">BBBB", self.unk1, self.unk2, self.unk3, self.unk4))
 
+    def pack_into(self, data, offset):
+        self._struct.pack_into(data, offset,
+                               self.start.x, self.start.y, self.start.z,
+                               self.end.x, self.end.y, self.end.z,
+                               self.unk1, self.unk2, self.unk3, self.unk4)
+
 
 class CheckpointGroups(object):
     def __init__(self):
@@ -534,6 +719,21 @@ class CheckpointGroups(object):
 
         return checkpointgroups
 
+    @classmethod
+    def from_buffer(cls, data, offset, count):
+        checkpointgroups = cls()
+
+        for i in range(count):
+            checkpointgroups.groups.append(CheckpointGroup.from_buffer(data, offset))
+            offset += CheckpointGroup._struct.size
+
+        for group in checkpointgroups.groups:
+            for i in range(group._pointcount):
+                group.points.append(Checkpoint.from_buffer(data, offset))
+                offset += Checkpoint._struct.size
+
+        return checkpointgroups
+
     def new_group_id(self):
         return len(self.groups)
 
@@ -546,6 +746,8 @@ class CheckpointGroups(object):
 # Section 3
 # Routes/Paths for cameras, objects and other things
 class Route(object):
+    _struct = Struct(">HHIB7s")
+
     def __init__(self):
         self.points = []
         self._pointcount = 0
@@ -572,6 +774,14 @@ class Route(object):
 
         return route
 
+    @classmethod
+    def from_buffer(cls, data, offset):
+        route = cls()
+        route._pointcount, route._pointstart, route.unk1, route.unk2, pad = cls._struct.unpack_from(data, offset)
+        assert pad == b"\x00"*7
+
+        return route
+
     def add_routepoints(self, points):
         for i in range(self._pointcount):
             self.points.append(points[self._pointstart+i])
@@ -581,10 +791,16 @@ class Route(object):
         f.write(pack(">IB", self.unk1, self.unk2))
         f.write(b"\x00"*7)
 
+    def pack_into(self, data, offset, pointstart):
+        self._struct.pack_into(data, offset, len(self.points), pointstart, self.unk1, self.unk2, b"")
+
 
 # Section 4
 # Route point for use with routes from section 3
 class RoutePoint(object):
+    __slots__ = ("position", "unk")
+    _struct = Struct(">fffI16s")
+
     def __init__(self, position):
         self.position = position
         self.unk = 0
@@ -605,15 +821,31 @@ class RoutePoint(object):
         assert padding == b"\x00"*16
         return point
 
+    @classmethod
+    def from_buffer(cls, data, offset):
+        x, y, z, unk, padding = cls._struct.unpack_from(data, offset)
+        assert padding == b"\x00"*16
+        point = cls(Vector3(x, y, z))
+        point.unk = unk
+
+        return point
+
     def write(self, f):
         f.write(pack(">fffI", self.position.x, self.position.y, self.position.z,
                      self.unk))
         f.write(b"\x00"*16)
 
+    def pack_into(self, data, offset):
+        self._struct.pack_into(data, offset, self.position.x, self.position.y, self.position.z, self.unk, b"")
+
 
 # Section 5
 # Objects
 class MapObject(object):
+    __slots__ = ("position", "scale", "rotation", "objectid", "pathid", "unk_28", "unk_2a", "presence_filter",
+                 "presence", "unk_flag", "unk_2f", "userdata", "widget", "_size")
+    _struct = Struct(">ffffff6hHhHhBBBB8h")
+
     def __init__(self, position, objectid):
         self.position = position
         self.scale = Vector3(1.0, 1.0, 1.0)
@@ -660,19 +892,49 @@ class MapObject(object):
         obj._size = f.tell() - start
         return obj
 
+    @classmethod
+    def from_buffer(cls, data, offset):
+        values = cls._struct.unpack_from(data, offset)
+
+        obj = cls(Vector3(*values[0:3]), values[12])
+        obj.scale = Vector3(*values[3:6])
+        obj.rotation = Rotation.from_mkdd_rotation(*values[6:12])
+        (obj.pathid, obj.unk_28, obj.unk_2a,
+         obj.presence_filter, obj.presence, obj.unk_flag, obj.unk_2f) = values[13:20]
+        obj.userdata = list(values[20:28])
+        obj._size = cls._struct.size
+        return obj
+
     def write(self, f):
         start = f.tell()
         f.write(pack(">fff", self.position.x, self.position.y, self.position.z))
         f.write(pack(">fff", self.scale.x, self.scale.y, self.scale.z))
         self.rotation.write(f)
 
-        f.write(pack(">hhHh", self.objectid, self.pathid, self.unk_28, self.unk_2a))
+        self.check_objectid()
+        f.write(pack(">HhHh", self.objectid, self.pathid, self.unk_28, self.unk_2a))
         f.write(pack(">BBBB", self.presence_filter, self.presence, self.unk_flag, self.unk_2f))
 
         for i in range(8):
             f.write(pack(">h", self.userdata[i]))
         #assert f.tell() - start == self._size
 
+    def check_objectid(self):
+        # The object id is read and written as unsigned. It used to be written as signed, which
+        # failed for ids above 0x7FFF, ids that don't fit are still an error instead of being wrapped.
+        if not 0 <= self.objectid <= 0xFFFF:
+            raise RuntimeError("Object id {0} is out of range (0-65535)".format(self.objectid))
+
+    def pack_into(self, data, offset):
+        self.check_objectid()
+        self._struct.pack_into(data, offset,
+                               self.position.x, self.position.y, self.position.z,
+                               self.scale.x, self.scale.y, self.scale.z,
+                               *self.rotation.to_mkdd_rotation(),
+                               self.objectid, self.pathid, self.unk_28, self.unk_2a,
+                               self.presence_filter, self.presence, self.unk_flag, self.unk_2f,
+                               *self.userdata)
+
 
 class MapObjects(object):
     def __init__(self):
@@ -692,6 +954,16 @@ class MapObjects(object):
 
         return mapobjs
 
+    @classmethod
+    def from_buffer(cls, data, offset, objectcount):
+        mapobjs = cls()
+        size = MapObject._struct.size
+
+        for i in range(objectcount):
+            mapobjs.objects.append(MapObject.from_buffer(data, offset + i*size))
+
+        return mapobjs
+
 
 # Section 6
 # Kart/Starting positions
@@ -700,6 +972,9 @@ POLE_RIGHT = 1
 
 
 class KartStartPoint(object):
+    __slots__ = ("position", "scale", "rotation", "poleposition", "playerid", "unknown")
+    _struct = Struct(">ffffff6hBBH")
+
     def __init__(self, position):
         self.position = position
         self.scale = Vector3(1.0, 1.0, 1.0)
@@ -729,12 +1004,29 @@ class KartStartPoint(object):
         #assert kstart.unknown == 0
         return kstart
 
+    @classmethod
+    def from_buffer(cls, data, offset):
+        values = cls._struct.unpack_from(data, offset)
+
+        kstart = cls(Vector3(*values[0:3]))
+        kstart.scale = Vector3(*values[3:6])
+        kstart.rotation = Rotation.from_mkdd_rotation(*values[6:12])
+        kstart.poleposition, kstart.playerid, kstart.unknown = values[12:15]
+        return kstart
+
     def write(self, f):
         f.write(pack(">fff", self.position.x, self.position.y, self.position.z))
         f.write(pack(">fff", self.scale.x, self.scale.y, self.scale.z))
         self.rotation.write(f)
         f.write(pack(">BBH", self.poleposition, self.playerid, self.unknown))
 
+    def pack_into(self, data, offset):
+        self._struct.pack_into(data, offset,
+                               self.position.x, self.position.y, self.position.z,
+                               self.scale.x, self.scale.y, self.scale.z,
+                               *self.rotation.to_mkdd_rotation(),
+                               self.poleposition, self.playerid, self.unknown)
+
 
 class KartStartPoints(object):
     def __init__(self):
@@ -750,10 +1042,24 @@ class KartStartPoints(object):
 
         return kspoints
 
+    @classmethod
+    def from_buffer(cls, data, offset, count):
+        kspoints = cls()
+        size = KartStartPoint._struct.size
+
+        for i in range(count):
+            kspoints.positions.append(KartStartPoint.from_buffer(data, offset + i*size))
+
+        return kspoints
+
 
 # Section 7
 # Areas
 class Area(object):
+    __slots__ = ("position", "scale", "rotation", "check_flag", "area_type", "camera_index", "unk1", "unk2",
+                 "unkfixedpoint", "unkshort", "shadow_id", "lightparam_index")
+    _struct = Struct(">ffffff6hBBhIIhhhh")
+
     def __init__(self, position):
         self.position = position
         self.scale = Vector3(1.0, 1.0, 1.0)
@@ -791,6 +1097,18 @@ class Area(object):
 
         return area
 
+    @classmethod
+    def from_buffer(cls, data, offset):
+        values = cls._struct.unpack_from(data, offset)
+
+        area = cls(Vector3(*values[0:3]))
+        area.scale = Vector3(*values[3:6])
+        area.rotation = Rotation.from_mkdd_rotation(*values[6:12])
+        (area.check_flag, area.area_type, area.camera_index, area.unk1, area.unk2,
+         area.unkfixedpoint, area.unkshort, area.shadow_id, area.lightparam_index) = values[12:21]
+
+        return area
+
     def write(self, f):
         f.write(pack(">fff", self.position.x, self.position.y, self.position.z))
         f.write(pack(">fff", self.scale.x, self.scale.y, self.scale.z))
@@ -799,6 +1117,14 @@ class Area(object):
         f.write(pack(">II", self.unk1, self.unk2))
         f.write(pack(">hhhh", self.unkfixedpoint, self.unkshort, self.shadow_id, self.lightparam_index))
 
+    def pack_into(self, data, offset):
+        self._struct.pack_into(data, offset,
+                               self.position.x, self.position.y, self.position.z,
+                               self.scale.x, self.scale.y, self.scale.z,
+                               *self.rotation.to_mkdd_rotation(),
+                               self.check_flag, self.area_type, self.camera_index, self.unk1, self.unk2,
+                               self.unkfixedpoint, self.unkshort, self.shadow_id, self.lightparam_index)
+
 
 class Areas(object):
     def __init__(self):
@@ -812,10 +1138,25 @@ class Areas(object):
 
         return areas
 
+    @classmethod
+    def from_buffer(cls, data, offset, count):
+        areas = cls()
+        size = Area._struct.size
+
+        for i in range(count):
+            areas.areas.append(Area.from_buffer(data, offset + i*size))
+
+        return areas
+
 
 # Section 8
 # Cameras
 class Camera(object):
+    __slots__ = ("position", "position2", "position3", "rotation", "unkbyte", "camtype", "startzoom",
+                 "camduration", "startcamera", "unk2", "unk3", "route", "routespeed", "endzoom", "nextcam",
+                 "name")
+    _struct = Struct(">fff6hffffffBBHHHHHhHHh4s")
+
     def __init__(self, position):
         self.position = position
         self.position2 = Vector3(0.0, 0.0, 0.0)
@@ -867,6 +1208,20 @@ class Camera(object):
 
         return cam
 
+    @classmethod
+    def from_buffer(cls, data, offset):
+        values = cls._struct.unpack_from(data, offset)
+
+        cam = cls(Vector3(*values[0:3]))
+        cam.rotation = Rotation.from_mkdd_rotation(*values[3:9])
+        cam.position2 = Vector3(*values[9:12])
+        cam.position3 = Vector3(*values[12:15])
+        (cam.unkbyte, cam.camtype, cam.startzoom, cam.camduration, cam.startcamera,
+         cam.unk2, cam.unk3, cam.route, cam.routespeed, cam.endzoom, cam.nextcam) = values[15:26]
+        cam.name = str(values[26], encoding="ascii")
+
+        return cam
+
     def write(self, f):
         f.write(pack(">fff", self.position.x, self.position.y, self.position.z))
         self.rotation.write(f)
@@ -879,10 +1234,24 @@ class Camera(object):
         assert len(self.name) == 4
         f.write(bytes(self.name, encoding="ascii"))
 
+    def pack_into(self, data, offset):
+        assert len(self.name) == 4
+        self._struct.pack_into(data, offset,
+                               self.position.x, self.position.y, self.position.z,
+                               *self.rotation.to_mkdd_rotation(),
+                               self.position2.x, self.position2.y, self.position2.z,
+                               self.position3.x, self.position3.y, self.position3.z,
+                               self.unkbyte, self.camtype, self.startzoom, self.camduration, self.startcamera,
+                               self.unk2, self.unk3, self.route, self.routespeed, self.endzoom, self.nextcam,
+                               bytes(self.name, encoding="ascii"))
+
 
 # Section 9
 # Jugem Points
 class JugemPoint(object):
+    __slots__ = ("position", "rotation", "respawn_id", "unk1", "unk2", "unk3")
+    _struct = Struct(">fff6hHHhh")
+
     def __init__(self, position):
         self.position = position
         self.rotation = Rotation.default()
@@ -907,15 +1276,34 @@ class JugemPoint(object):
 
         return jugem
 
+    @classmethod
+    def from_buffer(cls, data, offset):
+        values = cls._struct.unpack_from(data, offset)
+
+        jugem = cls(Vector3(*values[0:3]))
+        jugem.rotation = Rotation.from_mkdd_rotation(*values[3:9])
+        jugem.respawn_id, jugem.unk1, jugem.unk2, jugem.unk3 = values[9:13]
+
+        return jugem
+
     def write(self, f):
         f.write(pack(">fff", self.position.x, self.position.y, self.position.z))
         self.rotation.write(f)
         f.write(pack(">HHhh", self.respawn_id, self.unk1, self.unk2, self.unk3))
 
+    def pack_into(self, data, offset):
+        self._struct.pack_into(data, offset,
+                               self.position.x, self.position.y, self.position.z,
+                               *self.rotation.to_mkdd_rotation(),
+                               self.respawn_id, self.unk1, self.unk2, self.unk3)
+
 
 # Section 10
 # LightParam
 class LightParam(object):
+    __slots__ = ("color1", "color2", "unkvec")
+    _struct = Struct(">BBBBfffBBBB")
+
     def __init__(self):
         self.color1 = ColorRGBA(0x64, 0x64, 0x64, 0xFF)
         self.color2 = ColorRGBA(0x64, 0x64, 0x64, 0x00)
@@ -936,15 +1324,35 @@ class LightParam(object):
 
         return lp
 
+    @classmethod
+    def from_buffer(cls, data, offset):
+        values = cls._struct.unpack_from(data, offset)
+
+        lp = cls()
+        lp.color1 = ColorRGBA(*values[0:4])
+        lp.unkvec = Vector3(*values[4:7])
+        lp.color2 = ColorRGBA(*values[7:11])
+
+        return lp
+
     def write(self, f):
         self.color1.write(f)
         f.write(pack(">fff", self.unkvec.x, self.unkvec.y, self.unkvec.z))
         self.color2.write(f)
 
+    def pack_into(self, data, offset):
+        self._struct.pack_into(data, offset,
+                               self.color1.r, self.color1.g, self.color1.b, self.color1.a,
+                               self.unkvec.x, self.unkvec.y, self.unkvec.z,
+                               self.color2.r, self.color2.g, self.color2.b, self.color2.a)
+
 
 # Section 11
 # MG (MiniGame?)
 class MGEntry(object):
+    __slots__ = ("unk1", "unk2", "unk3", "unk4")
+    _struct = Struct(">hhhh")
+
     def __init__(self):
         self.unk1 = 0
         self.unk2 = 0
@@ -965,11 +1373,276 @@ class MGEntry(object):
 
         return mgentry
 
+    @classmethod
+    def from_buffer(cls, data, offset):
+        mgentry = cls()
+        mgentry.unk1, mgentry.unk2, mgentry.unk3, mgentry.unk4 = cls._struct.unpack_from(data, offset)
+
+        return mgentry
+
     def write(self, f):
         f.write(pack(">hhhh", self.unk1, self.unk2, self.unk3, self.unk4))
 
+    def pack_into(self, data, offset):
+        self._struct.pack_into(data, offset, self.unk1, self.unk2, self.unk3, self.unk4)
+
+
+# Position attributes, other Vector3 attributes, whether the records have a rotation and
+# the plain number fields with their numpy types for the sections that can be stored in
+# columns, see BOL.columns
+COLUMN_FIELDS = {
+    ENEMYITEMPOINT: (("position",), (), False,
+                     (("driftdirection", "i8"), ("link", "i8"), ("scale", "f8"), ("swerve", "i8"),
+                      ("itemsonly", "i8"), ("group", "i8"), ("driftacuteness", "i8"), ("driftduration", "i8"),
+                      ("unknown", "i8"))),
+    CHECKPOINT: (("start", "end"), (), False,
+                 (("unk1", "i8"), ("unk2", "i8"), ("unk3", "i8"), ("unk4", "i8"))),
+    ROUTEGROUP: (("position",), (), False, (("unk", "i8"),)),
+    OBJECTS: (("position",), ("scale",), True,
+              (("objectid", "i8"), ("pathid", "i8"), ("unk_28", "i8"), ("unk_2a", "i8"), ("presence_filter", "i8"),
+               ("presence", "i8"), ("unk_flag", "i8"), ("unk_2f", "i8"))),
+    KARTPOINT: (("position",), ("scale",), True, (("poleposition", "i8"), ("playerid", "i8"), ("unknown", "i8"))),
+    AREA: (("position",), ("scale",), True,
+           (("check_flag", "i8"), ("area_type", "i8"), ("camera_index", "i8"), ("unk1", "i8"), ("unk2", "i8"),
+            ("unkfixedpoint", "i8"), ("unkshort", "i8"), ("shadow_id", "i8"), ("lightparam_index", "i8"))),
+    CAMERA: (("position", "position2", "position3"), (), True,
+             (("unkbyte", "i8"), ("camtype", "i8"), ("startzoom", "i8"), ("camduration", "i8"),
+              ("startcamera", "i8"), ("unk2", "i8"), ("unk3", "i8"), ("route", "i8"), ("routespeed", "i8"),
+              ("endzoom", "i8"), ("nextcam", "i8"))),
+    RESPAWNPOINT: (("position",), (), True, (("respawn_id", "i8"), ("unk1", "i8"), ("unk2", "i8"), ("unk3", "i8")))
+}
+
+
+def column_dtype(section):
+    positionfields, otherfields, rotation, numberfields = COLUMN_FIELDS[section]
+    dtype = [(name, "f8", (3,)) for name in positionfields + otherfields]
+    if rotation:
+        dtype.append(("rotation", "f8", (4, 4)))
+    dtype.extend(numberfields)
+    return dtype
+
+
+def column_data(section, records):
+    # Column array with the values of records, the records aren't changed
+    positionfields, otherfields, rotation, numberfields = COLUMN_FIELDS[section]
+    data = zeros(len(records), dtype=column_dtype(section))
+    if not records:
+        return data
+    for name in positionfields + otherfields:
+        data[name] = [(vec.x, vec.y, vec.z) for vec in (getattr(record, name) for record in records)]
+    if rotation:
+        column = data["rotation"]
+        for i, record in enumerate(records):
+            column[i] = record.rotation.mtx
+    for name, dtype in numberfields:
+        data[name] = [getattr(record, name) for record in records]
+    return data
+
+
+def make_record_views(cls, section, data):
+    # New records of class cls for the rows of a column array of section, as views of the rows.
+    # Attributes that aren't columns (like MapObject.userdata) still have to be set.
+    viewcls = record_view_class(cls, section)
+    positionfields, otherfields, rotation, numberfields = COLUMN_FIELDS[section]
+    vectorcolumns = [(name, data[name]) for name in positionfields + otherfields]
+    rotations = data["rotation"] if rotation else None
+
+    records = []
+    for i in range(len(data)):
+        record = viewcls.__new__(viewcls)
+        record._rowslot = data[i]
+        for name, column in vectorcolumns:
+            setattr(record, name, Vector3View(column, i))
+        if rotations is not None:
+            record.rotation = Rotation.__new__(Rotation)
+            record.rotation.mtx = rotations[i]
+        records.append(record)
+
+    return records
+
+
+_record_views = {}
+
+
+def record_view_class(cls, section):
+    # Subclass of the record class cls whose number fields are properties reading and writing
+    # a row of the section's column array. Like vectors.Vector3View it adds no slots, so records
+    # are turned into views by changing their class and stay the same objects. The row is kept
+    # in the slot of the first number field.
+    viewcls = _record_views.get(cls)
+    if viewcls is None:
+        fields = [name for name, dtype in COLUMN_FIELDS[section][3]]
+        namespace = {"__slots__": (), "_rowslot": _slot_descriptor(cls, fields[0]),
+                     "__reduce_ex__": _reduce_record_view}
+        for name in fields:
+            namespace[name] = property(partial(_get_column_field, name), partial(_set_column_field, name))
+
+        viewcls = type(cls.__name__, (cls,), namespace)
+        _record_views[cls] = viewcls
+        _record_views[viewcls] = viewcls
+        SECTION_TYPES[viewcls] = SECTION_TYPES[cls]
+
+    return viewcls
+
+
+def _slot_descriptor(cls, name):
+    for base in cls.__mro__:
+        if name in base.__dict__.get("__slots__", ()):
+            return base.__dict__[name]
+    raise RuntimeError("{0} has no slot {1}".format(cls.__name__, name))
+
+
+def _get_column_field(name, record):
+    return record._rowslot[name].item()
+
+
+def _set_column_field(name, record, value):
+    record._rowslot[name] = value
+
+
+def _reduce_record_view(record, protocol):
+    # Copies and pickles of views are plain records that don't share the array
+    cls = type(record).__bases__[0]
+    state = {}
+    for base in cls.__mro__:
+        for name in base.__dict__.get("__slots__", ()):
+            if hasattr(record, name):
+                state[name] = getattr(record, name)
+    return _plain_record, (cls, state)
+
+
+def _plain_record(cls, state):
+    record = cls.__new__(cls)
+    for name, value in state.items():
+        setattr(record, name, value)
+    return record
+
+
+class SectionColumns(object):
+    # Columnar storage for the records (points for sections with groups) of a section: the Vector3
+    # attributes, rotation matrices and number fields of all records are kept in one structured
+    # numpy array. The records and their vectors stay the same objects but become views of its
+    # rows (see record_view_class and vectors.Vector3View), so whatever holds them sees changes
+    # made through the array and the other way around. Rotation matrices are replaced by views.
+    # Sections changed through the array directly have to be marked dirty, the methods here do that.
+    def __init__(self, bol, section, records, data=None):
+        # With data the records already are views of its rows, see make_record_views
+        self.bol = bol
+        self.section = section
+        self.records = list(records)
+        self.positionfields, self.otherfields, rotation, numberfields = COLUMN_FIELDS[section]
+
+        if data is not None:
+            self.data = data
+        else:
+            self._bind(rotation, numberfields)
+
+        self._views = []
+        for name in self.positionfields + self.otherfields:
+            self._views.append((name, [getattr(record, name) for record in self.records]))
+        if rotation:
+            self._views.append(("rotation", [record.rotation.mtx for record in self.records]))
+
+    def _bind(self, rotation, numberfields):
+        self.data = zeros(len(self.records), dtype=column_dtype(self.section))
+        bound = set()
+        for name in self.positionfields + self.otherfields:
+            column = self.data[name]
+            for i, record in enumerate(self.records):
+                vec = getattr(record, name)
+                if id(vec) in bound:
+                    # A vector used by several records can only be a view of one row
+                    vec = vec.copy()
+                view = Vector3View.bind(vec, column, i)
+                bound.add(id(view))
+                if view is not getattr(record, name):
+                    setattr(record, name, view)
+
+        if rotation:
+            column = self.data["rotation"]
+            for i, record in enumerate(self.records):
+                column[i] = record.rotation.mtx
+                record.rotation.mtx = column[i]
+
+        for name, dtype in numberfields:
+            self.data[name] = [getattr(record, name) for record in self.records]
+        for i, record in enumerate(self.records):
+            record.__class__ = record_view_class(type(record), self.section)
+            record._rowslot = self.data[i]
+
+    def is_current(self, records):
+        # False if records were added, removed or replaced or if an attribute of a record
+        # was replaced by an object that isn't a view of the array.
+        # Copies of records and vectors aren't views, e.g. in a deep copy of the BOL.
+        if len(records) != len(self.records):
+            return False
+        for a, b in zip(records, self.records):
+            if a is not b or _record_views.get(type(a)) is not type(a):
+                return False
+
+        for name, views in self._views:
+            for record, view in zip(self.records, views):
+                if name == "rotation":
+                    if record.rotation.mtx is not view:
+                        return False
+                elif getattr(record, name) is not view or type(view) is not Vector3View:
+                    return False
+
+        return True
+
+    def __len__(self):
+        return len(self.records)
+
+    def column(self, name):
+        # Columns of the array are views, other attributes are gathered into a new array
+        if name in self.data.dtype.names:
+            return self.data[name]
+        else:
+            return array([getattr(record, name) for record in self.records])
+
+    def set_column(self, name, values):
+        if name in self.data.dtype.names:
+            self.data[name] = values
+        else:
+            for record, value in zip(self.records, values):
+                setattr(record, name, value.item() if hasattr(value, "item") else value)
+        self.bol.mark_dirty(self.section)
+
+    def translate(self, delta, mask=None):
+        # Moves the positions of all records (or those where mask is True) by delta (x, y, z)
+        for name in self.positionfields:
+            column = self.data[name]
+            if mask is None:
+                column += delta
+            else:
+                column[mask] += delta
+        self.bol.mark_dirty(self.section)
+
+    def bounds(self):
+        # Smallest and largest position coordinates as two Vector3, None if the section is empty
+        if len(self.records) == 0:
+            return None
+
+        mins = self.data[self.positionfields[0]].min(axis=0)
+        maxs = self.data[self.positionfields[0]].max(axis=0)
+        for name in self.positionfields[1:]:
+            mins = minimum(mins, self.data[name].min(axis=0))
+            maxs = maximum(maxs, self.data[name].max(axis=0))
+
+        return Vector3(*mins.tolist()), Vector3(*maxs.tolist())
+
+
+# The BOL header after the 4 byte magic. Old (0012) files have no light color and light source.
+BOL_HEADER_0015 = Struct(">B3B4B3f")
+BOL_HEADER_0012 = Struct(">B3B")
+BOL_HEADER_COMMON = Struct(">BB7HB3BffHBB3BBBBBBI11I12s")
+
 
 class BOL(object):
+    # Debug mode: to_buffer(use_cache=True) compares the output using cached sections with a full
+    # rewrite. If they differ the full rewrite is returned and the section that differed is printed.
+    verify_cache = False
+
     def __init__(self):
         self.roll = 0
         self.rgb_ambient = ColorRGB(0x64, 0x64, 0x64)
@@ -1005,8 +1678,14 @@ class BOL(object):
         self.lightparams = ObjectContainer()
         self.mgentries = ObjectContainer()
 
+        # Encoded bytes of each section from the last to_buffer call, see mark_dirty
+        self._section_cache = {}
+        self._dirty_sections = set()
+
+        self._columns = {}
+
     def objects_with_position(self):
-        for group in self.enemypointgroups.groups.values():
+        for group in self.enemypointgroups.groups:
             for point in group.points:
                 yield point
 
@@ -1042,195 +1721,411 @@ class BOL(object):
 
 
     @classmethod
-    def from_file(cls, f):
-        bol = cls()
-        magic = f.read(4)
-        print(magic, type(magic))
-        assert magic == b"0015" or magic == b"0012"
-        old_bol = magic == b"0012"
-
-        bol.roll = read_uint8(f)
-        bol.rgb_ambient = ColorRGB.from_file(f)
-
-        if not old_bol:
-            bol.rgba_light = ColorRGBA.from_file(f)
-            bol.lightsource = Vector3(read_float(f), read_float(f), read_float(f))
-
-        bol.lap_count = read_uint8(f)
-        bol.music_id = read_uint8(f)
-
-        sectioncounts = {}
-        for i in (ENEMYITEMPOINT, CHECKPOINT, OBJECTS, AREA, CAMERA, ROUTEGROUP, RESPAWNPOINT):
-            sectioncounts[i] = read_uint16(f)
-
-        bol.fog_type = read_uint8(f)
-        bol.fog_color = ColorRGB.from_file(f)
-
-        bol.fog_startz = read_float(f)
-        bol.fog_endz = read_float(f)
-        bol.unk1 = read_uint16(f)
-        bol.unk2 = read_uint8(f)
-        bol.unk3 = read_uint8(f)
-        bol.shadow_color = ColorRGB.from_file(f)
-        bol.unk4 = read_uint8(f)
-        bol.unk5 = read_uint8(f)
-
-        sectioncounts[LIGHTPARAM] = read_uint8(f)
-        sectioncounts[MINIGAME] = read_uint8(f)
-        bol.unk6 = read_uint8(f)
-
-        filestart = read_uint32(f)
-        print(hex(f.tell()), filestart)
-        assert filestart == 0
-
-        sectionoffsets = {}
-        for i in range(11):
-            sectionoffsets[i+1] = read_uint32(f)
-
-        padding = f.read(12) # padding
-        assert padding == b"\x00"*12
-        endofheader = f.tell()
+    def from_file(cls, f, lazy=False):
+        # The whole file is read into one buffer, see from_buffer. Section offsets are
+        # relative to the start of the file.
+        f.seek(0)
+        return cls.from_buffer(f.read(), lazy)
 
+    @classmethod
+    def from_buffer(cls, data, lazy=False):
+        # With lazy set only the header is parsed right away. The buffer is kept and each
+        # section is decoded when its attribute is first used, e.g. for tools that only
+        # look at the music id or the objects of many courses.
+        bol, old_bol, sectioncounts, sectionoffsets = cls.from_header(data)
 
         #calculated_count = (sectionoffsets[CHECKPOINT] - sectionoffsets[ENEMYITEMPOINT])//0x20
         #assert sectioncounts[ENEMYITEMPOINT] == calculated_count
-        f.seek(sectionoffsets[ENEMYITEMPOINT])
-        bol.enemypointgroups = EnemyPointGroups.from_file(f, sectioncounts[ENEMYITEMPOINT], old_bol)
-
-        f.seek(sectionoffsets[CHECKPOINT])
-        bol.checkpoints = CheckpointGroups.from_file(f, sectioncounts[CHECKPOINT])
-
-        f.seek(sectionoffsets[ROUTEGROUP])
-        bol.routes = ObjectContainer.from_file(f, sectioncounts[ROUTEGROUP], Route)
-
-        f.seek(sectionoffsets[ROUTEPOINT])
-        routepoints = []
-        count = (sectionoffsets[OBJECTS] - sectionoffsets[ROUTEPOINT])//0x20
-        for i in range(count):
-            routepoints.append(RoutePoint.from_file(f))
+        routepointcount = (sectionoffsets[OBJECTS] - sectionoffsets[ROUTEPOINT])//0x20
+        kartpointcount = (sectionoffsets[AREA] - sectionoffsets[KARTPOINT])//0x28
+
+        loaders = {
+            "enemypointgroups": partial(EnemyPointGroups.from_buffer, data, sectionoffsets[ENEMYITEMPOINT],
+                                        sectioncounts[ENEMYITEMPOINT], old_bol),
+            "checkpoints": partial(CheckpointGroups.from_buffer, data, sectionoffsets[CHECKPOINT],
+                                   sectioncounts[CHECKPOINT]),
+            "routes": partial(_routes_from_buffer, data, sectionoffsets[ROUTEGROUP], sectioncounts[ROUTEGROUP],
+                              sectionoffsets[ROUTEPOINT], routepointcount),
+            "objects": partial(MapObjects.from_buffer, data, sectionoffsets[OBJECTS], sectioncounts[OBJECTS]),
+            "kartpoints": partial(KartStartPoints.from_buffer, data, sectionoffsets[KARTPOINT], kartpointcount),
+            "areas": partial(Areas.from_buffer, data, sectionoffsets[AREA], sectioncounts[AREA]),
+            "cameras": partial(ObjectContainer.from_buffer, data, sectionoffsets[CAMERA],
+                               sectioncounts[CAMERA], Camera),
+            "respawnpoints": partial(ObjectContainer.from_buffer, data, sectionoffsets[RESPAWNPOINT],
+                                     sectioncounts[RESPAWNPOINT], JugemPoint),
+            "lightparams": partial(ObjectContainer.from_buffer, data, sectionoffsets[LIGHTPARAM],
+                                   sectioncounts[LIGHTPARAM], LightParam),
+            "mgentries": partial(ObjectContainer.from_buffer, data, sectionoffsets[MINIGAME],
+                                 sectioncounts[MINIGAME], MGEntry)
+        }
+
+        bol.set_section_loaders(loaders, lazy)
+        return bol
 
-        for route in bol.routes:
-            route.add_routepoints(routepoints)
+    @classmethod
+    def from_header(cls, data):
+        # A BOL with only the header values set, the section counts and offsets are returned
+        # along with it
+        bol = cls()
+        magic = bytes(data[0:4])
+        print(magic, type(magic))
+        assert magic == b"0015" or magic == b"0012"
+        old_bol = magic == b"0012"
 
-        f.seek(sectionoffsets[OBJECTS])
-        bol.objects = MapObjects.from_file(f, sectioncounts[OBJECTS])
+        if not old_bol:
+            values = BOL_HEADER_0015.unpack_from(data, 4)
+            bol.rgba_light = ColorRGBA(*values[4:8])
+            bol.lightsource = Vector3(*values[8:11])
+            offset = 4 + BOL_HEADER_0015.size
+        else:
+            values = BOL_HEADER_0012.unpack_from(data, 4)
+            offset = 4 + BOL_HEADER_0012.size
 
-        f.seek(sectionoffsets[KARTPOINT])
-        bol.kartpoints = KartStartPoints.from_file(f, (sectionoffsets[AREA] - sectionoffsets[KARTPOINT])//0x28)
+        bol.roll = values[0]
+        bol.rgb_ambient = ColorRGB(*values[1:4])
 
-        f.seek(sectionoffsets[AREA])
-        bol.areas = Areas.from_file(f, sectioncounts[AREA])
+        values = BOL_HEADER_COMMON.unpack_from(data, offset)
+        bol.lap_count, bol.music_id = values[0:2]
 
-        f.seek(sectionoffsets[CAMERA])
-        bol.cameras = ObjectContainer.from_file(f, sectioncounts[CAMERA], Camera)
+        sectioncounts = dict(zip((ENEMYITEMPOINT, CHECKPOINT, OBJECTS, AREA, CAMERA, ROUTEGROUP, RESPAWNPOINT),
+                                 values[2:9]))
 
-        f.seek(sectionoffsets[RESPAWNPOINT])
-        bol.respawnpoints = ObjectContainer.from_file(f, sectioncounts[RESPAWNPOINT], JugemPoint)
+        bol.fog_type = values[9]
+        bol.fog_color = ColorRGB(*values[10:13])
+        bol.fog_startz, bol.fog_endz, bol.unk1, bol.unk2, bol.unk3 = values[13:18]
+        bol.shadow_color = ColorRGB(*values[18:21])
+        bol.unk4, bol.unk5 = values[21:23]
 
-        f.seek(sectionoffsets[LIGHTPARAM])
+        sectioncounts[LIGHTPARAM], sectioncounts[MINIGAME] = values[23:25]
+        bol.unk6 = values[25]
 
-        bol.lightparams = ObjectContainer.from_file(f, sectioncounts[LIGHTPARAM], LightParam)
+        filestart = values[26]
+        assert filestart == 0
 
-        f.seek(sectionoffsets[MINIGAME])
-        bol.mgentries = ObjectContainer.from_file(f, sectioncounts[MINIGAME], MGEntry)
+        sectionoffsets = dict(zip(range(1, 12), values[27:38]))
 
-        return bol
+        padding = values[38] # padding
+        assert padding == b"\x00"*12
 
-    def write(self, f):
-        f.write(b"0015")
-        f.write(pack(">B", self.roll))
-        self.rgb_ambient.write(f)
-        self.rgba_light.write(f)
-        f.write(pack(">fff", self.lightsource.x, self.lightsource.y, self.lightsource.z))
-        f.write(pack(">BB", self.lap_count, self.music_id))
+        return bol, old_bol, sectioncounts, sectionoffsets
+
+    def __getattr__(self, name):
+        # Only called for attributes that don't exist, i.e. sections of a lazily loaded
+        # file that weren't decoded yet
+        loaders = self.__dict__.get("_lazy_sections")
+        if loaders is None or name not in loaders:
+            raise AttributeError("'{0}' object has no attribute '{1}'".format(type(self).__name__, name))
+
+        value = loaders.pop(name)()
+        setattr(self, name, value)
+        if not loaders:
+            del self._lazy_sections
+        return value
+
+    def set_section_loaders(self, loaders, lazy=True):
+        # loaders maps section attributes to functions returning their contents
+        if lazy:
+            # Sections are decoded by __getattr__ the first time they are accessed
+            for name in loaders:
+                if name in self.__dict__:
+                    delattr(self, name)
+            self._lazy_sections = dict(loaders)
+        else:
+            for name, loader in loaders.items():
+                setattr(self, name, loader())
+
+    def load_sections(self):
+        # Decode all sections that weren't accessed yet
+        loaders = self.__dict__.get("_lazy_sections")
+        if loaders is not None:
+            for name in list(loaders):
+                getattr(self, name)
+
+    def __getstate__(self):
+        # The loaders of pending sections refer to this BOL and the data it was read from,
+        # so pickles and copies get all sections decoded instead
+        self.load_sections()
+        return self.__dict__
+
+    def __deepcopy__(self, memo):
+        self.load_sections()
+        copied = self.__class__.__new__(self.__class__)
+        memo[id(self)] = copied
+        copied.__dict__.update(deepcopy(self.__dict__, memo))
+        return copied
+
+    def write(self, f, use_cache=False):
+        f.write(self.to_buffer(use_cache))
+
+    def mark_dirty(self, *sections):
+        # Sections that were changed since the last save have to be marked as dirty, the others are
+        # copied from the bytes cached by the last to_buffer call. Adding, removing or reordering
+        # records is noticed without this, changes to the fields of existing records aren't.
+        for section in sections:
+            if section == ROUTEPOINT:
+                section = ROUTEGROUP
+            self._dirty_sections.add(section)
+
+    def mark_objects_dirty(self, objects):
+        # Record views (see SectionColumns) are registered in SECTION_TYPES when they are created
+        for obj in objects:
+            section = SECTION_TYPES.get(type(obj))
+            if section is not None:
+                self._dirty_sections.add(section)
+
+    def mark_all_dirty(self):
+        self._section_cache = {}
+        self._dirty_sections = set()
+
+    def _section_structure(self, section):
+        # The records of a section and the point counts of its groups. A cached section is only
+        # reused if it still consists of the same objects.
+        if section == ENEMYITEMPOINT:
+            groups = self.enemypointgroups.groups
+            counts = [(len(group.points), group.id) for group in groups]
+        elif section == CHECKPOINT:
+            groups = self.checkpoints.groups
+            counts = [len(group.points) for group in groups]
+        elif section == ROUTEGROUP:
+            groups = self.routes
+            counts = [len(group.points) for group in groups]
+        else:
+            return list(self._section_objects(section)), ()
+
+        records = list(groups)
+        for group in groups:
+            records.extend(group.points)
+
+        return records, tuple(counts)
+
+    def columns(self, section):
+        # Columnar storage of a section, see SectionColumns. It's created on first use and again
+        # when records were added, removed or replaced since then.
+        if section == ROUTEPOINT:
+            section = ROUTEGROUP
+        if section not in COLUMN_FIELDS:
+            raise RuntimeError("Section {0} can't be stored in columns".format(section))
+
+        records = self._section_points(section)
+        columns = self._columns.get(section)
+        if columns is None or not columns.is_current(records):
+            columns = SectionColumns(self, section, records)
+            self._columns[section] = columns
+
+        return columns
+
+    def set_columns(self, section, records, data):
+        # Columnar storage from data whose rows records already are views of, see make_record_views
+        self._columns[section] = SectionColumns(self, section, records, data)
+
+    def _section_points(self, section):
+        if section == ENEMYITEMPOINT:
+            return list(self.enemypointgroups.points())
+        elif section == CHECKPOINT:
+            return list(self.checkpoints.points())
+        elif section == ROUTEGROUP:
+            points = []
+            for route in self.routes:
+                points.extend(route.points)
+            return points
+        else:
+            return list(self._section_objects(section))
+
+    def _section_objects(self, section):
+        if section == OBJECTS:
+            return self.objects.objects
+        elif section == KARTPOINT:
+            return self.kartpoints.positions
+        elif section == AREA:
+            return self.areas.areas
+        elif section == CAMERA:
+            return self.cameras
+        elif section == RESPAWNPOINT:
+            return self.respawnpoints
+        elif section == LIGHTPARAM:
+            return self.lightparams
+        elif section == MINIGAME:
+            return self.mgentries
+        else:
+            raise RuntimeError("Unknown section: {0}".format(section))
+
+    def _pack_section(self, section, data, offset):
+        if section == ENEMYITEMPOINT:
+            for group in self.enemypointgroups.groups:
+                for point in group.points:
+                    point.group = group.id
+                    point.pack_into(data, offset)
+                    offset += EnemyPoint._struct.size
+
+        elif section == CHECKPOINT:
+            for group in self.checkpoints.groups:
+                group.pack_into(data, offset)
+                offset += CheckpointGroup._struct.size
+            for group in self.checkpoints.groups:
+                for point in group.points:
+                    point.pack_into(data, offset)
+                    offset += Checkpoint._struct.size
+
+        elif section == ROUTEGROUP:
+            # Route points directly follow the routes so both are handled as one section
+            index = 0
+            for route in self.routes:
+                route.pack_into(data, offset, index)
+                offset += Route._struct.size
+                index += len(route.points)
+
+            for route in self.routes:
+                for point in route.points:
+                    point.pack_into(data, offset)
+                    offset += RoutePoint._struct.size
 
+        else:
+            for obj in self._section_objects(section):
+                obj.pack_into(data, offset)
+                offset += obj._struct.size
+
+    def to_buffer(self, use_cache=False):
+        # The size of every section follows from the record counts, so the whole file is
+        # packed into a single bytearray without seeking back to fill in the section offsets.
+        # With use_cache, sections that weren't changed since the last cached call are copied
+        # from the cache. Changes to fields of existing records aren't detected, they have to be
+        # reported with mark_dirty or mark_objects_dirty, see there.
         enemypoints = 0
         for group in self.enemypointgroups.groups:
             enemypoints += len(group.points)
-        write_uint16(f, enemypoints)
-        write_uint16(f, len(self.checkpoints.groups))
-        write_uint16(f, len(self.objects.objects))
-        write_uint16(f, len(self.areas.areas))
-        write_uint16(f, len(self.cameras))
-        write_uint16(f, len(self.routes))
-        write_uint16(f, len(self.respawnpoints))
-
-        f.write(pack(">B", self.fog_type))
-        self.fog_color.write(f)
-        f.write(pack(">ffHBB",
-                self.fog_startz, self.fog_endz,
-                self.unk1, self.unk2, self.unk3))
-        self.shadow_color.write(f)
-        f.write(pack(">BB", self.unk4, self.unk5))
-        f.write(pack(">BB", len(self.lightparams), len(self.mgentries)))
-        f.write(pack(">B", self.unk6))
-
-        f.write(b"\x00"*4) # Filestart 0
-
-        offset_start = f.tell()
-        offsets = []
-        for i in range(11):
-            f.write(b"FOOB") # placeholder for offsets
-        f.write(b"\x00"*12) # padding
-
-        offsets.append(f.tell())
-        for group in self.enemypointgroups.groups:
-            #group = self.enemypointgroups.groups[groupindex]
-            for point in group.points:
-                point.group = group.id
-                point.write(f)
-
-        offsets.append(f.tell())
-        for group in self.checkpoints.groups:
-            group.write(f)
+        checkpoints = 0
         for group in self.checkpoints.groups:
-            for point in group.points:
-                point.write(f)
-
-        offsets.append(f.tell())
-
-        index = 0
-        for route in self.routes:
-            route.write(f, index)
-            index += len(route.points)
-
-        offsets.append(f.tell())
+            checkpoints += len(group.points)
+        routepoints = 0
         for route in self.routes:
-            for point in route.points:
-                point.write(f)
+            routepoints += len(route.points)
+
+        sectionsizes = (
+            enemypoints*EnemyPoint._struct.size,
+            len(self.checkpoints.groups)*CheckpointGroup._struct.size + checkpoints*Checkpoint._struct.size,
+            len(self.routes)*Route._struct.size,
+            routepoints*RoutePoint._struct.size,
+            len(self.objects.objects)*MapObject._struct.size,
+            len(self.kartpoints.positions)*KartStartPoint._struct.size,
+            len(self.areas.areas)*Area._struct.size,
+            len(self.cameras)*Camera._struct.size,
+            len(self.respawnpoints)*JugemPoint._struct.size,
+            len(self.lightparams)*LightParam._struct.size,
+            len(self.mgentries)*MGEntry._struct.size
+        )
 
-        offsets.append(f.tell())
-        for object in self.objects.objects:
-            object.write(f)
+        offsets = []
+        offset = 4 + BOL_HEADER_0015.size + BOL_HEADER_COMMON.size
+        for size in sectionsizes:
+            offsets.append(offset)
+            offset += size
+
+        data = bytearray(offset)
+        data[0:4] = b"0015"
+        BOL_HEADER_0015.pack_into(data, 4,
+                                  self.roll,
+                                  self.rgb_ambient.r, self.rgb_ambient.g, self.rgb_ambient.b,
+                                  self.rgba_light.r, self.rgba_light.g, self.rgba_light.b, self.rgba_light.a,
+                                  self.lightsource.x, self.lightsource.y, self.lightsource.z)
+        BOL_HEADER_COMMON.pack_into(data, 4 + BOL_HEADER_0015.size,
+                                    self.lap_count, self.music_id,
+                                    enemypoints, len(self.checkpoints.groups), len(self.objects.objects),
+                                    len(self.areas.areas), len(self.cameras), len(self.routes),
+                                    len(self.respawnpoints),
+                                    self.fog_type,
+                                    self.fog_color.r, self.fog_color.g, self.fog_color.b,
+                                    self.fog_startz, self.fog_endz,
+                                    self.unk1, self.unk2, self.unk3,
+                                    self.shadow_color.r, self.shadow_color.g, self.shadow_color.b,
+                                    self.unk4, self.unk5,
+                                    len(self.lightparams), len(self.mgentries),
+                                    self.unk6,
+                                    0, # Filestart 0
+                                    *offsets,
+                                    b"") # padding
+
+        spans = []
+        for i, section in enumerate(CACHED_SECTIONS):
+            if i+1 < len(CACHED_SECTIONS):
+                spans.append((section, offsets[section-1], offsets[CACHED_SECTIONS[i+1]-1]))
+            else:
+                spans.append((section, offsets[section-1], len(data)))
 
-        offsets.append(f.tell())
-        for startpoint in self.kartpoints.positions:
-            startpoint.write(f)
+        structures = {}
+        for section, start, end in spans:
+            if not use_cache:
+                self._pack_section(section, data, start)
+                continue
 
-        offsets.append(f.tell())
-        for area in self.areas.areas:
-            area.write(f)
+            structure = self._section_structure(section)
+            structures[section] = structure
+            cached = self._section_cache.get(section)
 
-        offsets.append(f.tell())
-        for camera in self.cameras:
-            camera.write(f)
-
-        offsets.append(f.tell())
-        for respawnpoint in self.respawnpoints:
-            respawnpoint.write(f)
-
-        offsets.append(f.tell())
-        for lightparam in self.lightparams:
-            lightparam.write(f)
-
-        offsets.append(f.tell())
-        for mgentry in self.mgentries:
-            mgentry.write(f)
-        print(len(offsets))
-        assert len(offsets) == 11
-        f.seek(offset_start)
-        for offset in offsets:
-            f.write(pack(">I", offset))
+            if (cached is not None and section not in self._dirty_sections
+                    and _same_structure(cached[0], structure)):
+                data[start:end] = cached[1]
+            else:
+                self._pack_section(section, data, start)
+                self._section_cache[section] = (structure, bytes(data[start:end]))
+
+        if use_cache:
+            self._dirty_sections = set()
+
+            if self.verify_cache:
+                full = self.to_buffer(use_cache=False)
+                if full != data:
+                    for section, start, end in spans:
+                        if full[start:end] != data[start:end]:
+                            print("Cached BOL section {0} at 0x{1:x} differs from a full rewrite, "
+                                  "a change wasn't marked dirty".format(section, start))
+                            self._section_cache[section] = (structures[section], bytes(full[start:end]))
+                    return full
+
+        return data
+
+
+def _routes_from_buffer(data, routeoffset, routecount, pointoffset, pointcount):
+    # Route points are stored in their own section after the routes
+    routes = ObjectContainer.from_buffer(data, routeoffset, routecount, Route)
+    routepoints = ObjectContainer.from_buffer(data, pointoffset, pointcount, RoutePoint)
+
+    for route in routes:
+        route.add_routepoints(routepoints)
+
+    return routes
+
+
+def _same_structure(old, new):
+    oldrecords, oldcounts = old
+    newrecords, newcounts = new
+    if oldcounts != newcounts or len(oldrecords) != len(newrecords):
+        return False
+
+    for a, b in zip(oldrecords, newrecords):
+        if a is not b:
+            return False
+    return True
+
+
+# Sections in the order they are written. Route points are part of the route group section.
+CACHED_SECTIONS = (ENEMYITEMPOINT, CHECKPOINT, ROUTEGROUP, OBJECTS, KARTPOINT, AREA, CAMERA, RESPAWNPOINT,
+                   LIGHTPARAM, MINIGAME)
+
+SECTION_TYPES = {
+    EnemyPoint: ENEMYITEMPOINT,
+    EnemyPointGroup: ENEMYITEMPOINT,
+    Checkpoint: CHECKPOINT,
+    CheckpointGroup: CHECKPOINT,
+    Route: ROUTEGROUP,
+    RoutePoint: ROUTEGROUP,
+    MapObject: OBJECTS,
+    KartStartPoint: KARTPOINT,
+    Area: AREA,
+    Camera: CAMERA,
+    JugemPoint: RESPAWNPOINT,
+    LightParam: LIGHTPARAM,
+    MGEntry: MINIGAME
+}
 
 
 with open("lib/mkddobjects.json", "r") as f:
@@ -7,6 +7,8 @@ from .vectors import Vector3
 from struct import unpack
 import os
 from OpenGL.GL import *
+from OpenGL import error as glerror
+from numpy import array, cross, sqrt, argsort, unique, repeat, ascontiguousarray, float32
 
 from PyQt5 import QtGui
 
@@ -974,42 +976,60 @@ colortypes = {
 otherwise = (40, 40, 40)
 
 
-class CollisionModel(object):
-    def __init__(self, mkdd_collision):
-        meshes = {}
-        self.program = None
-        vertices = mkdd_collision.vertices
-        self._displists = []
-        self.hidden_collision_types = set()
-        self.hidden_collision_type_groups = set()
+# Collision meshes are compiled from vertex arrays. If that raises an OpenGL error, or if this is
+# set to False, the faces are drawn one vertex at a time in immediate mode instead.
+COLLISION_VERTEX_ARRAYS = True
+
 
-        for v1, v2, v3, coltype, rest in mkdd_collision.triangles:
-            vertex1 = Vector3(*vertices[v1])
-            vertex1.z = -vertex1.z
-            vertex2 = Vector3(*vertices[v2])
-            vertex2.z = -vertex2.z
-            vertex3 = Vector3(*vertices[v3])
-            vertex3.z = -vertex3.z
+def _draw_collision_arrays(positions, normals, color):
+    # The arrays are read while the list is compiled, the list doesn't need them afterwards
+    glEnableVertexAttribArray(0)
+    glEnableVertexAttribArray(3)
+    try:
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, positions)
+        glVertexAttribPointer(3, 3, GL_FLOAT, GL_FALSE, 0, normals)
+        glVertexAttrib3f(4, *color)
+        glDrawArrays(GL_TRIANGLES, 0, len(positions))
+    finally:
+        glDisableVertexAttribArray(0)
+        glDisableVertexAttribArray(3)
 
-            v1tov2 = vertex2 - vertex1
-            v1tov3 = vertex3 - vertex1
 
-            normal = v1tov2.cross(v1tov3)
-            if normal.norm() != 0.0:
-                normal.normalize()
+def _draw_collision_immediate(positions, normals, color):
+    glBegin(GL_TRIANGLES)
+    for (x, y, z), (nx, ny, nz) in zip(positions.tolist(), normals.tolist()):
+        glVertexAttrib3f(3, nx, ny, nz)
+        glVertexAttrib3f(4, *color)
+        glVertex3f(x, y, z)
+    glEnd()
 
-            if coltype not in meshes:
-                meshes[coltype] = []
 
-            shift = coltype >> 8
+class CollisionModel(object):
+    def __init__(self, mesh):
+        # mesh is a collision_mesh.CollisionMesh, its faces are drawn grouped by collision type
+        self.program = None
+        self._displists = []
+        self.hidden_collision_types = set()
+        self.hidden_collision_type_groups = set()
 
-            if shift in colortypes:
-                color = colortypes[shift]
+        corners = mesh.vertices[mesh.faces]
+        # The normals are those of the mesh with z flipped
+        flipped = corners * array((1.0, 1.0, -1.0), dtype=float32)
+        normals = cross(flipped[:, 1] - flipped[:, 0], flipped[:, 2] - flipped[:, 0])
+        lengths = sqrt((normals**2).sum(axis=1))
+        normals[lengths != 0.0] /= lengths[lengths != 0.0, None]
+        positions = corners[:, :, (0, 2, 1)]
 
-            else:
-                color = otherwise
+        # The arrays of a collision type have three entries per face, one for each corner
+        meshes = {}
+        order = argsort(mesh.types, kind="stable")
+        coltypes, starts = unique(mesh.types[order], return_index=True)
+        for coltype, start, end in zip(coltypes.tolist(), starts.tolist(), starts[1:].tolist() + [len(order)]):
+            faces = order[start:end]
+            color = colortypes.get(coltype >> 8, otherwise)
             color = (color[0]/255.0, color[1]/255.0, color[2]/255.0)
-            meshes[coltype].append((vertex1, vertex2, vertex3, normal, color))
+            meshes[coltype] = (ascontiguousarray(positions[faces].reshape(-1, 3)),
+                               repeat(normals[faces], 3, axis=0), color)
 
         self.meshes = meshes
 
@@ -1017,25 +1037,28 @@ class CollisionModel(object):
         if self.program is None:
             self.create_shaders()
 
-        for meshtype, mesh in self.meshes.items():
-            displist = glGenLists(1)
-            glNewList(displist, GL_COMPILE)
-            glBegin(GL_TRIANGLES)
-
-            for v1, v2, v3, normal, color in mesh:
-                glVertexAttrib3f(3, normal.x, normal.y, normal.z)
-                glVertexAttrib3f(4, *color)
-                glVertex3f(v1.x, -v1.z, v1.y)
-                glVertexAttrib3f(3, normal.x, normal.y, normal.z)
-                glVertexAttrib3f(4, *color)
-                glVertex3f(v2.x, -v2.z, v2.y)
-                glVertexAttrib3f(3, normal.x, normal.y, normal.z)
-                glVertexAttrib3f(4, *color)
-                glVertex3f(v3.x, -v3.z, v3.y)
-
+        if COLLISION_VERTEX_ARRAYS:
+            try:
+                self._compile_displists(_draw_collision_arrays)
+                return
+            except glerror.Error as error:
+                print("Couldn't draw the collision from vertex arrays, using immediate mode:", error)
+                for meshtype, displist in self._displists:
+                    glDeleteLists(displist, 1)
+                self._displists = []
 
+        self._compile_displists(_draw_collision_immediate)
 
-            glEnd()
+    def _compile_displists(self, draw):
+        for meshtype, (positions, normals, color) in self.meshes.items():
+            displist = glGenLists(1)
+            glNewList(displist, GL_COMPILE)
+            try:
+                draw(positions, normals, color)
+            except:
+                glEndList()
+                glDeleteLists(displist, 1)
+                raise
             glEndList()
 
             self._displists.append((meshtype, displist))
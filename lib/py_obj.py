@@ -1,6 +1,9 @@
+from array import array
 from struct import unpack
 from OpenGL.GL import *
 
+from .collision_mesh import CollisionMesh
+
 
 def read_vertex(v_data):
     split = v_data.split("/")
@@ -140,6 +143,31 @@ def read_obj(objfile):
 
     return vertices, faces, normals
 
+def read_obj_mesh(objfile):
+    # Like read_obj, but returns the mesh as a CollisionMesh. Coordinates and vertex indices
+    # go straight into flat arrays instead of tuples.
+    vertices = array("f")
+    faces = array("i")
+
+    for line in objfile:
+        args = line.split()
+
+        if len(args) == 0 or args[0].startswith("#"):
+            continue
+        cmd = args[0]
+
+        if cmd == "v":
+            vertices.extend(map(float, args[1:4]))
+        elif cmd == "f":
+            # if it uses more than 3 vertices to describe a face then we panic!
+            # no triangulation yet.
+            if len(args) != 4:
+                raise RuntimeError("Model needs to be triangulated! Only faces with 3 vertices are supported.")
+            faces.extend(int(arg.split("/", 1)[0]) - 1 for arg in args[1:4])
+
+    return CollisionMesh(vertices, faces)
+
+
 def read_uint32(f):
     val = f.read(0x4)
     return unpack(">I", val)[0]
@@ -1,9 +1,12 @@
 from struct import pack, unpack
-from io import BytesIO
+from io import BytesIO, UnsupportedOperation
 from itertools import chain
-from .yaz0 import decompress, compress_fast, read_uint32, read_uint16
+from .yaz0 import Yaz0Reader, Yaz0Writer, compress, compress_incremental, read_uint32, read_uint16, LEVEL_FAST, LEVEL_LAZY, LEVEL_OPTIMAL
 
 import time
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 
 def write_uint32(f, val):
@@ -85,6 +88,54 @@ def stringtable_get_name(f, stringtable_offset, offset):
     return decodedfilename
 
 
+class StringTableReader(object):
+    # Decodes the whole string table of an archive at once. Names are looked up by
+    # their offset into the string table.
+    def __init__(self, data):
+        self._data = data
+        self._names = {}
+
+        offset = 0
+        for name in data.split(b"\x00"):
+            try:
+                self._names[offset] = name.decode("shift-jis")
+            except UnicodeDecodeError:
+                pass # Raise the error only if the name is actually used
+            offset += len(name) + 1
+
+    @classmethod
+    def from_file(cls, f, stringtable_offset, size):
+        curr = f.tell()
+        f.seek(stringtable_offset)
+        data = f.read(size)
+        f.seek(curr)
+
+        return cls(data)
+
+    def get_name(self, offset):
+        if offset in self._names:
+            return self._names[offset]
+
+        # Offset points into the middle of a string
+        end = self._data.find(b"\x00", offset)
+        if end == -1:
+            end = len(self._data)
+        filename = self._data[offset:end]
+        try:
+            decodedfilename = filename.decode("shift-jis")
+        except:
+            print("filename", filename)
+            print("failed")
+            raise
+        self._names[offset] = decodedfilename
+
+        return decodedfilename
+
+
+def normalize_path(path):
+    return path.replace("\\", "/").strip("/")
+
+
 def split_path(path): # Splits path at first backslash encountered
     for i, char in enumerate(path):
         if char == "/" or char == "\\":
@@ -106,7 +157,21 @@ class Directory(object):
         self.parent = None
 
     @classmethod
-    def from_dir(cls, path, follow_symlinks=False):
+    def from_dir(cls, path, follow_symlinks=False, workers=1, _jobs=None):
+        # With workers != 1 the directory tree is scanned first and the files are
+        # then read by a thread pool (workers=None uses the executor's default).
+        if workers != 1 and _jobs is None:
+            jobs = []
+            dir = cls.from_dir(path, follow_symlinks=follow_symlinks, _jobs=jobs)
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                files = executor.map(_read_file, [filepath for parent, filepath in jobs])
+                # Files are added in scan order so the archive layout doesn't depend on the worker count
+                for (parent, filepath), file in zip(jobs, files):
+                    parent.files[file.name] = file
+
+            return dir
+
         dirname = os.path.basename(path)
         #print(dirname, path)
         dir = cls(dirname)
@@ -115,20 +180,22 @@ class Directory(object):
         for entry in os.scandir(path):
             #print(entry.path, dirname)
             if entry.is_dir(follow_symlinks=follow_symlinks):
-                newdir = Directory.from_dir(entry.path, follow_symlinks=follow_symlinks)
+                newdir = Directory.from_dir(entry.path, follow_symlinks=follow_symlinks, _jobs=_jobs)
                 dir.subdirs[entry.name] = newdir
 
             elif entry.is_file(follow_symlinks=follow_symlinks):
-                with open(entry.path, "rb") as f:
-                    file = File.from_file(entry.name, f)
-                dir.files[entry.name] = file
+                if _jobs is not None:
+                    _jobs.append((dir, entry.path))
+                else:
+                    dir.files[entry.name] = _read_file(entry.path)
 
         return dir
 
 
 
     @classmethod
-    def from_node(cls, f, _name, stringtable_offset, globalentryoffset, dataoffset, nodelist, currentnodeindex, parents=None):
+    def from_node(cls, f, _name, stringtable, globalentryoffset, dataoffset, nodelist, currentnodeindex, parents=None,
+                  buffer=None):
         #print("=============================")
         #print("Creating new node with index", currentnodeindex)
         name, unknown, entrycount, entryoffset = nodelist[currentnodeindex]
@@ -149,7 +216,7 @@ class Directory(object):
             fileid, hashcode, flags, padbyte, nameoffset, filedataoffset, datasize, padding = unpack(">HHBBHIII", fileentry_data)
             #print("offset", hex(firstentry+i*20), fileid, flags, nameoffset)
 
-            name = stringtable_get_name(f, stringtable_offset, nameoffset)
+            name = stringtable.get_name(nameoffset)
 
             #print("name", name, fileid)
 
@@ -162,7 +229,7 @@ class Directory(object):
                 #nodeindex, datasize, padding = unpack(">III", fileentrydata)
                 nodeindex = filedataoffset
 
-                name = stringtable_get_name(f, stringtable_offset, nameoffset)
+                name = stringtable.get_name(nameoffset)
                 #print(name, hashcode, hash_name(name))
 
 
@@ -176,7 +243,8 @@ class Directory(object):
                     print("Skipping")
                     continue
 
-                subdir = Directory.from_node(f, name, stringtable_offset, globalentryoffset, dataoffset, nodelist, nodeindex, parents=newparents)
+                subdir = Directory.from_node(f, name, stringtable, globalentryoffset, dataoffset, nodelist, nodeindex, parents=newparents,
+                                             buffer=buffer)
                 subdir.parent = newdir
 
                 newdir.subdirs[subdir.name] = subdir
@@ -184,7 +252,10 @@ class Directory(object):
 
             else: # entry is a file
                 f.seek(offset)
-                file = File.from_fileentry(f, stringtable_offset, dataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize)
+                file = File.from_fileentry(f, stringtable, dataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize,
+                                           buffer=buffer)
+                file._entry_offset = offset
+                file._data_offset = filedataoffset
                 newdir.files[file.name] = file
 
         return newdir
@@ -251,20 +322,37 @@ class Directory(object):
         entries.extend(dir.subdirs.keys())
         return entries
 
-    def extract_to(self, path):
+    def extract_to(self, path, workers=1, _jobs=None):
+        # Like from_dir, workers != 1 creates the directories first and writes
+        # the files out with a thread pool.
+        if workers != 1 and _jobs is None:
+            jobs = []
+            self.extract_to(path, _jobs=jobs)
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Consume the results so that errors from the workers are raised here
+                for _ in executor.map(_write_file, jobs):
+                    pass
+            return
+
         current_dirpath = os.path.join(path, self.name)
         os.makedirs(current_dirpath, exist_ok=True)
 
         for filename, file in self.files.items():
             filepath = os.path.join(current_dirpath, filename)
-            with open(filepath, "wb") as f:
-                file.dump(f)
+            if _jobs is not None:
+                _jobs.append((filepath, file))
+            else:
+                _write_file((filepath, file))
 
         for dirname, dir in self.subdirs.items():
-            dir.extract_to(current_dirpath)
+            dir.extract_to(current_dirpath, _jobs=_jobs)
 
 
 class File(BytesIO):
+    # Files read from an archive with lazy=True don't have their own copy of the data. Instead they
+    # keep a memoryview into the archive buffer that is used for reading and only copied into the
+    # file's own buffer once the file is modified.
     def __init__(self, filename, fileid=None, hashcode=None, flags=None):
         super().__init__()
 
@@ -273,18 +361,30 @@ class File(BytesIO):
         self._hashcode = hashcode
         self._flags = flags
 
+        self._view = None
+        self._viewpos = 0
+
+        # Set when the file is modified, and where the file is located in the archive
+        # file it was last read from or written to. Used by Archive.update_arc.
+        self._dirty = False
+        self._entry_offset = None
+        self._data_offset = None
+        self._slot_size = None
+
     @classmethod
     def from_file(cls, filename, f):
         file = cls(filename)
 
         file.write(f.read())
         file.seek(0)
+        file._dirty = False
 
         return file
 
     @classmethod
-    def from_fileentry(cls, f, stringtable_offset, globaldataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize):
-        filename = stringtable_get_name(f, stringtable_offset, nameoffset)
+    def from_fileentry(cls, f, stringtable, globaldataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize,
+                       buffer=None):
+        filename = stringtable.get_name(nameoffset)
         """print("-----")
         print("File", len(filename))
         print("size", datasize)
@@ -292,52 +392,201 @@ class File(BytesIO):
         print(hex(datasize))"""
         file = cls(filename, fileid, hashcode, flags)
 
-        f.seek(globaldataoffset+filedataoffset)
-        file.write(f.read(datasize))
+        if buffer is not None:
+            start = globaldataoffset+filedataoffset
+            file._view = buffer[start:start+datasize]
+        else:
+            f.seek(globaldataoffset+filedataoffset)
+            file.write(f.read(datasize))
+            # Reset file position
+            file.seek(0)
+            file._dirty = False
         DATA[0] += datasize
-        # Reset file position
-        file.seek(0)
 
         return file
 
+    def is_shared(self):
+        return self._view is not None
+
+    def is_dirty(self):
+        return self._dirty
+
+    def _unshare(self):
+        # Copies the data out of the archive buffer, needs to happen before the data is modified.
+        if self._view is not None:
+            view = self._view
+            pos = self._viewpos
+            self._view = None
+            super().write(view)
+            super().seek(pos)
+            view.release()
+
+    def set_data(self, data):
+        # Replaces the contents of the file with data without copying it, the file shares
+        # data like a file read with lazy=True. data must not be modified afterwards.
+        super().seek(0)
+        super().truncate()
+        if self._view is not None:
+            self._view.release()
+        self._view = memoryview(data).toreadonly()
+        self._viewpos = 0
+        self._dirty = True
+
+    def read(self, size=-1):
+        if self._view is None:
+            return super().read(size)
+
+        start = self._viewpos
+        if size is None or size < 0:
+            end = len(self._view)
+        else:
+            end = min(len(self._view), start + size)
+
+        if end <= start:
+            return b""
+        self._viewpos = end
+        return bytes(self._view[start:end])
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def readinto(self, buffer):
+        if self._view is None:
+            return super().readinto(buffer)
+
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        if self._view is None:
+            return super().seek(offset, whence)
+
+        if whence == 0:
+            pos = offset
+        elif whence == 1:
+            pos = self._viewpos + offset
+        elif whence == 2:
+            pos = len(self._view) + offset
+        else:
+            raise ValueError("Invalid whence: {0}".format(whence))
+
+        if pos < 0:
+            raise ValueError("negative seek value {0}".format(pos))
+
+        self._viewpos = pos
+        return pos
+
+    def tell(self):
+        if self._view is None:
+            return super().tell()
+        return self._viewpos
+
+    def getvalue(self):
+        if self._view is None:
+            return super().getvalue()
+        return bytes(self._view)
+
+    def getbuffer(self):
+        # Read-only, files are modified through write. Files that share their data return a
+        # view of it, so reading through the buffer doesn't copy the data or mark the file dirty.
+        if self._view is not None:
+            return self._view[:]
+        return super().getbuffer().toreadonly()
+
+    def write(self, data):
+        self._unshare()
+        self._dirty = True
+        return super().write(data)
+
+    def writelines(self, lines):
+        self._unshare()
+        self._dirty = True
+        return super().writelines(lines)
+
+    def truncate(self, size=None):
+        self._unshare()
+        self._dirty = True
+        return super().truncate(size)
+
+    def readline(self, size=-1):
+        self._unshare()
+        return super().readline(size)
+
+    def readlines(self, hint=-1):
+        self._unshare()
+        return super().readlines(hint)
+
+    def __next__(self):
+        self._unshare()
+        return super().__next__()
+
+    def size(self):
+        if self._view is not None:
+            return len(self._view)
+
+        with super().getbuffer() as buffer:
+            return buffer.nbytes
+
     def dump(self, f):
-        f.write(self.getvalue())
+        if self._view is not None:
+            f.write(self._view)
+        else:
+            with super().getbuffer() as buffer:
+                f.write(buffer)
 
 
 class Archive(object):
+    # Paths are looked up through a flat index that is built when an archive is loaded.
+    # If an entry was added, removed or replaced by modifying the directories directly,
+    # the lookup falls back to walking the directories along the path and indexes what it finds.
     def __init__(self):
         self.root = None
+        self._yaz0_checkpoint = None
+        self._mmap = None
+
+        self._path_index = {}   # path -> (entry, parent directory, name)
+        self._hash_index = {}   # hash_name of lowercase path -> [(lowercase path, path)]
+
+        # Uncompressed archive file that the archive was last read from or written to,
+        # see update_arc
+        self._saved_path = None
+        self._saved_size = None
+        self._saved_data_offset = None
+        self._saved_structure = None
 
     @classmethod
-    def from_dir(cls, path, follow_symlinks=False):
+    def from_dir(cls, path, follow_symlinks=False, workers=1):
         arc = cls()
-        dir = Directory.from_dir(path, follow_symlinks=follow_symlinks)
+        dir = Directory.from_dir(path, follow_symlinks=follow_symlinks, workers=workers)
         arc.root = dir
+        arc.rebuild_index()
 
         return arc
 
 
     @classmethod
-    def from_file(cls, f):
+    def from_file(cls, f, lazy=False):
+        # With lazy=True the file data isn't copied out of the archive. Uncompressed archives
+        # are memory-mapped if f is a real file (which must not be overwritten while the
+        # archive is in use, call unmap first) and compressed archives are decompressed into a
+        # single buffer.
         newarc = cls()
         print("ok")
         header = f.read(4)
+        buffer = None
+        compressed = header == b"Yaz0"
+        path = getattr(f, "name", None)
 
         if header == b"Yaz0":
-            # Decompress first
-            print("Yaz0 header detected, decompressing...")
-            start = time.time()
-            tmp = BytesIO()
-            f.seek(0)
-            decompress(f, tmp)
-            #with open("decompressed.bin", "wb") as g:
-            #    decompress(f,)
-            f = tmp
-            f.seek(0)
+            # The archive is decompressed on demand as it is being read
+            print("Yaz0 header detected, decompressing on demand...")
+            f = Yaz0Reader(f)
 
             header = f.read(4)
-            print("Finished decompression.")
-            print("Time taken:", time.time() - start)
+
+        if lazy:
+            buffer = newarc._map_buffer(f)
 
         if header == b"RARC":
             pass
@@ -352,14 +601,14 @@ class Archive(object):
         node_count = read_uint32(f)
         f.read(8) # Unknown
         file_entry_offset = read_uint32(f) + 0x20
-        f.read(4) # Unknown
+        stringtable_size = read_uint32(f)
         stringtable_offset = read_uint32(f) + 0x20
         f.read(8) # Unknown
         nodes = []
 
         print("Archive has", node_count, " total directories")
 
-                
+        stringtable = StringTableReader.from_file(f, stringtable_offset, stringtable_size)
         
         #print("data offset", hex(data_offset))
         for i in range(node_count):
@@ -368,17 +617,87 @@ class Archive(object):
             nameoffset, unknown, entrycount, entryoffset = unpack(">IHHI", nodedata)
 
             if i == 0:
-                dir_name = stringtable_get_name(f, stringtable_offset, nameoffset)
+                dir_name = stringtable.get_name(nameoffset)
             else:
                 dir_name = None 
                 
             nodes.append((dir_name, unknown, entrycount, entryoffset))
 
         rootfoldername = nodes[0][0]
-        newarc.root = Directory.from_node(f, rootfoldername, stringtable_offset, file_entry_offset, data_offset, nodes, 0)
+        newarc.root = Directory.from_node(f, rootfoldername, stringtable, file_entry_offset, data_offset, nodes, 0,
+                                          buffer=buffer)
+        newarc.rebuild_index()
+
+        if not compressed and isinstance(path, str):
+            newarc._remember_saved_file(path, size, data_offset)
 
         return newarc
 
+    def _map_buffer(self, f):
+        if isinstance(f, Yaz0Reader):
+            return f.getbuffer()
+        elif isinstance(f, BytesIO):
+            return f.getbuffer().toreadonly()
+
+        try:
+            fileno = f.fileno()
+        except (AttributeError, UnsupportedOperation):
+            curr = f.tell()
+            f.seek(0)
+            buffer = memoryview(f.read())
+            f.seek(curr)
+            return buffer
+
+        self._mmap = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def unmap(self):
+        # Copies the data of the files that still share the memory-mapped archive file (see from_file
+        # with lazy=True) into their own buffers and closes the map. Has to be done before the archive
+        # file is rewritten or truncated, the files would read the new data or crash otherwise.
+        if self._mmap is None:
+            return
+
+        for file in self._mapped_files():
+            file._unshare()
+
+        try:
+            self._mmap.close()
+        except BufferError:
+            raise RuntimeError("The archive file can't be rewritten while its data is still in use")
+        self._mmap = None
+
+    def close(self):
+        # Closes the memory map of the archive file. Files that still read from it are closed as well
+        # instead of getting their own copy of the data, use unmap to keep them usable.
+        if self._mmap is None:
+            return
+
+        for file in self._mapped_files():
+            file._view.release()
+            file._view = None
+            file.close()
+
+        try:
+            self._mmap.close()
+        except BufferError:
+            raise RuntimeError("The archive file can't be closed while its data is still in use")
+        self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _mapped_files(self):
+        files = []
+        for dirpath, subdirnames, filenames in self.root.walk():
+            for file in self[dirpath].files.values():
+                if isinstance(file, File) and file.is_shared() and file._view.obj is self._mmap:
+                    files.append(file)
+        return files
+
     def listdir(self, path):
         if path == ".":
             return [self.root.name]
@@ -389,16 +708,97 @@ class Archive(object):
             entries.extend(dir.subdirs.keys())
             return entries
 
-    def __getitem__(self, path):
-        dirname, rest = split_path(path)
-
-        if rest is None or rest.strip() == "":
-            if dirname != self.root.name:
-                raise FileNotFoundError(path)
-            else:
-                return self.root
+    def rebuild_index(self):
+        self._path_index = {}
+        self._hash_index = {}
+        if self.root is not None:
+            self._index_directory(self.root, self.root.name, None)
+
+    def _index_directory(self, dir, dirpath, parent):
+        self._add_to_index(dirpath, dir, parent)
+
+        for filename, file in dir.files.items():
+            self._add_to_index(dirpath + "/" + filename, file, dir)
+        for dirname, subdir in dir.subdirs.items():
+            self._index_directory(subdir, dirpath + "/" + dirname, dir)
+
+    def _add_to_index(self, path, entry, parent):
+        if path not in self._path_index:
+            # Paths are hashed in lowercase so that these lookups don't depend on case
+            lowerpath = path.lower()
+            self._hash_index.setdefault(hash_name(lowerpath), []).append((lowerpath, path))
+        self._path_index[path] = (entry, parent, path.rpartition("/")[2])
+
+    def _indexed_entry(self, path):
+        # The entry is only valid if it and all of its parent directories are still
+        # attached where the index says they are
+        if path not in self._path_index:
+            return None
+
+        entry, parent, name = self._path_index[path]
+        if parent is None:
+            return entry if entry is self.root else None
+        elif isinstance(entry, Directory):
+            attached = parent.subdirs.get(name) is entry
         else:
-            return self.root[rest]
+            attached = parent.files.get(name) is entry
+
+        if not attached or self._indexed_entry(path.rpartition("/")[0]) is not parent:
+            return None
+        return entry
+
+    def _indexed_path_nocase(self, path):
+        lowerpath = path.lower()
+        for otherlowerpath, otherpath in self._hash_index.get(hash_name(lowerpath), ()):
+            if otherlowerpath == lowerpath:
+                return otherpath
+        return None
+
+    def _walk_path(self, path, case_sensitive):
+        # Looks up path in the directories themselves, for entries that were added or replaced
+        # since the index was built. Every directory on the way and the entry are indexed.
+        names = path.split("/")
+        if self.root is None or not _name_matches(self.root.name, names[0], case_sensitive):
+            return None
+
+        entry = self.root
+        entrypath = self.root.name
+        self._add_to_index(entrypath, entry, None)
+
+        for i, name in enumerate(names[1:], 1):
+            parent = entry
+            key, entry = _child(parent.subdirs, name, case_sensitive)
+            if entry is None and i == len(names) - 1:
+                key, entry = _child(parent.files, name, case_sensitive)
+            if entry is None:
+                return None
+
+            entrypath = entrypath + "/" + key
+            self._add_to_index(entrypath, entry, parent)
+
+        return entry
+
+    def find(self, path, case_sensitive=True):
+        # Returns the file or directory at path, or None if it doesn't exist.
+        path = normalize_path(path)
+
+        if case_sensitive:
+            indexpath = path
+        else:
+            indexpath = self._indexed_path_nocase(path)
+
+        if indexpath is not None:
+            entry = self._indexed_entry(indexpath)
+            if entry is not None:
+                return entry
+
+        return self._walk_path(path, case_sensitive)
+
+    def __getitem__(self, path):
+        entry = self.find(path)
+        if entry is None:
+            raise FileNotFoundError(path)
+        return entry
 
     def __setitem__(self, path, entry):
         dirname, rest = split_path(path)
@@ -413,34 +813,48 @@ class Archive(object):
         else:
             self.root[rest] = entry
 
-    def extract_to(self, path):
-        self.root.extract_to(path)
-
-    def write_arc_compressed(self, f):
-        temp = BytesIO()
-        self.write_arc(temp)
-        temp.seek(0)
-
-        compress_fast(temp, f)
-
-    def write_arc(self, f):
-        stringtable = StringTable()
-
-        nodes = BytesIO()
-        entries = BytesIO()
-        data = BytesIO()
+    def extract_to(self, path, workers=1):
+        self.root.extract_to(path, workers)
+
+    def write_arc_compressed(self, f, level=LEVEL_LAZY, workers=1, incremental=False):
+        if incremental:
+            # Only the part of the archive after the first changed byte since
+            # the last incremental save is compressed again.
+            temp = BytesIO()
+            self.write_arc(temp)
+            compressed, self._yaz0_checkpoint = compress_incremental(temp.getvalue(), self._yaz0_checkpoint,
+                                                                     level, workers)
+            f.write(compressed)
+        elif workers != 1:
+            temp = BytesIO()
+            self.write_arc(temp)
+            temp.seek(0)
+            compress(temp, f, level, workers)
+        else:
+            # The archive is compressed while it is being written
+            layout = self.calculate_layout()
+            writer = Yaz0Writer(f, layout.size, level)
+            self.write_arc(writer, layout)
+            writer.finish()
+
+    def calculate_layout(self):
+        # First pass of writing an archive: works out where everything goes
+        # using only the directory tree and the file sizes.
+        layout = ArchiveLayout()
+        stringtable = layout.stringtable
 
         nodecount = 1
-        entries = 0
+        entrycount = 0
 
         # Set up string table with all directory and file names
         stringtable.write_string(".")
         stringtable.write_string("..")
         stringtable.write_string(self.root.name)
 
-        for dir, subdirnames, filenames in self.root.walk():
+        for i, dirinfo in enumerate(self.root.walk()):
+            dirpath, subdirnames, filenames = dirinfo
             nodecount += len(subdirnames)
-            entries += len(subdirnames) + len(filenames)
+            entrycount += len(subdirnames) + len(filenames) + 2 # Each directory has two special entries being the current and the parent directories
 
             for name in subdirnames:
                 stringtable.write_string(name)
@@ -448,43 +862,55 @@ class Archive(object):
             for name in filenames:
                 stringtable.write_string(name)
 
-        f.write(b"RARC")
-        f.write(b"FOO ") # placeholder for filesize
-        write_uint32(f, 0x20)  #Unknown but often 0x20?
-        f.write(b"BAR ") # placeholder for data offset
-        f.write(b"\x00"*16) # 4 unknown ints
-
-        write_uint32(f, nodecount)
-        write_uint32(f, 0x20) # unknown
-        f.write(b"\x00"*4) # 1 unknown ints
-
-        #aligned_file_entry_offset = (0x20 + 44 + (nodecount*16) + 0x1F) & 0x20
-        #write_uint32(f, aligned_file_entry_offset)  # Offset to file entries aligned to multiples of 0x20
-        write_uint32(f, 0xF0F0F0F0)
-
-        f.write(b"\x00"*4) # 1 unknown int
-
-        #aligned_stringtable_offset = aligned_file_entry_offset + ((entries * 20) + 0x1F) & 0x20
-        #write_uint32(f, aligned_stringtable_offset)
-        write_uint32(f, 0xF0F0F0F0)
-
-        f.write(b"\x00"*8) # 2 unknown ints
-
-        node_offset = f.tell()
-
-        first_file_entry_index = 0
-
-        dirlist = []
-
-        #aligned_data_offset = aligned_stringtable_offset + (stringtable.size() + 0x1F) & 0x20
-
-        for i, dirinfo in enumerate(self.root.walk()):
-            dirpath, dirnames, filenames = dirinfo
             dir = self[dirpath]
             dir._nodeindex = i
+            layout.dirs.append(dir)
 
-            dirlist.append(dir)
+        datasize = 0
+        for dir in layout.dirs:
+            for filename, file in dir.files.items():
+                size = file_size(file)
+                layout.files.append((file, datasize, size))
+                datasize = align32(datasize + size)
+
+        layout.nodecount = nodecount
+        layout.entrycount = entrycount
+        layout.file_entry_offset = align32(0x40 + len(layout.dirs)*16)
+        layout.stringtable_offset = align32(layout.file_entry_offset + entrycount*20)
+        layout.stringtable_size = align32(stringtable.size())
+        layout.data_offset = layout.stringtable_offset + layout.stringtable_size
+        layout.size = layout.data_offset + datasize
+
+        return layout
+
+    def write_arc(self, f, layout=None):
+        # Second pass: headers are written with the offsets from the layout and the file data
+        # is streamed to f afterwards, so f doesn't need to support seeking.
+        if layout is None:
+            layout = self.calculate_layout()
+        stringtable = layout.stringtable
+        data_size = layout.size - layout.data_offset
+
+        header = BytesIO()
+        header.write(b"RARC")
+        write_uint32(header, layout.size)
+        write_uint32(header, 0x20)  #Unknown but often 0x20?
+        write_uint32(header, layout.data_offset-0x20)
+        write_uint32(header, data_size)
+        write_uint32(header, data_size)
+        header.write(b"\x00"*8) # 2 unknown ints
+
+        write_uint32(header, layout.nodecount)
+        write_uint32(header, 0x20) # unknown
+        write_uint32(header, layout.entrycount)
+        write_uint32(header, layout.file_entry_offset-0x20) # Offset to file entries aligned to multiples of 0x20
+        write_uint32(header, layout.stringtable_size)
+        write_uint32(header, layout.stringtable_offset-0x20)
+        header.write(b"\x00"*8) # 2 unknown ints
 
+        first_file_entry_index = 0
+
+        for i, dir in enumerate(layout.dirs):
             if i == 0:
                 nodetype = b"ROOT"
             else:
@@ -492,83 +918,232 @@ class Archive(object):
                 if len(nodetype) < 4:
                     nodetype = nodetype + (b"\x00"*(4 - len(nodetype)))
 
-            f.write(nodetype)
-            write_uint32(f, stringtable.get_string_offset(dir.name))
+            header.write(nodetype)
+            write_uint32(header, stringtable.get_string_offset(dir.name))
             hash = hash_name(dir.name)
 
-            entrycount = len(dirnames) + len(filenames)
-            write_uint16(f, hash)
-            write_uint16(f, entrycount+2)
+            entrycount = len(dir.subdirs) + len(dir.files)
+            write_uint16(header, hash)
+            write_uint16(header, entrycount+2)
 
-            write_uint32(f, first_file_entry_index)
-            first_file_entry_index += entrycount + 2 # Each directory has two special entries being the current and the parent directories
+            write_uint32(header, first_file_entry_index)
+            first_file_entry_index += entrycount + 2
 
-        write_pad32(f)
+        write_pad32(header)
+        assert header.tell() == layout.file_entry_offset
 
-        current_file_entry_offset = f.tell()
-        #assert f.tell() == aligned_file_entry_offset
         fileid = 0
+        files = iter(layout.files)
 
-        for dir in dirlist:
+        for dir in layout.dirs:
             for filename, file in dir.files.items():
-                write_uint16(f, fileid)
-                write_uint16(f, hash_name(filename))
-                f.write(b"\x11\x00") # Flag for file+padding
-                write_uint16(f, stringtable.get_string_offset(filename))
-
-                filedata_offset = data.tell()
-                write_uint32(f, filedata_offset) # Write file data offset
-                data.write(file.getvalue()) # Write file data
-                write_uint32(f, data.tell()-filedata_offset) # Write file size
-                write_pad32(data)
-                write_uint32(f, 0)
+                _file, filedata_offset, size = next(files)
+                assert _file is file
+
+                write_uint16(header, fileid)
+                write_uint16(header, hash_name(filename))
+                header.write(b"\x11\x00") # Flag for file+padding
+                write_uint16(header, stringtable.get_string_offset(filename))
+                write_uint32(header, filedata_offset) # Write file data offset
+                write_uint32(header, size) # Write file size
+                write_uint32(header, 0)
 
                 fileid += 1
 
             specialdirs = [(".", dir), ("..", dir.parent)]
 
             for subdirname, subdir in chain(specialdirs, dir.subdirs.items()):
-                write_uint16(f, 0xFFFF)
-                write_uint16(f, hash_name(subdirname))
-                f.write(b"\x02\x00") # Flag for directory+padding
-                write_uint16(f, stringtable.get_string_offset(subdirname))
+                write_uint16(header, 0xFFFF)
+                write_uint16(header, hash_name(subdirname))
+                header.write(b"\x02\x00") # Flag for directory+padding
+                write_uint16(header, stringtable.get_string_offset(subdirname))
 
                 if subdir is None:
                     child_nodeindex = 0xFFFFFFFF
                 else:
                     child_nodeindex = subdir._nodeindex
-                write_uint32(f, child_nodeindex)
-                write_uint32(f, 0x10)
-                write_uint32(f, 0) # Padding
+                write_uint32(header, child_nodeindex)
+                write_uint32(header, 0x10)
+                write_uint32(header, 0) # Padding
+
+        write_pad32(header)
+        assert header.tell() == layout.stringtable_offset
+        stringtable.write_to(header)
+        write_pad32(header)
+        assert header.tell() == layout.data_offset
+
+        f.write(header.getvalue())
+        del header
+
+        # File data
+        for file, filedata_offset, size in layout.files:
+            file.dump(f)
+            f.write(b"\x00"*(align32(size) - size))
+
+        path = getattr(f, "name", None)
+        if isinstance(path, str):
+            self._remember_layout(path, layout)
+
+    def _remember_layout(self, path, layout):
+        entry_offset = layout.file_entry_offset
+        for dir in layout.dirs:
+            for file in dir.files.values():
+                file._entry_offset = entry_offset
+                entry_offset += 20
+            entry_offset += (len(dir.subdirs) + 2)*20
+
+        for file, filedata_offset, size in layout.files:
+            file._data_offset = filedata_offset
+            file._dirty = False
+
+        self._remember_saved_file(path, layout.size, layout.data_offset)
+
+    def _structure(self):
+        structure = []
+        for dirpath, subdirnames, filenames in self.root.walk():
+            dir = self[dirpath]
+            structure.append((dirpath, tuple(subdirnames), tuple(id(file) for file in dir.files.values())))
+        return structure
+
+    def _remember_saved_file(self, path, size, data_offset):
+        self._saved_path = os.path.abspath(path)
+        self._saved_size = size
+        self._saved_data_offset = data_offset
+        self._saved_structure = self._structure()
+
+        # Every file can grow up to the start of the next file without having to be moved
+        files = []
+        for dirpath, subdirnames, filenames in self.root.walk():
+            files.extend(self[dirpath].files.values())
+        files.sort(key=lambda file: file._data_offset)
+
+        for i, file in enumerate(files):
+            if i+1 < len(files):
+                end = files[i+1]._data_offset
+            else:
+                end = size - data_offset
+            file._slot_size = end - file._data_offset
+
+    def can_update_in_place(self, path):
+        # Whether update_arc can patch the archive at path instead of writing it from scratch:
+        # The file has to be the uncompressed archive this archive was last read from or
+        # written to and no files or directories may have been added, removed or replaced.
+        if self._saved_path is None or self._saved_path != os.path.abspath(path):
+            return False
+        if not os.path.isfile(path) or os.path.getsize(path) != self._saved_size:
+            return False
+
+        return self._saved_structure == self._structure()
+
+    def update_arc(self, f):
+        # Saves the archive to f, an archive file opened with "r+b". If possible only the files that were
+        # modified are written: Files that still fit into their old place are overwritten there, other
+        # files are appended to the end of the archive and their file entry is updated.
+        # Otherwise the whole archive is written.
+        if not self.can_update_in_place(f.name):
+            # Written to memory first because the files might still be read from f, and files
+            # that share a memory map of f get their own copy before f is overwritten
+            self.unmap()
+            layout = self.calculate_layout()
+            temp = BytesIO()
+            self.write_arc(temp, layout)
+            f.seek(0)
+            f.write(temp.getvalue())
+            f.truncate()
+            self._remember_layout(f.name, layout)
+            return
 
-        write_pad32(f)
-        assert f.tell() % 0x20 == 0
-        current_stringtable_offset = f.tell()
-        stringtable.write_to(f)
+        data_offset = self._saved_data_offset
+        size = self._saved_size
 
-        write_pad32(f)
-        stringtablesize = f.tell() - current_stringtable_offset
+        for dirpath, subdirnames, filenames in self.root.walk():
+            for file in self[dirpath].files.values():
+                if not isinstance(file, File) or not file.is_dirty():
+                    continue
+
+                filesize = file.size()
+
+                if filesize <= file._slot_size:
+                    f.seek(data_offset + file._data_offset)
+                    file.dump(f)
+                    f.write(b"\x00"*(min(align32(filesize), file._slot_size) - filesize))
+                else:
+                    file._data_offset = size - data_offset
+                    file._slot_size = align32(filesize)
+                    f.seek(size)
+                    file.dump(f)
+                    f.write(b"\x00"*(file._slot_size - filesize))
+                    size = f.tell()
+
+                    f.seek(file._entry_offset + 8)
+                    write_uint32(f, file._data_offset)
+
+                f.seek(file._entry_offset + 12)
+                write_uint32(f, filesize)
+                file._dirty = False
+
+        if size != self._saved_size:
+            f.seek(4)
+            write_uint32(f, size)
+            f.seek(16)
+            write_uint32(f, size - data_offset)
+            write_uint32(f, size - data_offset)
+            self._saved_size = size
+
+
+def _name_matches(name, other, case_sensitive):
+    if case_sensitive:
+        return name == other
+    return name.lower() == other.lower()
+
+
+def _child(entries, name, case_sensitive):
+    # Name and entry of name in a dict of directory entries
+    if name in entries:
+        return name, entries[name]
+    if not case_sensitive:
+        lowername = name.lower()
+        for othername, entry in entries.items():
+            if othername.lower() == lowername:
+                return othername, entry
+    return None, None
+
+
+class ArchiveLayout(object):
+    def __init__(self):
+        self.stringtable = StringTable()
+        self.dirs = []
+        self.files = [] # (file, offset into data section, size)
+        self.nodecount = 0
+        self.entrycount = 0
+        self.file_entry_offset = 0
+        self.stringtable_offset = 0
+        self.stringtable_size = 0
+        self.data_offset = 0
+        self.size = 0
 
-        current_data_offset = f.tell()
 
-        f.write(data.getvalue())
+def align32(value):
+    return (value + 0x1F) & ~0x1F
 
-        rarc_size = f.tell()
 
-        f.seek(4)
-        write_uint32(f, rarc_size)
-        f.seek(12)
-        write_uint32(f, current_data_offset-0x20)
-        write_uint32(f, rarc_size - current_data_offset)
-        write_uint32(f, rarc_size - current_data_offset)
+def file_size(file):
+    if isinstance(file, File):
+        return file.size()
+    else:
+        return len(file.getvalue())
+
+
+def _read_file(filepath):
+    with open(filepath, "rb") as f:
+        return File.from_file(os.path.basename(filepath), f)
 
-        f.seek(40)
 
-        total_file_entries = first_file_entry_index
-        write_uint32(f, total_file_entries)
-        write_uint32(f, current_file_entry_offset-0x20)
-        write_uint32(f, stringtablesize)
-        write_uint32(f, current_stringtable_offset-0x20)
+def _write_file(job):
+    filepath, file = job
+    with open(filepath, "wb") as f:
+        file.dump(f)
+
 
 
 
@@ -594,6 +1169,12 @@ if __name__ == "__main__":
                         help="Path to the archive file (usually .arc or .szs) to be extracted or the directory to be packed into an archive file.")
     parser.add_argument("--yaz0fast", action="store_true",
                         help="Encode archive as yaz0 when doing directory->.arc/.szs")
+    parser.add_argument("--yaz0level", type=int, default=None, choices=(LEVEL_FAST, LEVEL_LAZY, LEVEL_OPTIMAL),
+                        help="Encode archive as yaz0 with the given compression level: "
+                             "1 = fast, 2 = lazy matching, 3 = optimal (slowest, smallest). --yaz0fast is the same as level 1.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of threads used for reading/writing files and processes used for yaz0 compression. "
+                             "0 uses one per CPU core.")
     parser.add_argument("output", default=None, nargs = '?',
                         help="Output path to which the archive is extracted or a new archive file is written, depending on input.")
 
@@ -605,12 +1186,18 @@ if __name__ == "__main__":
     else:
         dir2arc = False
 
+    if args.yaz0level is not None:
+        yaz0level = args.yaz0level
+    elif args.yaz0fast:
+        yaz0level = LEVEL_FAST
+    else:
+        yaz0level = None
 
     if args.output is None:
         path, name = os.path.split(inputpath)
 
         if dir2arc:
-            if args.yaz0fast:
+            if yaz0level is not None:
                 ending = ".szs"
             else:
                 ending = ".arc"
@@ -639,12 +1226,12 @@ if __name__ == "__main__":
             raise RuntimeError("Directory {0} contains no folders! Exactly one folder should exist.".format(inputpath))
         
         print("Packing directory to archive")
-        archive = Archive.from_dir(os.path.join(inputpath, inputdir))
+        archive = Archive.from_dir(os.path.join(inputpath, inputdir), workers=args.workers or None)
         print("Directory loaded into memory, writing archive now")
 
         with open(outputpath, "wb") as f:
-            if args.yaz0fast:
-                archive.write_arc_compressed(f)
+            if yaz0level is not None:
+                archive.write_arc_compressed(f, yaz0level, args.workers or None)
             else:
                 archive.write_arc(f)
         print("Done")
@@ -652,6 +1239,6 @@ if __name__ == "__main__":
         print("Extracting archive to directory")
         with open(inputpath, "rb") as f:
             archive = Archive.from_file(f)
-        archive.extract_to(outputpath)
+        archive.extract_to(outputpath, args.workers or None)
 
 
@@ -1,12 +1,17 @@
-from io import BytesIO
-from struct import pack
+from io import BytesIO, UnsupportedOperation
+from struct import pack, Struct
 from collections import OrderedDict
+from array import array
+from bisect import bisect_left
 import time
 import sys
 import os
+import mmap
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
 
-from lib.yaz0 import decompress, read_uint32, read_uint16, compress_fast
+from lib.yaz0 import Yaz0Reader, read_uint32, read_uint16, LEVEL_FAST, LEVEL_LAZY, LEVEL_OPTIMAL
+from lib.yaz0 import compress as yaz0_compress, compress_incremental
 
 
 def write_uint32(f, val):
@@ -109,11 +114,15 @@ class SARCArchive(object):
     def __init__(self):
         self.files = OrderedDict()
         self.unnamed_files = []
+        self._yaz0_checkpoint = None
 
     @classmethod
-    def from_folder(cls, folderpath):
+    def from_folder(cls, folderpath, workers=1):
+        # With workers != 1 the files are read by a thread pool (workers=None uses
+        # the executor's default). They are still added in the order os.walk finds them.
         arc = cls()
         skip = len(folderpath)
+        jobs = []
 
         for dirpath, directories, files in os.walk(folderpath):
             print(dirpath)
@@ -125,16 +134,34 @@ class SARCArchive(object):
             print(relpath)
 
             for filename in files:
-                try:
-                    with open(os.path.join(dirpath, filename), "rb") as f:
-                        file = File.from_file(relpath+filename, f)
+                jobs.append((relpath+filename, os.path.join(dirpath, filename)))
 
-                    arc.files[relpath+filename] = file
-                except PermissionError:
-                    print("Permission denied:", os.path.join(dirpath, filename), "skipping...")
+        if workers != 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                files = list(executor.map(_read_file, jobs))
+        else:
+            files = [_read_file(job) for job in jobs]
+
+        for file in files:
+            if file is not None:
+                arc.files[file.name] = file
         return arc
 
-    def to_file(self, f, compress=False, padding=0x20):
+    def extract_to(self, path, workers=1):
+        jobs = []
+        for filepath, file in self.files.items():
+            os.makedirs(os.path.join(path, os.path.dirname(filepath)), exist_ok=True)
+            jobs.append((os.path.join(path, filepath), file))
+
+        if workers != 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for _ in executor.map(_write_file, jobs):
+                    pass
+        else:
+            for job in jobs:
+                _write_file(job)
+
+    def to_file(self, f, compress=False, padding=0x20, level=LEVEL_LAZY, workers=1, incremental=False):
         if compress:
             file = BytesIO()
         else:
@@ -190,9 +217,15 @@ class SARCArchive(object):
         write_uint32(file, totalsize)
         write_uint32(file, dataoffset)
 
-        if compress:
+        if compress and incremental:
+            # Only the part of the archive after the first changed byte since
+            # the last incremental save is compressed again.
+            compressed, self._yaz0_checkpoint = compress_incremental(file.getvalue(), self._yaz0_checkpoint,
+                                                                     level, workers)
+            f.write(compressed)
+        elif compress:
             file.seek(0)
-            compress_fast(file, f)
+            yaz0_compress(file, f, level, workers)
 
 
     @classmethod
@@ -202,20 +235,11 @@ class SARCArchive(object):
         header = f.read(4)
 
         if header == b"Yaz0":
-            # Decompress first
-            print("Yaz0 header detected, decompressing...")
-            start = time.time()
-            tmp = BytesIO()
-            f.seek(0)
-            decompress(f, tmp)
-            #with open("decompressed.bin", "wb") as g:
-            #    decompress(f,)
-            f = tmp
-            f.seek(0)
+            # The archive is decompressed on demand as it is being read
+            print("Yaz0 header detected, decompressing on demand...")
+            f = Yaz0Reader(f)
 
             header = f.read(4)
-            print("Finished decompression.")
-            print("Time taken:", time.time() - start)
 
         if header == b"SARC":
             pass
@@ -275,6 +299,196 @@ class SARCArchive(object):
         return newarc
 
 
+SARC_HEADER = Struct(">4sHHIIHH")
+SFAT_HEADER = Struct(">4sHHI")
+SFNT_HEADER = Struct(">4sHH")
+
+
+class SARCReader(object):
+    # Read-only access to a SARC archive that doesn't load the files. Only the SFAT table is read
+    # (into compact arrays), files are looked up by binary search on their name hash and returned
+    # as memoryview slices of the memory-mapped archive file or of the decompressed data.
+    # Compressed archives are only decompressed up to the end of the furthest file requested so far.
+    # The archive file must not be modified while the reader or views returned by it are in use.
+    # Use it as a context manager or call close() to unmap the file.
+    def __init__(self):
+        self._buffer = None
+        self._yaz0 = None
+        self._mmap = None
+        self._strings = b""
+
+        self.data_offset = 0
+        self.hash_key = 0x65
+        self.hashes = array("I")
+        self.attributes = array("I")
+        self.starts = array("I")
+        self.ends = array("I")
+
+        # Hashes in ascending order for the binary search. If the SFAT table isn't sorted
+        # (e.g. archives written by SARCArchive.to_file) _sorted_order maps them back to entries.
+        self._sorted_hashes = self.hashes
+        self._sorted_order = None
+
+    @classmethod
+    def from_file(cls, f):
+        reader = cls()
+        header = f.read(4)
+        f.seek(0)
+
+        if header == b"Yaz0":
+            reader._yaz0 = Yaz0Reader(f)
+        else:
+            reader._buffer = reader._map_buffer(f)
+
+        magic, header_size, bom, size, data_offset, version, reserved = SARC_HEADER.unpack_from(
+            reader._view(0, SARC_HEADER.size))
+        if magic != b"SARC":
+            raise RuntimeError("Unknown file header: {} should be Yaz0 or SARC".format(magic))
+        assert bom == 0xFEFF # BOM: Big endian
+        reader.data_offset = data_offset
+
+        magic, sfat_header_size, node_count, hash_key = SFAT_HEADER.unpack_from(
+            reader._view(header_size, header_size + SFAT_HEADER.size))
+        assert magic == b"SFAT"
+        reader.hash_key = hash_key
+
+        # Each node is hash, attributes, data start, data end
+        nodes_start = header_size + sfat_header_size
+        nodes_end = nodes_start + node_count*16
+        nodes = array("I")
+        nodes.frombytes(reader._view(nodes_start, nodes_end))
+        if sys.byteorder == "little":
+            nodes.byteswap()
+        reader.hashes = nodes[0::4]
+        reader.attributes = nodes[1::4]
+        reader.starts = nodes[2::4]
+        reader.ends = nodes[3::4]
+
+        magic, sfnt_header_size, reserved = SFNT_HEADER.unpack_from(
+            reader._view(nodes_end, nodes_end + SFNT_HEADER.size))
+        assert magic == b"SFNT"
+        reader._strings = bytes(reader._view(nodes_end + sfnt_header_size, data_offset))
+
+        hashes = reader.hashes
+        if all(hashes[i] <= hashes[i+1] for i in range(node_count-1)):
+            reader._sorted_hashes = hashes
+            reader._sorted_order = None
+        else:
+            order = sorted(range(node_count), key=hashes.__getitem__)
+            reader._sorted_hashes = array("I", (hashes[i] for i in order))
+            reader._sorted_order = array("I", order)
+
+        return reader
+
+    def _map_buffer(self, f):
+        if isinstance(f, BytesIO):
+            return f.getbuffer().toreadonly()
+
+        try:
+            fileno = f.fileno()
+        except (AttributeError, UnsupportedOperation):
+            f.seek(0)
+            return memoryview(f.read())
+
+        self._mmap = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)
+
+    def close(self):
+        # Views returned by the reader have to be released before
+        if self._yaz0 is not None:
+            self._yaz0.close()
+            self._yaz0 = None
+        if self._buffer is not None:
+            self._buffer.release()
+            self._buffer = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _view(self, start, end):
+        if self._yaz0 is not None:
+            return self._yaz0.view(start, end)
+        else:
+            return self._buffer[start:end]
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def get_name(self, index):
+        # Returns None for files without a name
+        attr = self.attributes[index]
+        if not attr & 0x01000000:
+            return None
+
+        offset = (attr & 0xFFFF) * 4
+        end = self._strings.index(b"\x00", offset)
+        return self._strings[offset:end].decode("shift-jis")
+
+    def names(self):
+        return [name for name in (self.get_name(i) for i in range(len(self))) if name is not None]
+
+    def find(self, name):
+        # Returns the SFAT index of the file or None if it doesn't exist.
+        namehash = calc_hash(name, self.hash_key)
+        hashes = self._sorted_hashes
+        i = bisect_left(hashes, namehash)
+
+        # Several names can have the same hash
+        while i < len(hashes) and hashes[i] == namehash:
+            index = i if self._sorted_order is None else self._sorted_order[i]
+            if self.get_name(index) == name:
+                return index
+            i += 1
+
+        return None
+
+    def read_index(self, index):
+        return self._view(self.data_offset + self.starts[index], self.data_offset + self.ends[index])
+
+    def get(self, name, default=None):
+        index = self.find(name)
+        if index is None:
+            return default
+        return self.read_index(index)
+
+    def __getitem__(self, name):
+        index = self.find(name)
+        if index is None:
+            raise KeyError(name)
+        return self.read_index(index)
+
+    def __contains__(self, name):
+        return self.find(name) is not None
+
+    def items(self):
+        for i in range(len(self)):
+            name = self.get_name(i)
+            if name is not None:
+                yield name, self.read_index(i)
+
+
+def _read_file(job):
+    name, filepath = job
+    try:
+        with open(filepath, "rb") as f:
+            return File.from_file(name, f)
+    except PermissionError:
+        print("Permission denied:", filepath, "skipping...")
+        return None
+
+
+def _write_file(job):
+    filepath, file = job
+    with open(filepath, "wb") as f:
+        f.write(file.getvalue())
+
+
 if __name__ == "__main__":
     """
     import sys
@@ -303,6 +517,12 @@ if __name__ == "__main__":
                         help="Path to the archive file (usually .arc or .szs) to be extracted or the directory to be packed into an archive file.")
     parser.add_argument("--yaz0fast", action="store_true",
                         help="Encode archive as yaz0 when doing directory->.arc/.szs")
+    parser.add_argument("--yaz0level", type=int, default=None, choices=(LEVEL_FAST, LEVEL_LAZY, LEVEL_OPTIMAL),
+                        help="Encode archive as yaz0 with the given compression level: "
+                             "1 = fast, 2 = lazy matching, 3 = optimal (slowest, smallest). --yaz0fast is the same as level 1.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of threads used for reading/writing files and processes used for yaz0 compression. "
+                             "0 uses one per CPU core.")
     parser.add_argument("output", default=None, nargs='?',
                         help="Output path to which the archive is extracted or a new archive file is written, depending on input.")
     parser.add_argument("--padding", default=0x20, type=int,
@@ -320,7 +540,7 @@ if __name__ == "__main__":
         path, name = os.path.split(inputpath)
 
         if dir2arc:
-            if args.yaz0fast:
+            if args.yaz0fast or args.yaz0level is not None:
                 ending = ".szs"
             else:
                 ending = ".arc"
@@ -335,9 +555,14 @@ if __name__ == "__main__":
         outputpath = args.output
 
     if dir2arc:
-        sarc = SARCArchive.from_folder(inputpath)
+        sarc = SARCArchive.from_folder(inputpath, workers=args.workers or None)
         with open(outputpath, "wb") as f:
-            sarc.to_file(f, padding=args.padding, compress=args.yaz0fast)
+            if args.yaz0level is not None:
+                sarc.to_file(f, padding=args.padding, compress=True, level=args.yaz0level,
+                             workers=args.workers or None)
+            else:
+                sarc.to_file(f, padding=args.padding, compress=args.yaz0fast, level=LEVEL_FAST,
+                             workers=args.workers or None)
     else:
         with open(inputpath, "rb") as f:
             sarc = SARCArchive.from_file(f)
@@ -346,6 +571,4 @@ if __name__ == "__main__":
 
         for path, file in sarc.files.items():
             print(path, file, hex(file.attributes))
-            os.makedirs(os.path.join(out, os.path.dirname(path)), exist_ok=True)
-            with open(os.path.join(out, path), "wb") as f:
-                f.write(file.getvalue())
+        sarc.extract_to(out, args.workers or None)
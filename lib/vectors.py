@@ -4,6 +4,8 @@ from numpy import array
 
 
 class Vector3(object):
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
@@ -12,6 +14,12 @@ class Vector3(object):
     def copy(self):
         return Vector3(self.x, self.y, self.z)
 
+    def __deepcopy__(self, memo):
+        # Much faster than the generic copy of objects with __slots__
+        result = self.copy()
+        memo[id(self)] = result
+        return result
+
     def norm(self):
         return sqrt(self.x**2 + self.y**2 + self.z**2)
 
@@ -81,7 +89,66 @@ class Vector3(object):
         return str((self.x, self.y, self.z))
 
 
+class Vector3View(Vector3):
+    # Vector3 whose coordinates are stored in a row of an (n, 3) numpy array, changes to either
+    # show up in the other. Copies of it are plain Vector3 objects that don't share the array.
+    # It adds no slots, so bind() can turn an existing Vector3 into a view and everything that
+    # holds the vector keeps seeing its values. The row is kept in the slot of x (_rowslot is
+    # its descriptor), the x property below replaces it for everything else.
+    __slots__ = ()
+    _rowslot = Vector3.x
+
+    def __init__(self, array, index):
+        self._rowslot = array[index]
+
+    @classmethod
+    def bind(cls, vec, array, index):
+        # Copies the coordinates of vec into the array and makes vec a view of that row.
+        # Returns the vector that has to be used in place of vec, a new view if vec can't
+        # be changed (e.g. a Vector4).
+        array[index] = (vec.x, vec.y, vec.z)
+        if type(vec) is Vector3:
+            vec.__class__ = cls
+        elif type(vec) is not cls:
+            return cls(array, index)
+
+        vec._rowslot = array[index]
+        return vec
+
+    @property
+    def x(self):
+        return float(self._rowslot[0])
+
+    @x.setter
+    def x(self, value):
+        self._rowslot[0] = value
+
+    @property
+    def y(self):
+        return float(self._rowslot[1])
+
+    @y.setter
+    def y(self, value):
+        self._rowslot[1] = value
+
+    @property
+    def z(self):
+        return float(self._rowslot[2])
+
+    @z.setter
+    def z(self, value):
+        self._rowslot[2] = value
+
+    def copy(self):
+        return Vector3(self.x, self.y, self.z)
+
+    def __reduce__(self):
+        return (Vector3, (self.x, self.y, self.z))
+
+
 class Vector4(Vector3):
+    __slots__ = ("w",)
+
     def __init__(self, x, y, z, w):
         Vector3.__init__(self, x, y, z)
         self.w = w
@@ -101,6 +168,8 @@ class Vector4(Vector3):
 
 
 class Vector2(Vector3):
+    __slots__ = ()
+
     def __init__(self, x, y):
         super().__init__(x, y, 0)
 
@@ -8,9 +8,13 @@ import os
 import re
 import hashlib
 import math
+import mmap
 
 from timeit import default_timer as time
-from io import BytesIO
+from io import BytesIO, RawIOBase
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+from bisect import bisect_right
 #from cStringIO import StringIO
 
 #class yaz0():
@@ -28,109 +32,203 @@ def read_uint16(f):
 def read_uint8(f):
     return f.read(1)[0]
 
-def write_limited(f, data, limit):
-    if f.tell() >= limit:
-        pass
-    else:
-        f.write(data)
-    
-def decompress(f, out):
-    #if out is None:
-    #    out = BytesIO()
-    
-    # A way to discover the total size of the input data that
-    # should be compatible with most file-like objects.
-    f.seek(0, 2)
-    maxsize = f.tell()
-    f.seek(0)
-    
-    #data = f.read()
-    #assert len(data) == maxsize
-    #f.seek(0)
-
-
-    header = f.read(4)
+def read_yaz0_header(src):
+    header = bytes(src[0:4])
     if header != b"Yaz0":
         raise RuntimeError("File is not Yaz0-compressed! Header: {0}".format(header))
-    
-    decompressed_size = read_uint32(f)
-    f.read(8) # padding
-        
-    eof = False
 
-    # Some micro optimization, can save up to a second on bigger files
-    file_read = f.read
-    file_tell = f.tell
+    return src[4] << 24 | src[5] << 16 | src[6] << 8 | src[7]
 
-    out_read = out.read
-    out_write = out.write
-    out_tell = out.tell
-    out_seek = out.seek
 
-    range_8 = [i for i in range(8)]
+def decode_groups(src, src_pos, out, dest_pos, decompressed_size, target):
+    # Decodes whole code byte groups from src into the bytearray out until at least target bytes
+    # have been decoded and returns the new (src_pos, dest_pos). out needs to have room for
+    # min(decompressed_size, target + 8*0x111) bytes because the last group can overshoot target.
+    maxsize = len(src)
+
+    while dest_pos < target and src_pos < maxsize:
+        code_byte = src[src_pos]
+        src_pos += 1
+
+        if code_byte == 0xFF and dest_pos + 8 <= decompressed_size and src_pos + 8 <= maxsize:
+            # Fast path: 8 literal bytes in a row
+            out[dest_pos:dest_pos+8] = src[src_pos:src_pos+8]
+            dest_pos += 8
+            src_pos += 8
+            continue
+
+        for i in range(8):
+            if dest_pos >= decompressed_size:
+                break
 
-    while out_tell() < decompressed_size and not eof:
-        code_byte = file_read(1)[0]
-        
-        for i in range_8:
-            #is_set = ((code_byte << i) & 0x80) != 0
-            
             if (code_byte << i) & 0x80:
-                out_write(file_read(1)) # Write next byte as-is without requiring decompression
+                if src_pos >= maxsize:
+                    break
+                out[dest_pos] = src[src_pos] # Write next byte as-is without requiring decompression
+                dest_pos += 1
+                src_pos += 1
             else:
-                if file_tell() >= maxsize-1:
-                    eof = True
+                if src_pos >= maxsize-1:
+                    src_pos = maxsize
                     break
 
-                data = file_read(2)
-                infobyte = data[0] << 8 | data[1]
-                
+                infobyte = src[src_pos] << 8 | src[src_pos+1]
+                src_pos += 2
 
-                bytecount = infobyte >> 12 
-                
+                bytecount = infobyte >> 12
                 if bytecount == 0:
-                    if file_tell() > maxsize-1:
-                        eof = True
+                    if src_pos > maxsize-1:
                         break
-                    bytecount = file_read(1)[0] + 0x12
+                    bytecount = src[src_pos] + 0x12
+                    src_pos += 1
                 else:
                     bytecount += 2
-                
-                offset = infobyte & 0x0FFF
-                
-                current = out_tell()
-                seekback = current - (offset+1)
-                
+
+                distance = (infobyte & 0x0FFF) + 1
+                seekback = dest_pos - distance
+
                 if seekback < 0:
                     raise RuntimeError("Malformed Yaz0 file: Seek back position goes below 0")
 
-                out_seek(seekback)
-                copy = out_read(bytecount)
-                out_seek(current)
-                
-                write_limited(out, copy, decompressed_size)
-
-                copy_length = len(copy)
-                
-                if copy_length < bytecount:
-                    # Copy source and copy distance overlap which essentially means that
-                    # we have to repeat the copied source to make up for the difference
-                    j = 0
-                    for i in range(bytecount-copy_length):
-                        #write_limited(out, copy[j:j+1], decompressed_size)
-                        if out_tell() < decompressed_size:
-                            out_write(copy[j:j+1])
-                        else:
-                            break
-
-                        j = (j+1) % copy_length
-                
-    if out.tell() < decompressed_size:
-        #print("this isn't right")
+                if dest_pos + bytecount > decompressed_size:
+                    bytecount = decompressed_size - dest_pos
+
+                if distance >= bytecount:
+                    out[dest_pos:dest_pos+bytecount] = out[seekback:seekback+bytecount]
+                else:
+                    # Copy source and copy distance overlap which means that the
+                    # source has to be repeated to make up for the difference
+                    repeats = bytecount // distance + 1
+                    out[dest_pos:dest_pos+bytecount] = (out[seekback:dest_pos] * repeats)[:bytecount]
+
+                dest_pos += bytecount
+
+    return src_pos, dest_pos
+
+
+def decompress_buffer(data):
+    # Decodes a complete Yaz0 stream held in memory and returns the result as a bytearray.
+    # The output is allocated up front from the size in the header and filled by index,
+    # so nothing has to go through read/seek/tell of a file object.
+    src = memoryview(data)
+    decompressed_size = read_yaz0_header(src)
+    out = bytearray(decompressed_size)
+
+    src_pos, dest_pos = decode_groups(src, 0x10, out, 0, decompressed_size, decompressed_size)
+
+    if dest_pos < decompressed_size:
         raise RuntimeError("Didn't decompress correctly, notify the developer!")
-    if out.tell() > decompressed_size:
-        print(  "Warning: output is longer than decompressed size for some reason: "
-                "{}/decompressed: {}".format(out.tell(), decompressed_size))
+
+    return out
+
+
+def decompress(f, out):
+    # Kept for compatibility: reads everything from f and writes the
+    # decompressed data to out using decompress_buffer.
+    f.seek(0)
+    out.write(decompress_buffer(f.read()))
+
+
+class Yaz0Reader(RawIOBase):
+    # Read-only file-like object over Yaz0-compressed data. Data is only decoded up to the
+    # furthest position that has been read so far, and the decoded part is kept around
+    # so seeking back does not decode anything again.
+    def __init__(self, f):
+        super().__init__()
+        f.seek(0)
+        self._src = memoryview(f.read())
+        self.size = read_yaz0_header(self._src)
+
+        # The decoded data goes into an anonymous memory map of the full size. The OS only allocates
+        # its pages when they are written to, so the part that isn't decoded yet costs nothing, and it
+        # never has to be resized, so views returned by view() and getbuffer() stay valid.
+        self._decoded = mmap.mmap(-1, self.size) if self.size > 0 else bytearray()
+        self._src_pos = 0x10
+        self._dest_pos = 0
+        self._pos = 0
+
+    def _decode_until(self, target):
+        target = min(target, self.size)
+        if target <= self._dest_pos:
+            return
+
+        self._src_pos, self._dest_pos = decode_groups(self._src, self._src_pos,
+                                                      self._decoded, self._dest_pos,
+                                                      self.size, target)
+
+        if self._dest_pos < target:
+            raise RuntimeError("Didn't decompress correctly, notify the developer!")
+
+    def decoded_size(self):
+        return self._dest_pos
+
+    def close(self):
+        # Views of the decoded data have to be released before
+        if isinstance(self._decoded, mmap.mmap):
+            self._decoded.close()
+        self._src.release()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            pos = offset
+        elif whence == 1:
+            pos = self._pos + offset
+        elif whence == 2:
+            pos = self.size + offset
+        else:
+            raise ValueError("Invalid whence: {0}".format(whence))
+
+        if pos < 0:
+            raise ValueError("Negative seek position {0}".format(pos))
+
+        self._pos = pos
+        return pos
+
+    def read(self, size=-1):
+        start = self._pos
+        if size is None or size < 0:
+            end = self.size
+        else:
+            end = min(self.size, start + size)
+
+        if end <= start:
+            return b""
+
+        self._decode_until(end)
+        self._pos = end
+        return bytes(self._decoded[start:end])
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def getvalue(self):
+        self._decode_until(self.size)
+        return bytes(self._decoded[:self.size])
+
+    def getbuffer(self):
+        # Decodes everything and returns a read-only view of the decoded data without copying it.
+        self._decode_until(self.size)
+        return memoryview(self._decoded).toreadonly()
+
+    def view(self, start, end):
+        # Read-only view of the decoded bytes start:end without copying them, only decodes up to end.
+        self._decode_until(end)
+        return memoryview(self._decoded)[start:end].toreadonly()
 
 
 def compress_fast(f, out):
@@ -158,3 +256,391 @@ def compress_fast(f, out):
         
         out_write(b"\xFF") # Set all bits in the code byte to 1 to mark the following 8 bytes as copy
         out_write(tocopy)
+
+
+# Compression levels for compress(). Higher levels give smaller output but take longer.
+LEVEL_FAST = 1      # Greedy parsing with short hash chains
+LEVEL_LAZY = 2      # Lazy matching: a match is deferred if the next position has a longer one
+LEVEL_OPTIMAL = 3   # Cheapest token sequence for the longest match at every position
+
+# level: (maximum hash chain length, lazy matching)
+LEVEL_SETTINGS = {
+    LEVEL_FAST: (16, False),
+    LEVEL_LAZY: (64, True),
+    LEVEL_OPTIMAL: (128, False)
+}
+
+WINDOW_SIZE = 0x1000
+MIN_MATCH = 3
+MAX_MATCH = 0x111
+
+# Size of a token in bits, including its bit in the code byte
+LITERAL_COST = 9
+SHORT_MATCH_COST = 17   # Matches up to 0x11 bytes long use 2 bytes
+LONG_MATCH_COST = 25    # Longer matches need a third byte for the length
+
+# Tokens are stored as plain ints: values below 0x100 are literal bytes,
+# anything else is a back-reference stored as (distance << 9) | length.
+
+
+class _MatchFinder(object):
+    # Hash chains over 3 byte prefixes. head maps a prefix to the most recent position
+    # that starts with it, prev links every position to the one before it with the same prefix.
+    def __init__(self, data, base, max_chain):
+        self.data = data
+        self.base = base
+        self.max_chain = max_chain
+        self.head = {}
+        self.prev = [-1]*(len(data) - base)
+
+    def insert(self, pos):
+        data = self.data
+        if pos + MIN_MATCH > len(data):
+            return
+        key = data[pos] << 16 | data[pos+1] << 8 | data[pos+2]
+        self.prev[pos - self.base] = self.head.get(key, -1)
+        self.head[key] = pos
+
+    def find(self, pos, end):
+        # Returns (length, distance) of the longest match for pos, looking at most
+        # max_chain positions back. Matches never extend past end.
+        data = self.data
+        maxlen = min(MAX_MATCH, end - pos)
+        if maxlen < MIN_MATCH:
+            return 0, 0
+
+        key = data[pos] << 16 | data[pos+1] << 8 | data[pos+2]
+        candidate = self.head.get(key, -1)
+        prev = self.prev
+        base = self.base
+        limit = pos - WINDOW_SIZE
+        chain = self.max_chain
+
+        best_len = 0
+        best_dist = 0
+
+        while candidate >= limit and candidate >= 0 and chain > 0:
+            chain -= 1
+            # Only bother comparing if this candidate could beat the current best
+            if best_len == 0 or data[candidate+best_len] == data[pos+best_len]:
+                length = MIN_MATCH
+                while length + 16 <= maxlen and data[candidate+length:candidate+length+16] == data[pos+length:pos+length+16]:
+                    length += 16
+                while length < maxlen and data[candidate+length] == data[pos+length]:
+                    length += 1
+
+                if length > best_len:
+                    best_len = length
+                    best_dist = pos - candidate
+                    if length == maxlen:
+                        break
+
+            candidate = prev[candidate - base]
+
+        return best_len, best_dist
+
+
+def _parse_greedy(data, start, end, finder, lazy):
+    tokens = []
+    append = tokens.append
+    insert = finder.insert
+    find = finder.find
+
+    pos = start
+    next_match = None
+
+    while pos < end:
+        if next_match is not None:
+            length, distance = next_match
+            next_match = None
+        else:
+            length, distance = find(pos, end)
+        insert(pos)
+
+        if length >= MIN_MATCH and lazy and length < MAX_MATCH and pos + 1 < end:
+            next_match = find(pos+1, end)
+            if next_match[0] > length:
+                # Better match one byte later, emit a literal instead
+                append(data[pos])
+                pos += 1
+                continue
+            next_match = None
+
+        if length >= MIN_MATCH:
+            append(distance << 9 | length)
+            for i in range(pos+1, pos+length):
+                insert(i)
+            pos += length
+        else:
+            append(data[pos])
+            pos += 1
+
+    return tokens
+
+
+def _parse_optimal(data, start, end, finder):
+    count = end - start
+    lengths = [0]*count
+    distances = [0]*count
+
+    for pos in range(start, end):
+        lengths[pos-start], distances[pos-start] = finder.find(pos, end)
+        finder.insert(pos)
+
+    # Walk backwards to find the cheapest way to encode the rest of the data from every position.
+    # Any match length up to the longest one is available at the same distance, which
+    # means that only lengths where the token size changes need to be considered.
+    cost = [0]*(count+1)
+    choice = [0]*count
+    for i in range(count-1, -1, -1):
+        best = cost[i+1] + LITERAL_COST
+        best_len = 1
+        longest = lengths[i]
+
+        if longest >= MIN_MATCH:
+            for first, last, token_cost in ((MIN_MATCH, min(longest, 0x11), SHORT_MATCH_COST),
+                                            (0x12, longest, LONG_MATCH_COST)):
+                if last < first:
+                    continue
+                c = min(cost[i+first:i+last+1]) + token_cost
+                if c < best:
+                    best = c
+                    best_len = cost.index(c - token_cost, i+first, i+last+1) - i
+
+        cost[i] = best
+        choice[i] = best_len
+
+    tokens = []
+    i = 0
+    while i < count:
+        length = choice[i]
+        if length == 1:
+            tokens.append(data[start+i])
+        else:
+            tokens.append(distances[i] << 9 | length)
+        i += length
+
+    return tokens
+
+
+def find_tokens(data, start, end, level=LEVEL_LAZY):
+    # Parses data[start:end] into tokens. Back-references may reach up to
+    # WINDOW_SIZE bytes before start, so data before start acts as the window.
+    max_chain, lazy = LEVEL_SETTINGS[level]
+    window_start = max(0, start - WINDOW_SIZE)
+    finder = _MatchFinder(data, window_start, max_chain)
+    for pos in range(window_start, start):
+        finder.insert(pos)
+
+    if level == LEVEL_OPTIMAL:
+        return _parse_optimal(data, start, end, finder)
+    else:
+        return _parse_greedy(data, start, end, finder, lazy)
+
+
+def write_tokens(tokens, out, checkpoint=None, input_offset=0):
+    # Writes tokens into the bytearray out, 8 tokens per code byte.
+    # If a checkpoint is given, the input and output offset of every code byte
+    # is recorded in it. input_offset is the input position of the first token.
+    if checkpoint is not None:
+        group_inputs = checkpoint.group_inputs
+        group_outputs = checkpoint.group_outputs
+
+    for group_start in range(0, len(tokens), 8):
+        code_pos = len(out)
+        out.append(0)
+        code = 0
+
+        if checkpoint is not None:
+            group_inputs.append(input_offset)
+            group_outputs.append(code_pos)
+
+        for bit, token in enumerate(tokens[group_start:group_start+8]):
+            if token < 0x100:
+                code |= 0x80 >> bit
+                out.append(token)
+                input_offset += 1
+            else:
+                length = token & 0x1FF
+                input_offset += length
+                distance = (token >> 9) - 1
+                if length < 0x12:
+                    out.append((length-2) << 4 | distance >> 8)
+                    out.append(distance & 0xFF)
+                else:
+                    out.append(distance >> 8)
+                    out.append(distance & 0xFF)
+                    out.append(length-0x12)
+
+        out[code_pos] = code
+
+
+# Size of the blocks that are handed to worker processes when compressing in parallel.
+# Matches can't cross block boundaries, which costs a few bytes per block compared to
+# compressing in one go (well below 0.01% of the output size with 1 MiB blocks).
+PARALLEL_BLOCK_SIZE = 0x100000
+
+
+def _find_block_tokens(args):
+    # Runs in a worker process. window_and_block contains up to WINDOW_SIZE bytes
+    # in front of the block so that matches can still reach back into the previous block.
+    window_and_block, block_start, level = args
+    return find_tokens(window_and_block, block_start, len(window_and_block), level)
+
+
+def find_tokens_parallel(data, level=LEVEL_LAZY, workers=None, data_start=0):
+    # Splits data[data_start:] into blocks of PARALLEL_BLOCK_SIZE bytes and finds the tokens for
+    # each block in a separate process. The token lists can simply be concatenated because tokens
+    # only ever refer back to earlier data.
+    jobs = []
+    for start in range(data_start, len(data), PARALLEL_BLOCK_SIZE):
+        window_start = max(0, start - WINDOW_SIZE)
+        end = min(len(data), start + PARALLEL_BLOCK_SIZE)
+        jobs.append((data[window_start:end], start - window_start, level))
+
+    tokens = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for block_tokens in executor.map(_find_block_tokens, jobs):
+            tokens.extend(block_tokens)
+
+    return tokens
+
+
+def compress_buffer(data, level=LEVEL_LAZY, workers=1):
+    # workers is the number of processes used for finding matches.
+    # None uses one process per CPU core.
+    data = bytes(data)
+    out = bytearray(b"Yaz0")
+    out += pack(">I", len(data))
+    out += b"\x00"*8
+
+    if workers != 1 and len(data) > PARALLEL_BLOCK_SIZE:
+        tokens = find_tokens_parallel(data, level, workers)
+    else:
+        tokens = find_tokens(data, 0, len(data), level)
+
+    write_tokens(tokens, out)
+    return out
+
+
+def compress(f, out, level=LEVEL_LAZY, workers=1):
+    out.write(compress_buffer(f.read(), level, workers))
+
+
+class Yaz0Writer(object):
+    # Write-only file-like object that compresses data while it is written to it, so the
+    # uncompressed data never has to be held in memory as a whole. The decompressed size
+    # goes into the header and has to be known in advance. Data is compressed in chunks of
+    # chunk_size bytes, each using the end of the previous chunk as window.
+    def __init__(self, f, size, level=LEVEL_LAZY, chunk_size=0x40000):
+        self._f = f
+        self.size = size
+        self.level = level
+        self.chunk_size = chunk_size
+
+        self._window = b""
+        self._pending = bytearray()
+        self._tokens = [] # Tokens that didn't fill a whole code byte group yet
+        self._written = 0
+
+        f.write(b"Yaz0")
+        f.write(pack(">I", size))
+        f.write(b"\x00"*8)
+
+    def write(self, data):
+        self._pending += data
+        self._written += len(data)
+
+        if len(self._pending) >= self.chunk_size:
+            self._compress_pending()
+
+        return len(data)
+
+    def tell(self):
+        return self._written
+
+    def _compress_pending(self):
+        data = self._window + bytes(self._pending)
+        start = len(self._window)
+        self._pending = bytearray()
+
+        tokens = self._tokens
+        tokens.extend(find_tokens(data, start, len(data), self.level))
+        complete = len(tokens) - len(tokens) % 8
+
+        out = bytearray()
+        write_tokens(tokens[:complete], out)
+        self._f.write(out)
+
+        self._tokens = tokens[complete:]
+        self._window = data[-WINDOW_SIZE:]
+
+    def finish(self):
+        if self._written != self.size:
+            raise RuntimeError("Expected {0} bytes to be written but got {1}".format(self.size, self._written))
+
+        self._compress_pending()
+        out = bytearray()
+        write_tokens(self._tokens, out)
+        self._f.write(out)
+        self._tokens = []
+
+
+class Yaz0Checkpoint(object):
+    # Result of an earlier compression: the uncompressed data, the compressed output
+    # and the input/output offset of every code byte in it.
+    def __init__(self, data, level):
+        self.data = data
+        self.level = level
+        self.encoded = None
+        self.group_inputs = array("I")
+        self.group_outputs = array("I")
+
+
+def common_prefix_length(data1, data2):
+    # Compares in big chunks first and only narrows down byte by byte at the end.
+    maxlen = min(len(data1), len(data2))
+    view1 = memoryview(data1)
+    view2 = memoryview(data2)
+
+    pos = 0
+    chunk = 0x10000
+    while chunk > 0:
+        while pos + chunk <= maxlen and view1[pos:pos+chunk] == view2[pos:pos+chunk]:
+            pos += chunk
+        chunk //= 16
+
+    return pos
+
+
+def compress_incremental(data, checkpoint=None, level=LEVEL_LAZY, workers=1):
+    # Compresses data and returns the compressed data and a new checkpoint. If the checkpoint
+    # of the previous compression is given, the compressed output is reused for everything up to
+    # the code byte group that contains the first changed byte, and only the rest is encoded again.
+    data = bytes(data)
+    newcheckpoint = Yaz0Checkpoint(data, level)
+    out = bytearray(b"Yaz0")
+    out += pack(">I", len(data))
+    out += b"\x00"*8
+
+    start = 0
+    if checkpoint is not None and checkpoint.level == level and len(checkpoint.group_inputs) > 0:
+        changed = common_prefix_length(data, checkpoint.data)
+        # The groups in front of the group containing the first changed byte only depend on
+        # unchanged data, including every byte their back-references point to.
+        keep = bisect_right(checkpoint.group_inputs, changed) - 1
+        if keep > 0:
+            start = checkpoint.group_inputs[keep]
+            out += checkpoint.encoded[0x10:checkpoint.group_outputs[keep]]
+            newcheckpoint.group_inputs = checkpoint.group_inputs[:keep]
+            newcheckpoint.group_outputs = checkpoint.group_outputs[:keep]
+
+    if workers != 1 and len(data) - start > PARALLEL_BLOCK_SIZE:
+        tokens = find_tokens_parallel(data, level, workers, start)
+    else:
+        tokens = find_tokens(data, start, len(data), level)
+
+    write_tokens(tokens, out, newcheckpoint, start)
+    newcheckpoint.encoded = out
+
+    return out, newcheckpoint
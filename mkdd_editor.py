@@ -7,6 +7,7 @@ from timeit import default_timer
 from copy import deepcopy
 from io import TextIOWrapper, BytesIO, StringIO
 from math import sin, cos, atan2
+from numpy import isnan
 import json
 import PyQt5.QtWidgets as QtWidgets
 import PyQt5.QtCore as QtCore
@@ -33,8 +34,10 @@ from widgets.editor_widgets import open_error_dialog, catch_exception_with_dialo
 from mkdd_widgets import BolMapViewer, MODE_TOPDOWN
 from lib.libbol import BOL, MGEntry, Route, get_full_name
 import lib.libbol as libbol
+import lib.bolcache as bolcache
 from lib.rarc import Archive
 from lib.BCOllider import RacetrackCollision
+from lib.collision_mesh import CollisionMesh
 from lib.model_rendering import TexturedModel, CollisionModel, Minimap
 from widgets.editor_widgets import ErrorAnalyzer
 from lib.dolreader import DolFile, read_float, write_float, read_load_immediate_r0, write_load_immediate_r0, UnmappedAddress
@@ -44,6 +47,10 @@ from lib.bmd_render import clear_temp_folder, load_textured_bmd
 from lib.game_visualizer import Game
 PIKMIN2GEN = "Generator files (defaultgen.txt;initgen.txt;plantsgen.txt;*.txt)"
 
+# Saves use the cached BOL sections, checked against a full rewrite until the editor is known
+# to report every change, see mark_selection_dirty
+BOL.verify_cache = True
+
 
 def detect_dol_region(dol):
     try:
@@ -129,11 +136,17 @@ class GenEditor(QMainWindow):
         self.level_view.dolphin = self.dolphin
         self.last_chosen_type = ""
 
+    def close_archive(self):
+        # The loaded archive is memory-mapped, see Archive.from_file with lazy=True
+        if self.loaded_archive is not None:
+            self.loaded_archive.close()
+        self.loaded_archive = None
+        self.loaded_archive_file = None
+
     @catch_exception
     def reset(self):
         self.last_position_clicked = []
-        self.loaded_archive = None
-        self.loaded_archive_file = None
+        self.close_archive()
         self.history.reset()
         self.object_to_be_added = None
         self.level_view.reset(keep_collision=True)
@@ -812,6 +825,7 @@ class GenEditor(QMainWindow):
     def connect_actions(self):
         self.level_view.select_update.connect(self.action_update_info)
         self.level_view.select_update.connect(self.select_from_3d_to_treeview)
+        self.level_view.select_update.connect(self.mark_selection_dirty)
         #self.pik_control.lineedit_coordinatex.textChanged.connect(self.create_field_edit_action("coordinatex"))
         #self.pik_control.lineedit_coordinatey.textChanged.connect(self.create_field_edit_action("coordinatey"))
         #self.pik_control.lineedit_coordinatez.textChanged.connect(self.create_field_edit_action("coordinatez"))
@@ -848,6 +862,7 @@ class GenEditor(QMainWindow):
         self.leveldatatreeview.duplicate.connect(self.duplicate_group)
         self.leveldatatreeview.split.connect(self.split_group)
         self.leveldatatreeview.split_checkpoint.connect(self.split_group_checkpoint)
+        self.leveldatatreeview.ground_all.connect(self.ground_all_of_group)
 
     def split_group_checkpoint(self, group_item, item):
         group = group_item.bound_to
@@ -870,6 +885,7 @@ class GenEditor(QMainWindow):
         new_group.prevlinks = [group.grouplink, -1, -1, -1]
         new_group.nextlinks = deepcopy(group.nextgroup)
         group.nextgroup = [new_group.grouplink, -1, -1, -1]
+        self.level_file.mark_objects_dirty([group])
 
         self.leveldatatreeview.set_objects(self.level_file)
         self.update_3d()
@@ -882,18 +898,9 @@ class GenEditor(QMainWindow):
         if point == group.points[-1]:
             return
 
-        # Get an unused link to connect the groups with
-        new_link = self.level_file.enemypointgroups.new_link_id()
-        if new_link >= 2**14:
-            raise RuntimeError("Too many links, cannot create more")
-
-        # Get new hopefully unused group id
-        new_id = self.level_file.enemypointgroups.new_group_id()
-        new_group = group.copy_group_after(new_id, point)
-        self.level_file.enemypointgroups.groups.append(new_group)
-        group.remove_after(point)
-
-        group.points[-1].link = new_group.points[0].link = new_link
+        # The new group gets an unused link to connect it with the end of the old one
+        self.level_file.enemypointgroups.split_group(group, point)
+        self.level_file.mark_objects_dirty([group])
 
         self.leveldatatreeview.set_objects(self.level_file)
         self.update_3d()
@@ -902,9 +909,7 @@ class GenEditor(QMainWindow):
     def duplicate_group(self, item):
         group = item.bound_to
         if isinstance(group, libbol.EnemyPointGroup):
-            new_id = len(self.level_file.enemypointgroups.groups)
-            new_group = group.copy_group(new_id)
-            self.level_file.enemypointgroups.groups.append(new_group)
+            self.level_file.enemypointgroups.duplicate_group(group)
 
             self.leveldatatreeview.set_objects(self.level_file)
             self.update_3d()
@@ -922,6 +927,7 @@ class GenEditor(QMainWindow):
             group.points.reverse()
         elif isinstance(group, libbol.Route):
             group.points.reverse()
+        self.level_file.mark_objects_dirty([group])
 
         self.leveldatatreeview.set_objects(self.level_file)
         self.update_3d()
@@ -939,6 +945,7 @@ class GenEditor(QMainWindow):
                 self.level_view.selected_positions.append(point.end)
             else:
                 self.level_view.selected_positions.append(point.position)
+        self.level_file.mark_objects_dirty([group])
         self.update_3d()
 
     def action_open_rotationedit_window(self):
@@ -969,7 +976,7 @@ class GenEditor(QMainWindow):
             if chosentype == "Archived files (*.arc)" or filepath.endswith(".arc"):
                 with open(filepath, "rb") as f:
                     try:
-                        self.loaded_archive = Archive.from_file(f)
+                        self.loaded_archive = Archive.from_file(f, lazy=True)
                         root_name = self.loaded_archive.root.name
                         coursename = find_file(self.loaded_archive.root, "_course.bol")
                         bol_file = self.loaded_archive[root_name + "/" + coursename]
@@ -982,8 +989,7 @@ class GenEditor(QMainWindow):
                         print("Error appeared while loading:", error)
                         traceback.print_exc()
                         open_error_dialog(str(error), self)
-                        self.loaded_archive = None
-                        self.loaded_archive_file = None
+                        self.close_archive()
                         return
 
                     try:
@@ -1007,7 +1013,7 @@ class GenEditor(QMainWindow):
             else:
                 with open(filepath, "rb") as f:
                     try:
-                        bol_file = BOL.from_file(f)
+                        bol_file = bolcache.load_cached(filepath)
                         self.setup_bol_file(bol_file, filepath)
                         self.leveldatatreeview.set_objects(bol_file)
                         self.current_gen_path = filepath
@@ -1040,25 +1046,19 @@ class GenEditor(QMainWindow):
         if choice.endswith("(3D Model)"):
             alternative_mesh = load_textured_bmd(bmdfile)
             with open("lib/temp/temp.obj", "r") as f:
-                verts, faces, normals = py_obj.read_obj(f)
+                mesh = py_obj.read_obj_mesh(f)
 
-            self.setup_collision(verts, faces, bmdfile, alternative_mesh)
+            self.setup_collision(mesh, bmdfile, alternative_mesh)
 
         elif choice.endswith("(3D Collision)"):
             bco_coll = RacetrackCollision()
-            verts = []
-            faces = []
 
             with open(collisionfile, "rb") as f:
                 bco_coll.load_file(f)
 
-            for vert in bco_coll.vertices:
-                verts.append(vert)
-
-            for v1, v2, v3, collision_type, rest in bco_coll.triangles:
-                faces.append(((v1 + 1, None), (v2 + 1, None), (v3 + 1, None)))
-            model = CollisionModel(bco_coll)
-            self.setup_collision(verts, faces, collisionfile, alternative_mesh=model)
+            mesh = bco_coll.mesh
+            model = CollisionModel(mesh)
+            self.setup_collision(mesh, collisionfile, alternative_mesh=model)
 
     def load_optional_3d_file_arc(self, additional_files, bmdfile, collisionfile, arcfilepath):
         choice, pos = FileSelect.open_file_list(self, additional_files,
@@ -1071,24 +1071,18 @@ class GenEditor(QMainWindow):
             bmdpath = "lib/temp/temp.bmd"
             alternative_mesh = load_textured_bmd(bmdpath)
             with open("lib/temp/temp.obj", "r") as f:
-                verts, faces, normals = py_obj.read_obj(f)
+                mesh = py_obj.read_obj_mesh(f)
 
-            self.setup_collision(verts, faces, arcfilepath, alternative_mesh)
+            self.setup_collision(mesh, arcfilepath, alternative_mesh)
 
         elif choice.endswith("(3D Collision)"):
             bco_coll = RacetrackCollision()
-            verts = []
-            faces = []
 
             bco_coll.load_file(collisionfile)
 
-            for vert in bco_coll.vertices:
-                verts.append(vert)
-
-            for v1, v2, v3, collision_type, rest in bco_coll.triangles:
-                faces.append(((v1 + 1, None), (v2 + 1, None), (v3 + 1, None)))
-            model = CollisionModel(bco_coll)
-            self.setup_collision(verts, faces, arcfilepath, alternative_mesh=model)
+            mesh = bco_coll.mesh
+            model = CollisionModel(mesh)
+            self.setup_collision(mesh, arcfilepath, alternative_mesh=model)
 
     def load_file(self, filepath, additional=None):
         if filepath.endswith('.bol'):
@@ -1098,11 +1092,10 @@ class GenEditor(QMainWindow):
             return self.load_arc_file(filepath, additional=additional)
 
     def load_bol_file(self, filepath, additional=None):
-        with open(filepath, "rb") as f:
-            bol_file = BOL.from_file(f)
-            self.setup_bol_file(bol_file, filepath)
-            self.leveldatatreeview.set_objects(bol_file)
-            self.current_gen_path = filepath
+        bol_file = bolcache.load_cached(filepath)
+        self.setup_bol_file(bol_file, filepath)
+        self.leveldatatreeview.set_objects(bol_file)
+        self.current_gen_path = filepath
 
         if not filepath.endswith('_course.bol'):
             return
@@ -1114,9 +1107,9 @@ class GenEditor(QMainWindow):
 
             alternative_mesh = load_textured_bmd(bmdfile)
             with open("lib/temp/temp.obj", "r") as f:
-                verts, faces, normals = py_obj.read_obj(f)
+                mesh = py_obj.read_obj_mesh(f)
 
-            self.setup_collision(verts, faces, bmdfile, alternative_mesh)
+            self.setup_collision(mesh, bmdfile, alternative_mesh)
 
         elif additional == 'collision':
             collisionfile = filepath[:-len('.bol')] + ".bco"
@@ -1127,21 +1120,15 @@ class GenEditor(QMainWindow):
             with open(collisionfile, "rb") as f:
                 bco_coll.load_file(f)
 
-            verts = []
-            for vert in bco_coll.vertices:
-                verts.append(vert)
 
-            faces = []
-            for v1, v2, v3, collision_type, rest in bco_coll.triangles:
-                faces.append(((v1 + 1, None), (v2 + 1, None), (v3 + 1, None)))
-
-            model = CollisionModel(bco_coll)
-            self.setup_collision(verts, faces, collisionfile, alternative_mesh=model)
+            mesh = bco_coll.mesh
+            model = CollisionModel(mesh)
+            self.setup_collision(mesh, collisionfile, alternative_mesh=model)
 
     def load_arc_file(self, filepath, additional=None):
         with open(filepath, "rb") as f:
             try:
-                self.loaded_archive = Archive.from_file(f)
+                self.loaded_archive = Archive.from_file(f, lazy=True)
                 root_name = self.loaded_archive.root.name
                 coursename = find_file(self.loaded_archive.root, "_course.bol")
                 bol_file = self.loaded_archive[root_name + "/" + coursename]
@@ -1151,8 +1138,7 @@ class GenEditor(QMainWindow):
                 self.current_gen_path = filepath
                 self.loaded_archive_file = coursename
             except:
-                self.loaded_archive = None
-                self.loaded_archive_file = None
+                self.close_archive()
                 raise
 
         if additional == 'model':
@@ -1166,9 +1152,9 @@ class GenEditor(QMainWindow):
 
             alternative_mesh = load_textured_bmd(bmdpath)
             with open("lib/temp/temp.obj", "r") as f:
-                verts, faces, normals = py_obj.read_obj(f)
+                mesh = py_obj.read_obj_mesh(f)
 
-            self.setup_collision(verts, faces, filepath, alternative_mesh)
+            self.setup_collision(mesh, filepath, alternative_mesh)
 
         elif additional == 'collision':
             collisionfile = get_file_safe(self.loaded_archive.root, "_course.bco")
@@ -1178,16 +1164,10 @@ class GenEditor(QMainWindow):
             bco_coll = RacetrackCollision()
             bco_coll.load_file(collisionfile)
 
-            verts = []
-            for vert in bco_coll.vertices:
-                verts.append(vert)
-
-            faces = []
-            for v1, v2, v3, collision_type, rest in bco_coll.triangles:
-                faces.append(((v1 + 1, None), (v2 + 1, None), (v3 + 1, None)))
 
-            model = CollisionModel(bco_coll)
-            self.setup_collision(verts, faces, filepath, alternative_mesh=model)
+            mesh = bco_coll.mesh
+            model = CollisionModel(mesh)
+            self.setup_collision(mesh, filepath, alternative_mesh=model)
 
     def setup_bol_file(self, bol_file, filepath):
         self.level_file = bol_file
@@ -1203,6 +1183,13 @@ class GenEditor(QMainWindow):
         save_cfg(self.configuration)
         self.current_gen_path = filepath
 
+    def store_bol_snapshot(self, data):
+        # Reopening the saved file loads it from the snapshot, see lib/bolcache.py
+        try:
+            bolcache.store_snapshot(self.level_file, bolcache.content_hash(data))
+        except OSError as error:
+            print("Couldn't store BOL snapshot:", error)
+
     @catch_exception_with_dialog
     def button_save_level(self, *args, **kwargs):
         if self.current_gen_path is not None:
@@ -1210,19 +1197,30 @@ class GenEditor(QMainWindow):
                 assert self.loaded_archive_file is not None
                 root_name = self.loaded_archive.root.name
                 file = self.loaded_archive[root_name + "/" + self.loaded_archive_file]
-                file.seek(0)
-
-                self.level_file.write(file)
-
-                with open(self.current_gen_path, "wb") as f:
-                    self.loaded_archive.write_arc(f)
+                # The archive file shares the packed BOL data instead of copying it
+                file.set_data(self.level_file.to_buffer(use_cache=True))
+                self.mark_selection_dirty()
+
+                if self.loaded_archive.can_update_in_place(self.current_gen_path):
+                    # Only rewrite the files in the archive that have changed
+                    with open(self.current_gen_path, "r+b") as f:
+                        self.loaded_archive.update_arc(f)
+                else:
+                    # The files that still read from the memory-mapped archive need their own copy
+                    # before it is overwritten
+                    self.loaded_archive.unmap()
+                    with open(self.current_gen_path, "wb") as f:
+                        self.loaded_archive.write_arc(f)
 
                 self.set_has_unsaved_changes(False)
                 self.statusbar.showMessage("Saved to {0}".format(self.current_gen_path))
 
             else:
+                data = self.level_file.to_buffer(use_cache=True)
                 with open(self.current_gen_path, "wb") as f:
-                    self.level_file.write(f)
+                    f.write(data)
+                    self.mark_selection_dirty()
+                    self.store_bol_snapshot(data)
                     self.set_has_unsaved_changes(False)
 
                     self.statusbar.showMessage("Saved to {0}".format(self.current_gen_path))
@@ -1252,18 +1250,23 @@ class GenEditor(QMainWindow):
                 self.loaded_archive_file = find_file(self.loaded_archive.root, "_course.bol")
                 root_name = self.loaded_archive.root.name
                 file = self.loaded_archive[root_name + "/" + self.loaded_archive_file]
-                file.seek(0)
-
-                self.level_file.write(file)
+                # The archive file shares the packed BOL data instead of copying it
+                file.set_data(self.level_file.to_buffer(use_cache=True))
+                self.mark_selection_dirty()
 
+                # filepath can be the memory-mapped archive itself
+                self.loaded_archive.unmap()
                 with open(filepath, "wb") as f:
                     self.loaded_archive.write_arc(f)
 
                 self.set_has_unsaved_changes(False)
                 self.statusbar.showMessage("Saved to {0}".format(filepath))
             else:
+                data = self.level_file.to_buffer(use_cache=True)
                 with open(filepath, "wb") as f:
-                    self.level_file.write(f)
+                    f.write(data)
+                    self.mark_selection_dirty()
+                    self.store_bol_snapshot(data)
 
                     self.set_has_unsaved_changes(False)
 
@@ -1290,10 +1293,10 @@ class GenEditor(QMainWindow):
                 return
 
             with open(filepath, "r") as f:
-                verts, faces, normals = py_obj.read_obj(f)
+                mesh = py_obj.read_obj_mesh(f)
             alternative_mesh = TexturedModel.from_obj_path(filepath, rotate=True)
 
-            self.setup_collision(verts, faces, filepath, alternative_mesh)
+            self.setup_collision(mesh, filepath, alternative_mesh)
 
         except Exception as e:
             traceback.print_exc()
@@ -1312,22 +1315,21 @@ class GenEditor(QMainWindow):
             clear_temp_folder()
             if choosentype == "Archived files (*.arc)" or filepath.endswith(".arc"):
                 with open(filepath, "rb") as f:
-                    rarc = Archive.from_file(f)
-
-                root_name = rarc.root.name
-                bmd_filename = find_file(rarc.root, "_course.bmd")
-                bmd = rarc[root_name][bmd_filename]
-                with open("lib/temp/temp.bmd", "wb") as f:
-                    f.write(bmd.getvalue())
+                    with Archive.from_file(f, lazy=True) as rarc:
+                        root_name = rarc.root.name
+                        bmd_filename = find_file(rarc.root, "_course.bmd")
+                        bmd = rarc[root_name][bmd_filename]
+                        with open("lib/temp/temp.bmd", "wb") as out:
+                            bmd.dump(out)
 
                 bmdpath = "lib/temp/temp.bmd"
                 
 
             alternative_mesh = load_textured_bmd(bmdpath)
             with open("lib/temp/temp.obj", "r") as f:
-                verts, faces, normals = py_obj.read_obj(f)
+                mesh = py_obj.read_obj_mesh(f)
 
-            self.setup_collision(verts, faces, filepath, alternative_mesh)
+            self.setup_collision(mesh, filepath, alternative_mesh)
 
         except Exception as e:
             traceback.print_exc()
@@ -1341,36 +1343,28 @@ class GenEditor(QMainWindow):
                 "MKDD Collision (*.bco);;Archived files (*.arc);;All files (*)")
             if filepath:
                 bco_coll = RacetrackCollision()
-                verts = []
-                faces = []
 
                 if choosentype == "Archived files (*.arc)" or filepath.endswith(".arc"):
                     with open(filepath, "rb") as f:
-                        rarc = Archive.from_file(f)
-
-
-                    root_name = rarc.root.name
-                    collision_file = find_file(rarc.root, "_course.bco")
-                    bco = rarc[root_name][collision_file]
-                    bco_coll.load_file(bco)
+                        with Archive.from_file(f, lazy=True) as rarc:
+                            root_name = rarc.root.name
+                            collision_file = find_file(rarc.root, "_course.bco")
+                            bco = rarc[root_name][collision_file]
+                            bco_coll.load_file(bco)
                 else:
                     with open(filepath, "rb") as f:
                         bco_coll.load_file(f)
 
-                for vert in bco_coll.vertices:
-                    verts.append(vert)
-
-                for v1, v2, v3, collision_type, rest in bco_coll.triangles:
-                    faces.append(((v1+1, None), (v2+1, None), (v3+1, None)))
-                model = CollisionModel(bco_coll)
-                self.setup_collision(verts, faces, filepath, alternative_mesh=model)
+                mesh = bco_coll.mesh
+                model = CollisionModel(mesh)
+                self.setup_collision(mesh, filepath, alternative_mesh=model)
 
         except Exception as e:
             traceback.print_exc()
             open_error_dialog(str(e), self)
 
-    def setup_collision(self, verts, faces, filepath, alternative_mesh=None):
-        self.level_view.set_collision(verts, faces, alternative_mesh)
+    def setup_collision(self, mesh, filepath, alternative_mesh=None):
+        self.level_view.set_collision(mesh, alternative_mesh)
         self.pathsconfig["collision"] = filepath
         editor_config = self.configuration["editor"]
         alternative_mesh.hidden_collision_types = \
@@ -1437,7 +1431,7 @@ class GenEditor(QMainWindow):
             if isinstance(obj, (libbol.EnemyPointGroup, libbol.CheckpointGroup, libbol.Route,
                                                     libbol.LightParam, libbol.MGEntry)):
                 if isinstance(obj, libbol.EnemyPointGroup):
-                    self.level_file.enemypointgroups.groups.append(obj)
+                    self.level_file.enemypointgroups.add_group(obj)
                 elif isinstance(obj, libbol.CheckpointGroup):
                     self.level_file.checkpoints.groups.append(obj)
                 elif isinstance(obj, libbol.Route):
@@ -1519,7 +1513,8 @@ class GenEditor(QMainWindow):
 
             if isinstance(object, libbol.EnemyPoint):
                 placeobject.group = group
-                self.level_file.enemypointgroups.groups[group].points.insert(position, placeobject)
+                enemypointgroups = self.level_file.enemypointgroups
+                enemypointgroups.insert_point(enemypointgroups.groups[group], placeobject, position)
             elif isinstance(object, libbol.RoutePoint):
                 self.level_file.routes[group].points.insert(position, placeobject)
             elif isinstance(object, libbol.MapObject):
@@ -1573,6 +1568,7 @@ class GenEditor(QMainWindow):
         #    self.pik_control.set_info(obj, obj.position, obj.rotation)
 
         #self.pikmin_gen_view.update()
+        self.mark_selection_dirty()
         self.level_view.do_redraw()
         self.pik_control.update_info()
         self.set_has_unsaved_changes(True)
@@ -1680,31 +1676,95 @@ class GenEditor(QMainWindow):
             self.pik_control.set_info(obj, obj.position, obj.rotation)
         """
         #self.pikmin_gen_view.update()
+        self.mark_selection_dirty()
         self.level_view.do_redraw()
         self.set_has_unsaved_changes(True)
         self.pik_control.update_info()
 
     def action_ground_objects(self):
-        for pos in self.level_view.selected_positions:
-            if self.level_view.collision is None:
-                return None
-            height = self.level_view.collision.collide_ray_closest(pos.x, pos.z, pos.y)
-
-            if height is not None:
-                pos.y = height
+        if self.level_view.collision is None:
+            return None
+        self.ground_positions(self.level_view.selected_positions)
+        self.mark_selection_dirty()
 
         self.pik_control.update_info()
         self.level_view.gizmo.move_to_average(self.level_view.selected_positions)
         self.set_has_unsaved_changes(True)
         self.level_view.do_redraw()
 
+    def ground_positions(self, positions):
+        # Puts the positions on the ground below or above them with one query for all of them
+        positions = list(positions)
+        heights = self.level_view.collision.ground_many([pos.x for pos in positions],
+                                                        [pos.z for pos in positions],
+                                                        [pos.y for pos in positions])
+        for pos, height in zip(positions, heights.tolist()):
+            if not isnan(height):
+                pos.y = height
+
+    def ground_all_of_group(self, item):
+        if self.level_view.collision is None:
+            return None
+
+        group = item.bound_to
+        if group is not None:
+            positions = []
+            for point in group.points:
+                if isinstance(group, libbol.CheckpointGroup):
+                    positions.append(point.start)
+                    positions.append(point.end)
+                else:
+                    positions.append(point.position)
+            self.ground_positions(positions)
+            self.level_file.mark_objects_dirty([group])
+        else:
+            tree = self.leveldatatreeview
+            section = {tree.enemyroutes: libbol.ENEMYITEMPOINT, tree.checkpointgroups: libbol.CHECKPOINT,
+                       tree.objectroutes: libbol.ROUTEGROUP, tree.objects: libbol.OBJECTS,
+                       tree.kartpoints: libbol.KARTPOINT, tree.areas: libbol.AREA,
+                       tree.cameras: libbol.CAMERA, tree.respawnpoints: libbol.RESPAWNPOINT}[item]
+
+            # Building the columns can replace vectors that several records shared (see SectionColumns),
+            # the selection is pointed at the vectors the records have afterwards
+            selectedfields = self.selected_position_fields()
+
+            # Whole sections are grounded on their columns without going through the records.
+            # Only the points on the track are grounded, not e.g. the points a camera looks at.
+            columns = self.level_file.columns(section)
+            for name in (("start", "end") if section == libbol.CHECKPOINT else ("position",)):
+                column = columns.column(name)
+                heights = self.level_view.collision.ground_many(column[:, 0], column[:, 2], column[:, 1])
+                hit = ~isnan(heights)
+                column[hit, 1] = heights[hit]
+            self.level_file.mark_dirty(section)
+
+            self.level_view.selected_positions = [pos if name is None else getattr(obj, name)
+                                                  for obj, name, pos in selectedfields]
+
+        self.action_update_info()
+        self.level_view.gizmo.move_to_average(self.level_view.selected_positions)
+        self.set_has_unsaved_changes(True)
+        self.update_3d()
+
+    def selected_position_fields(self):
+        # (object, attribute name, position) for each selected position, the object and name are
+        # None for positions that don't belong to a selected object
+        fields = {}
+        for obj in self.level_view.selected:
+            for name in ("position", "position2", "position3", "start", "end"):
+                pos = getattr(obj, name, None)
+                if pos is not None:
+                    fields[id(pos)] = (obj, name)
+
+        return [fields.get(id(pos), (None, None)) + (pos,) for pos in self.level_view.selected_positions]
+
     def action_delete_objects(self):
         tobedeleted = []
         for obj in self.level_view.selected:
             if isinstance(obj, libbol.EnemyPoint):
                 for group in self.level_file.enemypointgroups.groups:
                     if obj in group.points:
-                        group.points.remove(obj)
+                        self.level_file.enemypointgroups.remove_point(group, obj)
                         break
 
             elif isinstance(obj, libbol.RoutePoint):
@@ -1732,7 +1792,7 @@ class GenEditor(QMainWindow):
             elif isinstance(obj, libbol.CheckpointGroup):
                 self.level_file.checkpoints.groups.remove(obj)
             elif isinstance(obj, libbol.EnemyPointGroup):
-                self.level_file.enemypointgroups.groups.remove(obj)
+                self.level_file.enemypointgroups.remove_group(obj)
             elif isinstance(obj, libbol.Route):
                 self.level_file.routes.remove(obj)
             elif isinstance(obj, libbol.LightParam):
@@ -1821,6 +1881,16 @@ class GenEditor(QMainWindow):
         self.level_view.gizmo.move_to_average(self.level_view.selected_positions)
         self.level_view.do_redraw()
 
+    def update_selected_data(self):
+        # Called by the data editor after it changed a field of the selected object
+        self.mark_selection_dirty()
+        self.update_3d()
+
+    def update_enemy_point(self):
+        # The data editor sets the link of the point directly
+        self.level_file.enemypointgroups.invalidate_links()
+        self.update_selected_data()
+
     def select_from_3d_to_treeview(self):
         if self.level_file is not None:
             selected = self.level_view.selected
@@ -1864,6 +1934,15 @@ class GenEditor(QMainWindow):
                     #self._dontselectfromtree = True
                     self.leveldatatreeview.setCurrentItem(item)
 
+    def mark_selection_dirty(self):
+        # Almost every edit works on the selected objects, so their sections are re-encoded on the
+        # next save. This is called on selection, by the edit actions and again after saving, because
+        # a save clears the dirty sections while the selection can still be edited (not every field
+        # of the data editor reports its changes). Saves are checked against a full rewrite with
+        # BOL.verify_cache, so a change that isn't marked is still saved.
+        if self.level_file is not None:
+            self.level_file.mark_objects_dirty(self.level_view.selected)
+
     @catch_exception
     def action_update_info(self):
         if self.level_file is not None:
@@ -1880,9 +1959,11 @@ class GenEditor(QMainWindow):
                         if camera.route == index:
                             objects.append("Camera {0}".format(i))
 
-                    self.pik_control.set_info(currentobj, self.update_3d, objects)
+                    self.pik_control.set_info(currentobj, self.update_selected_data, objects)
+                elif isinstance(currentobj, libbol.EnemyPoint):
+                    self.pik_control.set_info(currentobj, self.update_enemy_point)
                 else:
-                    self.pik_control.set_info(currentobj, self.update_3d)
+                    self.pik_control.set_info(currentobj, self.update_selected_data)
 
                 self.pik_control.update_info()
             else:
@@ -2064,27 +2145,24 @@ if __name__ == "__main__":
         if args.collision is not None:
             if args.collision.endswith(".obj"):
                 with open(args.collision, "r") as f:
-                    verts, faces, normals = py_obj.read_obj(f)
+                    mesh = py_obj.read_obj_mesh(f)
 
             elif args.collision.endswith(".bin"):
                 with open(args.collision, "rb") as f:
                     collision = py_obj.PikminCollision(f)
-                verts = collision.vertices
-                faces = [face[0] for face in collision.faces]
+                mesh = CollisionMesh.from_obj_faces(collision.vertices, [face[0] for face in collision.faces])
 
             elif args.collision.endswith(".szs") or args.collision.endswith(".arc"):
                 with open(args.collision, "rb") as f:
                     archive = Archive.from_file(f)
                 f = archive["text/grid.bin"]
                 collision = py_obj.PikminCollision(f)
-
-                verts = collision.vertices
-                faces = [face[0] for face in collision.faces]
+                mesh = CollisionMesh.from_obj_faces(collision.vertices, [face[0] for face in collision.faces])
 
             else:
                 raise RuntimeError("Unknown collision file type:", args.collision)
 
-            pikmin_gui.setup_collision(verts, faces, args.collision)
+            pikmin_gui.setup_collision(mesh, args.collision)
 
         if args.waterbox is not None:
             if args.waterbox.endswith(".txt"):
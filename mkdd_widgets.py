@@ -25,7 +25,7 @@ from lib.collision import Collision
 from widgets.editor_widgets import catch_exception, catch_exception_with_dialog
 #from pikmingen import PikminObject
 from libpiktxt import PikminTxt
-from opengltext import draw_collision
+from opengltext import draw_collision_mesh
 from lib.vectors import Matrix4x4, Vector3, Line, Plane, Triangle
 import pikmingen
 from lib.model_rendering import TexturedPlane, Model, Grid, GenericObject, Material, Minimap
@@ -485,8 +485,8 @@ class BolMapViewer(QtWidgets.QOpenGLWidget):
         self.MOVE_RIGHT = 0
         self.SPEEDUP = 0
 
-    def set_collision(self, verts, faces, alternative_mesh):
-        self.collision = Collision(verts, faces)
+    def set_collision(self, mesh, alternative_mesh):
+        self.collision = Collision(mesh)
 
         if self.main_model is None:
             self.main_model = glGenLists(1)
@@ -495,7 +495,7 @@ class BolMapViewer(QtWidgets.QOpenGLWidget):
 
         glNewList(self.main_model, GL_COMPILE)
         #glBegin(GL_TRIANGLES)
-        draw_collision(verts, faces)
+        draw_collision_mesh(mesh)
         #glEnd()
         glEndList()
 
@@ -870,7 +870,9 @@ class BolMapViewer(QtWidgets.QOpenGLWidget):
                         enemypoints_to_highlight.add(next_enemy_point)
 
                 point_index = 0
-                for group in self.level_file.enemypointgroups.groups:
+                enemypointgroups = self.level_file.enemypointgroups
+                group_starts = {id(group.points[0]): group for group in enemypointgroups.groups if group.points}
+                for group in enemypointgroups.groups:
                     group_selected = False
                     for point in group.points:
                         if point in select_optimize:
@@ -927,11 +929,9 @@ class BolMapViewer(QtWidgets.QOpenGLWidget):
                     color_gen.shuffle(color_components)
                     color_components[2] += 0.5
                     glColor3f(*color_components)
-                    for groupB in self.level_file.enemypointgroups.groups:
-                        if group is groupB:
-                            continue
-                        pointB = groupB.points[0]
-                        if pointA.link == pointB.link:
+                    for pointB in enemypointgroups.points_with_link(pointA.link):
+                        groupB = group_starts.get(id(pointB))
+                        if groupB is not None and groupB is not group:
                             groupB_selected = any(map(lambda p: p in select_optimize, groupB.points))
                             glLineWidth(3.0 if (group_selected or groupB_selected) else 1.0)
                             glBegin(GL_LINES)
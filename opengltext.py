@@ -4,8 +4,11 @@ from PyQt5 import QtGui, QtCore, QtOpenGL, QtWidgets
 #from PyQt5.QtOpenGL import QOpenGLWidget
 # PyOpenGL imports
 from OpenGL.GL import *
+from OpenGL import error as glerror
 import OpenGL.arrays.vbo as glvbo
+import numpy
 from lib.vectors import Vector3, Triangle
+from lib.collision_mesh import CollisionMesh
 
 from widgets.editor_widgets import catch_exception
 
@@ -51,90 +54,70 @@ for coltrans in [
             COLORS.append(color)
 
 DO_GRAYSCALE = False
+# Draw the collision from vertex arrays. Without them, or if they raise an OpenGL error,
+# the faces are drawn in immediate mode.
+DO_VERTEX_ARRAYS = True
 
 def draw_collision(verts, faces):
-    biggest, smallest = None, None
-    for x, y, z in verts:
-        if biggest is None:
-            biggest = smallest = y
-        if y > biggest:
-            biggest = y
-        if y < smallest:
-            smallest = y
-    scaleheight = biggest - smallest
+    draw_collision_mesh(CollisionMesh.from_obj_faces(verts, faces))
+
+
+def draw_collision_mesh(mesh):
+    # Draws the faces of a CollisionMesh colored by height and shaded by how much they face lightvec
+    if len(mesh) == 0:
+        return
+
+    vertices = mesh.vertices.astype(numpy.float64)
+    smallest = vertices[:, 1].min()
+    scaleheight = vertices[:, 1].max() - smallest
     if scaleheight == 0:
         scaleheight = 1
 
     print(len(COLORS))
-    lightvec = Vector3(0, 1, -1)
+    lightvec = numpy.array((0.0, 1.0, -1.0))
+
+    corners = vertices[mesh.faces]
+    positions = corners[:, :, (0, 2, 1)] * (1.0, -1.0, 1.0)
+
+    if DO_GRAYSCALE:
+        grayscale = (corners[:, :, 1].mean(axis=1) - smallest) / scaleheight
+        colors = numpy.repeat(grayscale, 9).reshape(-1, 3, 3)
+    else:
+        normals = numpy.cross(positions[:, 1] - positions[:, 0], positions[:, 2] - positions[:, 0])
+        lengths = numpy.sqrt((normals**2).sum(axis=1))
+        angles = numpy.zeros(len(normals))
+        nonzero = lengths != 0
+        angles[nonzero] = (normals[nonzero] @ lightvec) / (lengths[nonzero] * numpy.sqrt(lightvec @ lightvec))
+        light = numpy.maximum(numpy.abs(angles), 0.3)
+
+        indices = ((corners[:, :, 1] - smallest) / scaleheight * len(COLORS)).astype(numpy.int64)
+        indices = numpy.clip(indices, 0, len(COLORS) - 1)
+        colors = numpy.array(COLORS, dtype=numpy.float64)[indices] * light[:, None, None] / 256.0
+
+    positions = numpy.ascontiguousarray(positions.reshape(-1, 3), dtype=numpy.float32)
+    colors = numpy.ascontiguousarray(colors.reshape(-1, 3), dtype=numpy.float32)
+
+    if DO_VERTEX_ARRAYS:
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        try:
+            glVertexPointer(3, GL_FLOAT, 0, positions)
+            glColorPointer(3, GL_FLOAT, 0, colors)
+            glDrawArrays(GL_TRIANGLES, 0, len(positions))
+            return
+        except glerror.Error as error:
+            print("Couldn't draw the collision from vertex arrays, using immediate mode:", error)
+        finally:
+            glDisableClientState(GL_COLOR_ARRAY)
+            glDisableClientState(GL_VERTEX_ARRAY)
 
     glBegin(GL_TRIANGLES)
-
-    i = -1
-    for v1, v2, v3 in faces:
-        i += 1
-        v1x, v1y, v1z = verts[v1[0]-1]
-        v2x, v2y, v2z = verts[v2[0]-1]
-        v3x, v3y, v3z = verts[v3[0]-1]
-
-        # grayscale = ((v1y+v2y+v3y)/3.0)/scaleheight
-        """average_y = max(v1y, v2y,v3y) - smallest#(v1y+v2y+v3y)/3.0 - smallest
-        index = int((average_y/scaleheight)*len(COLORS))
-        if index < 0:
-            index = 0
-        if index >= len(COLORS):
-            index = len(COLORS)-1
-        r, g, b = COLORS[index]
-        glColor3f(r/256.0,g/256.0,b/256.0)"""
-
-        if DO_GRAYSCALE:
-            average_y = (v1y + v2y + v3y) / 3.0 - smallest
-            grayscale = average_y / scaleheight
-
-            glColor3f(grayscale, grayscale, grayscale)
-            glVertex3f(v1x, -v1z, v1y)
-            glVertex3f(v2x, -v2z, v2y)
-            glVertex3f(v3x, -v3z, v3y)
-
-        else:
-            face = Triangle(Vector3(v1x, -v1z, v1y), Vector3(v2x, -v2z, v2y), Vector3(v3x, -v3z, v3y))
-            if face.normal.norm() != 0:
-                angle = lightvec.cos_angle(face.normal)
-            else:
-                angle = 0.0
-            light = max(abs(angle), 0.3)
-
-            average_y = v1y - smallest
-            index = int((average_y / scaleheight) * len(COLORS))
-            if index < 0:
-                index = 0
-            if index >= len(COLORS):
-                index = len(COLORS) - 1
-            r, g, b = (i * light for i in COLORS[index])
-            glColor3f(r / 256.0, g / 256.0, b / 256.0)
-            glVertex3f(v1x, -v1z, v1y)
-
-            average_y = v2y - smallest
-            index = int((average_y / scaleheight) * len(COLORS))
-            if index < 0:
-                index = 0
-            if index >= len(COLORS):
-                index = len(COLORS) - 1
-            r, g, b = (i * light for i in COLORS[index])
-            glColor3f(r / 256.0, g / 256.0, b / 256.0)
-            glVertex3f(v2x, -v2z, v2y)
-
-            average_y = v3y - smallest
-            index = int((average_y / scaleheight) * len(COLORS))
-            if index < 0:
-                index = 0
-            if index >= len(COLORS):
-                index = len(COLORS) - 1
-            r, g, b = (i * light for i in COLORS[index])
-            glColor3f(r / 256.0, g / 256.0, b / 256.0)
-            glVertex3f(v3x, -v3z, v3y)
+    for (x, y, z), (r, g, b) in zip(positions.tolist(), colors.tolist()):
+        glColor3f(r, g, b)
+        glVertex3f(x, y, z)
     glEnd()
 
+
 class GLPlotWidget(QtWidgets.QOpenGLWidget):
     # default window size
     width, height = 2000, 2000
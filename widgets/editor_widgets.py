@@ -89,20 +89,13 @@ class ErrorAnalyzer(QMdiSubWindow):
             results.write("\n")
 
         # Check enemy point linkage errors
-        links = {}
-        for group_index, group in enumerate(bol.enemypointgroups.groups):
-            for i, point in enumerate(group.points):
-                if point.link == -1:
-                    continue
-
-                if point.link not in links:
-                    links[point.link] = [(group_index, i, point)]
-                else:
-                    links[point.link].append(((group_index, i, point)))
-
-        for link_id, points in links.items():
-            if len(points) == 1:
-                group_index, i, point = points[0]
+        for link_id, points in bol.enemypointgroups.link_index().items():
+            if link_id != -1 and len(points) == 1:
+                point = points[0]
+                for group_index, group in enumerate(bol.enemypointgroups.groups):
+                    if point in group.points:
+                        i = group.points.index(point)
+                        break
                 write_line("Point {0} in enemy point group {1} has link {2}; No other point has link {2}".format(
                     i, group_index, point.link
                 ))
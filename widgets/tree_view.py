@@ -207,6 +207,7 @@ class LevelDataTreeView(QTreeWidget):
     duplicate = pyqtSignal(ObjectGroup)
     split = pyqtSignal(EnemyPointGroup, EnemyRoutePoint)
     split_checkpoint = pyqtSignal(CheckpointGroup, Checkpoint)
+    ground_all = pyqtSignal(ObjectGroup)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args)
@@ -269,6 +270,7 @@ class LevelDataTreeView(QTreeWidget):
             context_menu = QMenu(self)
             select_all_action = QAction("Select All", self)
             reverse_action = QAction("Reverse", self)
+            ground_all_action = QAction("Ground All", self)
 
             def emit_current_selectall():
                 item = self.itemAt(pos)
@@ -278,13 +280,17 @@ class LevelDataTreeView(QTreeWidget):
                 item = self.itemAt(pos)
                 self.reverse.emit(item)
 
-
+            def emit_current_ground_all():
+                item = self.itemAt(pos)
+                self.ground_all.emit(item)
 
             select_all_action.triggered.connect(emit_current_selectall)
             reverse_action.triggered.connect(emit_current_reverse)
+            ground_all_action.triggered.connect(emit_current_ground_all)
 
             context_menu.addAction(select_all_action)
             context_menu.addAction(reverse_action)
+            context_menu.addAction(ground_all_action)
 
             if isinstance(item, EnemyPointGroup):
                 def emit_current_duplicate():
@@ -298,6 +304,25 @@ class LevelDataTreeView(QTreeWidget):
             context_menu.exec(self.mapToGlobal(pos))
             context_menu.destroy()
             del context_menu
+        elif item in self.positioned_sections():
+            context_menu = QMenu(self)
+            ground_all_action = QAction("Ground All", self)
+
+            def emit_current_ground_all():
+                item = self.itemAt(pos)
+                self.ground_all.emit(item)
+
+            ground_all_action.triggered.connect(emit_current_ground_all)
+
+            context_menu.addAction(ground_all_action)
+            context_menu.exec(self.mapToGlobal(pos))
+            context_menu.destroy()
+            del context_menu
+
+    def positioned_sections(self):
+        # Top level items of the sections whose entries have positions
+        return (self.enemyroutes, self.checkpointgroups, self.objectroutes, self.objects,
+                self.kartpoints, self.areas, self.cameras, self.respawnpoints)
 
     def _add_group(self, name, customgroup=None):
         if customgroup is None: